@@ -18,7 +18,7 @@
 # Contact: ivana.mihalek@gmail.com
 #
 
-# Note: this is really slow, but assumed to be run only once - during the installation
+# Note: this is assumed to be run only once - during the installation
 
 # for the  ICGC v27 the search for the longest entry  comes up with the following
 
@@ -35,13 +35,15 @@
 
 import os
 from config import Config
+from icgc_utils.somatic_tsv import *
 
 #########################################
+# unzipped by 05_unzip or not
 def get_simple_somatic_tsv_files(data_home_local):
 	tsv_files = []
 	for root, dirs, files in os.walk(data_home_local):
 		for file in files:
-			if file.endswith(".tsv") and 'simple_somatic' in file:
+			if file.endswith((".tsv", ".tsv.gz")) and 'simple_somatic' in file:
 				tsv_files.append(os.path.join(root, file))
 	return tsv_files
 
@@ -53,34 +55,21 @@ def main():
 
 	field_groups = {
 		'alleles':      ['reference_genome_allele', 'mutated_from_allele', 'mutated_to_allele'],
-		'genotypes':    ['control_genotype', 'tumour_genotype', 'control_genotype'],
+		'genotypes':    ['control_genotype', 'tumour_genotype'],
 		'gene_names':   ['gene_affected', 'transcript_affected'],
 		'aa_mutation':  ['aa_mutation'],
 		'cds_mutation': ['cds_mutation']
 	}
+	columns = sorted(set(sum(field_groups.values(), [])))
 
-	max_allele_length = {}
-	for field_group in field_groups.keys():
-		max_allele_length[field_group] = 0
-
+	# the files are read in blocks, and only the columns we look at
+	stats = FieldStats()
 	for tf in tsv_files:
 		print(tf)
-		infile = open(tf,'r')
-		headers = None
-		for line in infile:
-			if not headers:
-				headers = line.rstrip('\n').split('\t')
-			else:
-				fields = line.rstrip('\n').split('\t')
-				field_named = dict(list(zip(headers, fields)))
-				for field_group, field_names in field_groups.items():
-					for name in field_names:
-						if len(field_named[name])>max_allele_length[field_group]:
-							max_allele_length[field_group] = len(field_named[name])
-		infile.close()
+		scan_somatic_file(tf, stats=stats, columns=columns)
 
-	for field_group in field_groups.keys():
-		print(field_group, max_allele_length[field_group])
+	for field_group, field_names in field_groups.items():
+		print(field_group, max([stats.max_length.get(name, 0) for name in field_names]))
 
 #########################################
 if __name__ == '__main__':
@@ -0,0 +1,100 @@
+#! /usr/bin/python3
+#
+# This source code is part of icgc, an ICGC processing pipeline.
+#
+# Icgc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Icgc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see<http://www.gnu.org/licenses/>.
+#
+# Contact: ivana.mihalek@gmail.com
+#
+
+# one pass over the simple somatic files of the release, one file per unit of work:
+# the types, widths, null rates and value counts of the temp table columns, and the row counts
+# the result goes to <data_home_local>/schema_manifest.json (see icgc_utils/schema_manifest.py),
+# and 06_make_tables.py sizes the temp tables from it
+# the per-file results are kept in schema_manifest_parts/, so with --resume a rerun after a crash
+# only scans the files it did not get to
+
+import os, json, time
+
+from icgc_utils.processes import *
+from icgc_utils.ledger import stage_ledger
+from icgc_utils.progress import progress_tick
+from icgc_utils.somatic_tsv import *
+from icgc_utils.schema_manifest import *
+from config import Config
+
+parts_dir = "schema_manifest_parts"
+
+#########################################
+def part_path(path):
+	return "{}/{}.json".format(parts_dir, path[len(Config.data_home_local)+1:].replace("/", "."))
+
+
+#########################################
+# as they come or unzipped, but not both
+def release_somatic_files(cancer_type):
+	gz_files = somatic_files(Config.data_home_local, cancer_type, suffix=".tsv.gz")
+	if gz_files: return gz_files
+	return somatic_files(Config.data_home_local, cancer_type, suffix=".tsv")
+
+
+#########################################
+def scan_files(paths, other_args):
+	for path in paths:
+		time0 = time.time()
+		stats = FieldStats()
+		scan_somatic_file(path, table_stats=stats)
+		# the first thing after the storage path is the cancer name
+		cancer_type = path[len(Config.data_home_local)+1:].split("/")[0]
+		part = {'cancer_type':cancer_type, 'bytes':os.path.getsize(path), 'stats':stats.to_dict()}
+		with open(part_path(path)+".tmp", "w") as outf:
+			json.dump(part, outf)
+		os.replace(part_path(path)+".tmp", part_path(path))
+		progress_tick(stats.rows)
+		print("%s: %d rows in %.1f mins, pid %d" % (path, stats.rows, (time.time()-time0)/60, os.getpid()))
+
+
+#########################################
+def main():
+
+	cancer_types = []
+	for name in os.listdir(Config.data_home_local):
+		if os.path.isdir("/".join([Config.data_home_local,name])): cancer_types.append(name)
+
+	paths = []
+	for ct in cancer_types: paths += release_somatic_files(ct)
+	file_size = [os.path.getsize(path) for path in paths]
+	if not os.path.exists(parts_dir): os.mkdir(parts_dir)
+
+	# no db here; the memory is in the blocks being parsed
+	# a part is replaced in one go, so a file that failed half way can simply be scanned again
+	number_of_chunks = worker_count(len(paths), memory_per_worker=1)
+	parallelize(number_of_chunks, scan_files, paths, [],
+				strategy='queue', weights=file_size, ledger=stage_ledger(), retries=1)
+
+	file_parts = {}
+	for path in paths:
+		with open(part_path(path)) as inf:
+			file_parts[path] = json.load(inf)
+	manifest = build_manifest(Config.icgc_release, file_parts)
+	print("%d rows in %d files; manifest written to %s" % (manifest['rows'], len(paths),
+			write_manifest(Config.data_home_local, manifest)))
+	for name, column in manifest['tables']['simple_somatic_temp']['columns'].items():
+		print("\t %-28s %-14s max length %4d  nulls %.3f  distinct %s" % (name, column['type'], column['max_length'],
+				column['null_rate'], column['distinct'] if column['distinct'] is not None else "many"))
+
+
+#########################################
+if __name__ == '__main__':
+	main()
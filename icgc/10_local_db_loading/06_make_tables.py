@@ -20,6 +20,7 @@
 
 from icgc_utils.mysql import  *
 from icgc_utils.icgc  import  *
+from icgc_utils.schema_manifest import read_manifest
 from config import Config
 
 #########################################
@@ -37,11 +38,13 @@ def main():
 	db     = connect_to_mysql(Config.mysql_conf_file)
 	cursor = db.cursor()
 
+	# sized from the data if 05a_schema_manifest.py was run, by hand otherwise
+	manifest = read_manifest(Config.data_home_local)
 	db_name =  "icgc"
 	for ct in cancer_types:
 		# note 'temp' here - we'll reroganize when we get to TCGA
 		mutations_table = ct + "_simple_somatic_temp"
-		make_temp_somatic_muts_table(cursor, db_name, mutations_table)
+		make_temp_somatic_muts_table(cursor, db_name, mutations_table, manifest)
 		donors_table = ct + "_donor"
 		make_donors_table(cursor, db_name, donors_table)
 		specimen_table = ct + "_specimen"
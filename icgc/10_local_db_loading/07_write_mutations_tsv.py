@@ -20,10 +20,12 @@
 
 # just spit out the select columns ans slurp them into database
 
-import os, subprocess
+import os, sys, subprocess
 from subprocess import PIPE
 from icgc_utils.mysql import *
 from icgc_utils.processes import *
+from icgc_utils.somatic_tsv import *
+from icgc_utils.schema_manifest import read_manifest, manifest_row_counts
 
 # import the produced fields using mysqlimport
 # mysqlimport db_name table_name.ext
@@ -39,17 +41,23 @@ from icgc_utils.processes import *
 #########################################
 from config import Config
 
+# off by default: the rows of each simple somatic file are appended to tsvs/<ct>_simple_somatic_temp.tsv as they come
+# with sort_by_position (or run with --sort-by-position) the rows are sorted by (chromosome, start_position),
+# with the ids in that order, so that 09_load_mysql builds the indices on clustered data; note that then
+#   - tsvs/<ct>_simple_somatic_temp.tsv is written from scratch, for all files of the cancer type at once
+#   - the sort is external, in runs of sort_run_rows rows (~1GB of memory for 500k rows, 1.5GB per worker)
+#   - the runs go to a temporary directory in tsvs/, removed when the cancer type is done (but not after a crash)
+sort_by_position = False
+sort_run_rows = 500000
 
 def get_simple_somatic_tsv_files(data_home_local, cancer_types):
 	tsv_files = []
 	outstr = ""
 	for ct in cancer_types:
 		outstr += ct + "\n"
-		for root, dirs, files in os.walk("{}/{}".format(data_home_local,ct)):
-			for file in files:
-				if file.endswith(".tsv") and 'simple_somatic' in file:
-					outstr += "\t" + os.path.join(root, file)  + "\n"
-					tsv_files.append(os.path.join(root, file))
+		for path in somatic_files(data_home_local, ct):
+			outstr += "\t" + path  + "\n"
+			tsv_files.append(path)
 		print("{} writing:\n{}".format(os.getpid(), outstr))
 	return tsv_files
 
@@ -66,48 +74,42 @@ def appendopen(original_tsv_file):
 
 	return open(outname,'a'), last_id
 
+#########################################
+def report_too_long(source, stats):
+	too_long = ["%s %d>%d" % (name, stats.max_length[name], width) for name, width in temp_table_widths.items()
+					if stats.max_length.get(name, 0)>width]
+	if too_long: print("\t %s: fields too long for the temp table (will be truncated): %s" % (source, ", ".join(too_long)))
+
+
+#########################################
+# all files for the cancer type in one sorted tsv, written from scratch
+def write_sorted_tsv(cancer_type):
+	tsv_files = get_simple_somatic_tsv_files(Config.data_home_local, [cancer_type])
+	outname = "tsvs/"+cancer_type+"_simple_somatic_temp.tsv"
+	stats = FieldStats()
+	with open(outname, 'w') as outfile:
+		for row in position_sorted_rows(tsv_files, stats=stats, run_rows=sort_run_rows, tmpdir="tsvs"):
+			outfile.write(somatic_line(row[0], row[1:]))
+	report_too_long(cancer_type, stats)
+
+
 #########################################
 def write_tsvs(cancer_types, other_args):
 
+	if other_args and other_args[0]:
+		for ct in cancer_types: write_sorted_tsv(ct)
+		return
 
 	tsv_files = get_simple_somatic_tsv_files(Config.data_home_local, cancer_types)
 
-	# the full set of the header fields can be found by (for example)
-	# head -n1 simple_somatic_mutation.controlled.ALL-US.tsv | sed 's/\t/,/g'
-	# this correposnds to the subset we want to store
-	names = "icgc_mutation_id,icgc_donor_id,icgc_specimen_id,icgc_sample_id,submitted_sample_id,chromosome,chromosome_start," \
-	"chromosome_end,chromosome_strand,assembly_version,mutation_type,reference_genome_allele,control_genotype,tumour_genotype,"\
-	"mutated_from_allele,mutated_to_allele,consequence_type,aa_mutation,cds_mutation," \
-	"gene_affected,transcript_affected,total_read_count,mutant_allele_read_count".split(",")
-
 	for tf in tsv_files:
 		print(tf)
-		infile  = open(tf,'r')
 		outfile, last_id = appendopen(tf)
-		headers = None
-		id = last_id
-
-		for line in infile:
-			if not headers:
-				headers = line.rstrip('\n').split('\t')
-			else:
-				fields = line.rstrip('\n').split('\t')
-				field_named = dict(list(zip(headers, fields)))
-				id += 1
-				new_fields = [str(id)]
-				# some fixing
-				field_named['mutation_type']    = field_named['mutation_type'].split(" ")[0]
-				field_named['consequence_type'] = field_named['consequence_type'].replace("_variant","").replace("_gene","")
-				for name in ["total_read_count","mutant_allele_read_count"]:
-					tmp = field_named[name].replace(" ","")
-					if len(tmp)==0: tmp = "\\N"
-					field_named[name] = tmp
-				for name in names:
-					new_fields.append(field_named[name])
-				outfile.write("\t".join(new_fields) + "\n")
-
-		infile.close()
+		# the field lengths come for free, in the same pass
+		stats = FieldStats()
+		scan_somatic_file(tf, stats=stats, outfile=outfile, last_id=last_id)
 		outfile.close()
+		report_too_long(tf, stats)
 
 #########################################
 def main():
@@ -129,8 +131,16 @@ def main():
 	cursor.close()
 	db.close()
 
-	number_of_chunks = 10  # myISAM does not deadlock
-	parallelize(number_of_chunks, write_tsvs, cancer_types, [])
+	sort = sort_by_position or "--sort-by-position" in sys.argv[1:]
+	# reading and writing files, block by block - little memory (unless sorting), no db connections
+	number_of_chunks = worker_count(len(cancer_types), memory_per_worker=1.5 if sort else 0.5)
+	# the biggest cancer types first, if the schema manifest (05a_schema_manifest.py) has the row counts
+	row_counts = manifest_row_counts(read_manifest(Config.data_home_local))
+	if all([ct in row_counts for ct in cancer_types]):
+		parallelize(number_of_chunks, write_tsvs, cancer_types, [sort],
+					strategy='queue', weights=[row_counts[ct] for ct in cancer_types])
+	else:
+		parallelize(number_of_chunks, write_tsvs, cancer_types, [sort])
 
 
 
@@ -0,0 +1,105 @@
+#! /usr/bin/python3
+#
+# This source code is part of icgc, an ICGC processing pipeline.
+#
+# Icgc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Icgc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see<http://www.gnu.org/licenses/>.
+#
+# Contact: ivana.mihalek@gmail.com
+#
+
+# the same as 05_unzip + 07_write_mutations_tsv + 09_load_mysql (for the simple somatic tables),
+# without the unzipped files and without the tsvs in between:
+# each simple_somatic_mutation.open.*.tsv.gz is decompressed, trimmed to the columns we keep,
+# fixed, and sent straight into 'load data local infile' through a named pipe (stream_load in mysql.py)
+# one cancer type per unit of work, so several tables are loading at the same time
+# the temp tables should exist (06_make_tables.py); donor and specimen still go through 08 and 09
+
+import os, time
+
+from icgc_utils.mysql import *
+from icgc_utils.processes import *
+from icgc_utils.ledger import stage_ledger
+from icgc_utils.progress import progress_tick
+from icgc_utils.somatic_tsv import *
+from icgc_utils.schema_manifest import read_manifest, manifest_row_counts
+from config import Config
+
+# the rows sorted by (chromosome, start_position) across all files of the cancer type, as in 07_write_mutations_tsv;
+# off by default here: above sort_run_rows rows the sort needs temporary run files (in the working directory)
+sort_by_position = False
+sort_run_rows = 500000
+
+#########################################
+def stream_cancer_type(cursor, cancer_type):
+	table = "%s_simple_somatic_temp" % cancer_type
+	# a unit that failed half way is rerun from scratch
+	search_db(cursor, "truncate table %s" % table)
+	if sort_by_position:
+		gz_files = somatic_files(Config.data_home_local, cancer_type, suffix=".tsv.gz")
+		rows = position_sorted_rows(gz_files, run_rows=sort_run_rows, tmpdir=os.getcwd())
+		rows_sent = stream_load(cursor, table, temp_table_columns, rows)
+		progress_tick(rows_sent)
+		return rows_sent
+	last_id = 0
+	for gz_file in somatic_files(Config.data_home_local, cancer_type, suffix=".tsv.gz"):
+		time0 = time.time()
+		counter = [last_id]
+		rows_sent = stream_load(cursor, table, temp_table_columns, somatic_rows(gz_file, last_id, counter))
+		last_id = counter[0]
+		progress_tick(rows_sent)
+		print("\t %s: %d rows from %s in %.1f mins" % (table, rows_sent, os.path.basename(gz_file), (time.time()-time0)/60))
+	return last_id
+
+
+#########################################
+def stream_tables(cancer_types, other_args):
+	with pooled_cursor(Config.mysql_conf_file, "icgc") as cursor:
+		for cancer_type in cancer_types:
+			time0 = time.time()
+			rows = stream_cancer_type(cursor, cancer_type)
+			print("%s: %d rows loaded in %.1f mins, pid %d" % (cancer_type, rows, (time.time()-time0)/60, os.getpid()))
+	return
+
+
+#########################################
+def main():
+
+	db     = connect_to_mysql(Config.mysql_conf_file)
+	cursor = db.cursor()
+
+	switch_to_db(cursor,"icgc")
+	qry  = "select table_name from information_schema.tables "
+	qry += "where table_schema='icgc' and table_name like '%simple_somatic_temp'"
+	cancer_types = [field[0].split("_")[0] for field in  search_db(cursor,qry)]
+
+	# the row counts from the schema manifest (05a_schema_manifest.py) if we have them,
+	# otherwise the compressed size is good enough as the estimate of the work
+	row_counts = manifest_row_counts(read_manifest(Config.data_home_local))
+	if all([ct in row_counts for ct in cancer_types]):
+		weights = [row_counts[ct] for ct in cancer_types]
+	else:
+		weights = [sum([os.path.getsize(f) for f in somatic_files(Config.data_home_local, ct, suffix=".tsv.gz")])
+					for ct in cancer_types]
+	# the decompression is on our side, the parsing of the rows on the mysql side
+	number_of_chunks = worker_count(len(cancer_types), cursor=cursor, memory_per_worker=1.5 if sort_by_position else 0.2)
+	cursor.close()
+	db.close()
+
+	parallelize(number_of_chunks, stream_tables, cancer_types, [],
+				strategy='queue', weights=weights, ledger=stage_ledger(), retries=1)
+
+
+#########################################
+if __name__ == '__main__':
+	main()
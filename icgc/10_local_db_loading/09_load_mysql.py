@@ -19,6 +19,7 @@
 #
 from config import Config
 from icgc_utils.mysql   import  *
+from icgc_utils.icgc    import  temp_table_indices
 
 
 #########################################
@@ -41,7 +42,15 @@ def main():
 		for filetype in ["simple_somatic_temp", "donor", "specimen"]:
 			table = "{}_{}".format(ct, filetype)
 			qry = "load data local infile 'tsvs/%s.tsv' into table %s" % (table,table)
-			search_db(cursor,qry,verbose=True)
+			if filetype!="simple_somatic_temp":
+				search_db(cursor,qry,verbose=True)
+				continue
+			# the indices go on the empty table, and are built once the data is in, one sort per index
+			# (cheaper still if 07_write_mutations_tsv was run with --sort-by-position: the data is mostly in order already)
+			# (10_make_indices_on_temp_tables then finds them there and moves on)
+			create_indices(cursor, db_name, table, temp_table_indices)
+			with keys_disabled(cursor, db_name, table):
+				search_db(cursor,qry,verbose=True)
 
 	cursor.close()
 	db.close()
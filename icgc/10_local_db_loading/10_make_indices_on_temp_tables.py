@@ -22,31 +22,18 @@ import time
 
 from config import Config
 from icgc_utils.mysql   import  *
+from icgc_utils.icgc    import  temp_table_indices
 from icgc_utils.processes import *
+from icgc_utils.ledger import stage_ledger
 
+# all in one alter table (see create_indices in mysql.py): the table is rebuilt once, not six times
 def make_indices(tables, other_args):
-	db     = connect_to_mysql(Config.mysql_conf_file)
-	cursor = db.cursor()
-
-	switch_to_db(cursor,"icgc")
-	for table in tables:
-		print(table)
-		time0 = time.time()
-		qry  = "create index somatic_mut_idx on %s (icgc_mutation_id)" % table
-		search_db(cursor,qry,verbose=True)
-		qry  = "create index somatic_donor_idx on %s (icgc_donor_id)" % table
-		search_db(cursor,qry,verbose=True)
-		qry  = "create index sample_idx on %s (submitted_sample_id)" % table
-		search_db(cursor,qry,verbose=True)
-		qry  = "create index mut_gene_idx on %s (icgc_mutation_id, gene_affected)" %  table
-		search_db(cursor,qry,verbose=True)
-		qry  =  "create index chrom_start_pos_idx on %s (chromosome, start_position)" % table
-		search_db(cursor, qry, verbose=True)
-		qry  =  "create index chrom_end_pos_idx on %s (chromosome, end_position)" % table
-		search_db(cursor, qry, verbose=True)
-		print(("\t\t  %s done in %.3f mins" % (table, float(time.time()-time0)/60)))
-	cursor.close()
-	db.close()
+	with pooled_cursor(Config.mysql_conf_file, "icgc") as cursor:
+		for table in tables:
+			print(table)
+			time0 = time.time()
+			create_indices(cursor, "icgc", table, temp_table_indices, verbose=True)
+			print(("\t\t  %s done in %.3f mins" % (table, float(time.time()-time0)/60)))
 
 
 #########################################
@@ -63,11 +50,17 @@ def main():
 	qry  = "select table_name from information_schema.tables "
 	qry += "where table_schema='icgc' and table_name like '%simple_somatic_temp'"
 	tables = [field[0] for field in  search_db(cursor,qry)]
+	table_size = get_table_size(cursor, "icgc", tables, as_list=True)
+	# each alter table copies its table and sorts the keys: the disk is the limit,
+	# hence a handful of workers, not one per core (unless set by hand in Config.worker_counts)
+	number_of_chunks = stage_worker_override() or min(4, worker_count(len(tables), cursor=cursor, memory_per_worker=2))
 	cursor.close()
 	db.close()
 
-	number_of_chunks = 1
-	parallelize(number_of_chunks, make_indices, tables, [])
+	# the big tables first; with --resume, the tables done in the previous run are skipped
+	# (create_indices skips the indices that exist already in any case)
+	parallelize(number_of_chunks, make_indices, tables, [],
+				strategy='queue', weights=table_size, ledger=stage_ledger(), retries=1)
 
 #########################################
 if __name__ == '__main__':
@@ -40,10 +40,9 @@ def make_ensembl_coding_seqs_table(cursor, db_name, table_name):
 	print(rows)
 	return
 
-def store_seq (cursor, table_name, transcript_id, sequence):
+def store_seq (writer, table_name, transcript_id, sequence):
 	if transcript_id and len(sequence)>0:
-		qry = "insert into %s (transcript_id, sequence) values ('%s','%s')" % (table_name, transcript_id,  "".join(sequence))
-		search_db(cursor, qry, verbose=False)
+		writer.add(table_name, {'transcript_id':transcript_id, 'sequence':"".join(sequence)})
 
 
 #########################################
@@ -62,15 +61,18 @@ def main():
 	inf = open(ens_seq_file, "r")
 	transcript_id = None
 	sequence=[]
-	for line in inf:
-		if line[0]=='>':
-			store_seq (cursor, table_name, transcript_id, sequence)
-			transcript_id = line.strip()[1:]
-			sequence=[]
-		else:
-			sequence.append(line.strip())
+	# the sequences are a few kb each, so keep the batches modest (max_allowed_packet)
+	with BulkWriter(cursor, flush_size=500) as writer:
+		for line in inf:
+			if line[0]=='>':
+				store_seq (writer, table_name, transcript_id, sequence)
+				transcript_id = line.strip()[1:]
+				sequence=[]
+			else:
+				sequence.append(line.strip())
 
-	store_seq (cursor, table_name, transcript_id, sequence)
+		store_seq (writer, table_name, transcript_id, sequence)
+	inf.close()
 
 	cursor.close()
 	db.close()
@@ -70,20 +70,15 @@ def reorganize_variants(cursor, orig_icgc_table):
 #########################################
 def reorganize(tables, other_args):
 
-	db     = connect_to_mysql(Config.mysql_conf_file)
-	cursor = db.cursor()
-	switch_to_db(cursor,"icgc")
-	for table in tables:
-
-		time0 = time.time()
-		print("====================")
-		print("reorganizing variants from ", table, os.getpid())
-		reorganize_variants(cursor, table)
-		time1 = time.time()
-		print(("\t\t %s (%d) done in %.3f mins" % (table, tables.index(table),  float(time1-time0)/60)), os.getpid())
+	with pooled_cursor(Config.mysql_conf_file, "icgc") as cursor:
+		for table in tables:
 
-	cursor.close()
-	db.close()
+			time0 = time.time()
+			print("====================")
+			print("reorganizing variants from ", table, os.getpid())
+			reorganize_variants(cursor, table)
+			time1 = time.time()
+			print(("\t\t %s (%d) done in %.3f mins" % (table, tables.index(table),  float(time1-time0)/60)), os.getpid())
 
 	return
 
@@ -111,7 +106,7 @@ def main():
 	tables_mirrored  = tables_sorted[0:half] + list(reversed(tables_sorted[half:]))
 	number_of_chunks = half
 
-	parallelize(number_of_chunks, reorganize, tables_mirrored, [], round_robin=True)
+	parallelize(number_of_chunks, reorganize, tables_mirrored, [], strategy='queue', weights=table_size)
 
 
 
@@ -73,7 +73,7 @@ def main():
 	tables_mirrored  = tables_sorted[0:half] + list(reversed(tables_sorted[half:]))
 	number_of_chunks = int(half/2)
 
-	parallelize(number_of_chunks, delete_normal, tables_mirrored, [], round_robin=True)
+	parallelize(number_of_chunks, delete_normal, tables_mirrored, [], strategy='queue', weights=table_size)
 
 
 
@@ -57,17 +57,13 @@ pathogenic = {'stop_lost', 'inframe_deletion', 'inframe_insertion', 'stop_gained
 
 
 #########################################
-def insert (cursor, table, columns, values):
+def insert (writer, table, columns, values):
 
-	nonempty_values = []
-	corresponding_columns = []
+	nonempty_fields = {}
 	for i in range(len(values)):
-		if not values[i] or  values[i] == "": continue
-		nonempty_values.append(values[i])
-		corresponding_columns.append(columns[i])
-	qry = "insert into %s (%s) " %(table, ",".join(corresponding_columns))
-	qry += "values (%s) " % ",".join(nonempty_values)
-	search_db(cursor, qry)
+		if values[i] is None or values[i] == "": continue
+		nonempty_fields[columns[i]] = values[i]
+	writer.add(table, nonempty_fields)
 
 
 
@@ -90,6 +86,9 @@ def reorganize_mutations(cursor, chromosome, somatic_temp_table, columns):
 	print("\t\t\t total mutations on chrom {} in {}: {}".format(chromosome, somatic_temp_table, totmut))
 	ct = 0
 	time0 = time.time()
+	# the mutations are distinct within the table, so we can hold on to the
+	# inserts until we are done with the table, without compromising entry_exists() below
+	writer = BulkWriter(cursor, flush_size=5000)
 	for mutation in mutations:
 		ct += 1
 		if ct%10000 == 0:
@@ -110,7 +109,7 @@ def reorganize_mutations(cursor, chromosome, somatic_temp_table, columns):
 			named_field = dict(list(zip(columns,fields)))
 
 			if not mutation_values: # we need to set this only once
-				mutation_values = [quotify(named_field[name]) for name in mutation_columns]
+				mutation_values = [named_field[name] for name in mutation_columns]
 				if entry_exists(cursor, "icgc", mutation_table, "icgc_mutation_id", quotify(mutation)):
 					skip = True
 					continue
@@ -142,38 +141,35 @@ def reorganize_mutations(cursor, chromosome, somatic_temp_table, columns):
 			print("chromosome not assigned for %s (!?)" % mutation)
 			exit()
 
-		mutation_values.append(quotify(";".join(list(aa_mutations))))
-		mutation_values.append(quotify(";".join(list(conseqs))))
+		mutation_values.append(";".join(list(aa_mutations)))
+		mutation_values.append(";".join(list(conseqs)))
 		if len(conseqs&pathogenic)>0:
-			mutation_values.append("1")
+			mutation_values.append(1)
 		else:
-			mutation_values.append("0")
+			mutation_values.append(0)
 
 		# now we are ready to store
-		insert(cursor, mutation_table, mutation_columns + ['aa_mutation','consequence', 'pathogenicity_estimate'], mutation_values)
+		insert(writer, mutation_table, mutation_columns + ['aa_mutation','consequence', 'pathogenicity_estimate'], mutation_values)
+
+	writer.flush()
 
 #########################################
 def reorganize(chromosomes, other_args):
 
-	db     = connect_to_mysql(Config.mysql_conf_file)
-	cursor = db.cursor()
-	switch_to_db(cursor,"icgc")
 	somatic_temp_tables  = other_args[0]
 	columns = other_args[1]
 
-	for chrom in chromosomes:
-		time0 = time.time()
-		print("====================")
-		print("reorganizing mutations on chromosome ", chrom, os.getpid())
-		for somatic_temp_table in somatic_temp_tables:
-			reorganize_mutations(cursor, chrom, somatic_temp_table, columns)
-		time1 = time.time()
-		print(("\t\t chromosome %s done in %.3f mins" % (chrom, float(time1-time0)/60)), os.getpid())
+	with pooled_cursor(Config.mysql_conf_file, "icgc") as cursor:
+		for chrom in chromosomes:
+			time0 = time.time()
+			print("====================")
+			print("reorganizing mutations on chromosome ", chrom, os.getpid())
+			for somatic_temp_table in somatic_temp_tables:
+				reorganize_mutations(cursor, chrom, somatic_temp_table, columns)
+			time1 = time.time()
+			print(("\t\t chromosome %s done in %.3f mins" % (chrom, float(time1-time0)/60)), os.getpid())
 
 
-	cursor.close()
-	db.close()
-
 	return
 
 
@@ -195,13 +191,15 @@ def main():
 	qry = "select column_name from information_schema.columns where table_name='%s'"%tables[0]
 	columns = [field[0] for field in  search_db(cursor,qry)]
 
+	chromosomes = [str(i) for i in range(1,23)] + ["X","Y"]
+	number_of_chunks = worker_count(len(chromosomes), cursor=cursor, memory_per_worker=1)  # myISAM does not deadlock
+
 	cursor.close()
 	db.close()
 
-	chromosomes = [str(i) for i in range(1,13)] + ["Y"] + [str(i) for i in range(22,12,-1)] + ["X"]
-	number_of_chunks = 12  # myISAM does not deadlock
-
-	parallelize(number_of_chunks, reorganize, chromosomes, [tables,columns], round_robin=True)
+	# the workers pick up the next chromosome as soon as they are done with the previous one;
+	# the mutations_chrom tables are empty at this point, so the order is the hint: roughly the largest first
+	parallelize(number_of_chunks, reorganize, chromosomes, [tables,columns], strategy='queue')
 
 
 
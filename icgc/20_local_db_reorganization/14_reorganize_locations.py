@@ -56,10 +56,10 @@ def describe_position(cursor, chrom, position, target_range):
 	position -= 1 # UCSC labels positions from 0
 	qry = "select ens_gene_id, ens_transcript_id, cds_start, cds_end, exon_count, exon_starts, exon_ends "
 	qry += "from coords_chrom_%s " % chrom
-	qry += "where tx_start between %d and %d " %(position-target_range, position+target_range)
-	qry += "and %d between tx_start and tx_end " % position # 2 min
+	qry += "where tx_start between %s and %s "
+	qry += "and %s between tx_start and tx_end " # 2 min
 
-	ret = search_db (cursor, qry)
+	ret = search_db (cursor, qry, args=[position-target_range, position+target_range, position])
 	if not ret:
 		return [None, None]
 	gene_relative_set = set()
@@ -169,30 +169,28 @@ def reorganize_locations(cursor, ref_assembly, chromosome, somatic_temp_tables):
 #########################################
 def reorganize(chromosomes, other_args):
 
-	db     = connect_to_mysql(Config.mysql_conf_file)
-	cursor = db.cursor()
-	switch_to_db(cursor,"icgc")
 	ref_assembly = other_args[0]
 	somatic_temp_tables = other_args[1]
 	home = os.getcwd()
 
-	for chrom in chromosomes:
+	with pooled_cursor(Config.mysql_conf_file, "icgc") as cursor:
+		for chrom in chromosomes:
 
-		# make a workdir and move there
-		workdir  = "chrom_%s" % chrom
-		workpath = "{}/locations/{}".format(home,workdir)
-		if not os.path.exists(workpath): os.makedirs(workpath)
-		os.chdir(workpath)
+			# make a workdir and move there
+			workdir  = "chrom_%s" % chrom
+			workpath = "{}/locations/{}".format(home,workdir)
+			if not os.path.exists(workpath): os.makedirs(workpath)
+			os.chdir(workpath)
 
-		time0 = time.time()
-		print("====================")
-		print("reorganizing locations for chrom %s, pid %d" % (chrom, os.getpid()))
-		reorganize_locations(cursor, ref_assembly, chrom, somatic_temp_tables)
-		time1 = time.time()
-		print(("chrom %s  done in %.3f mins" % (chrom, float(time1-time0)/60)), os.getpid())
+			time0 = time.time()
+			print("====================")
+			print("reorganizing locations for chrom %s, pid %d" % (chrom, os.getpid()))
+			reorganize_locations(cursor, ref_assembly, chrom, somatic_temp_tables)
+			time1 = time.time()
+			print(("chrom %s  done in %.3f mins" % (chrom, float(time1-time0)/60)), os.getpid())
 
-	cursor.close()
-	db.close()
+	# with the queue strategy, the next chromosome comes in another call
+	os.chdir(home)
 
 	return
 
@@ -212,13 +210,16 @@ def main():
 	qry  = "select table_name from information_schema.tables "
 	qry += "where table_schema='icgc' and table_name like '%simple_somatic_temp'"
 	somatic_temp_tables = [field[0] for field in  search_db(cursor,qry)]
+	chromosomes = [str(i) for i in range(1,23)] + ["X","Y"]
+	# the number of mutations per chromosome tells us which ones are going to take the longest
+	chrom_size = get_table_size(cursor, 'icgc', ["mutations_chrom_%s" % c for c in chromosomes], as_list=True)
+	# a worker keeps the locations for one chromosome in memory
+	number_of_chunks = worker_count(len(chromosomes), cursor=cursor, memory_per_worker=2)  # myISAM does not deadlock
 	cursor.close()
 	db.close()
 
-	chromosomes = [str(i) for i in range(1,13)] + ["Y"] + [str(i) for i in range(22,12,-1)] + ["X"]
-	number_of_chunks = 12  # myISAM does not deadlock
-
-	parallelize(number_of_chunks, reorganize, chromosomes, [ref_assembly, somatic_temp_tables], round_robin=True)
+	parallelize(number_of_chunks, reorganize, chromosomes, [ref_assembly, somatic_temp_tables],
+				strategy='queue', weights=chrom_size)
 
 
 #########################################
@@ -53,6 +53,7 @@ def fix_pathogenicity(chromosomes, other_args):
 		print("processing icgc table ", mutations_table, os.getpid())
 		qry  = "select icgc_mutation_id, start_position from icgc.%s " % mutations_table
 		qry += "where pathogenicity_estimate=0"
+		revised = []
 		for icgc_mutation_id, start_position in search_db(cursor,qry, verbose=True):
 			locations_table = "locations_chrom_%s"%chrom
 			qry2 = "select transcript_relative from icgc.%s " % locations_table
@@ -70,10 +71,8 @@ def fix_pathogenicity(chromosomes, other_args):
 						#print("tr_relative", tr_relative)
 						break
 			if p_estimate_revised: # if the revision needed, proceed
-				qry3  = "update icgc.%s " %  mutations_table
-				qry3 += "set pathogenicity_estimate=1 "
-				qry3 += "where icgc_mutation_id='%s' " %  icgc_mutation_id
-				search_db(cursor,qry3, verbose=False)
+				revised.append({'icgc_mutation_id':icgc_mutation_id, 'pathogenicity_estimate':1})
+		bulk_update(cursor, "icgc.%s" % mutations_table, ['icgc_mutation_id'], revised)
 
 	cursor.close()
 	db.close()
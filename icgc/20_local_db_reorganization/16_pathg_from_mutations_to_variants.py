@@ -107,7 +107,7 @@ def main():
 	shuffle(tables_sorted) # so called 'lazy load balancing'
 	number_of_chunks = 8
 
-	parallelize(number_of_chunks, fix_pathogenicity,  tables_sorted, [chromosomes], round_robin=True)
+	parallelize(number_of_chunks, fix_pathogenicity,  tables_sorted, [chromosomes], strategy='queue', weights=table_size)
 
 
 
@@ -17,9 +17,11 @@
 # 
 # Contact: ivana.mihalek@gmail.com
 #
+import time
 from config import Config
 from icgc_utils.common_queries  import  *
 from icgc_utils.processes   import  *
+from icgc_utils.ledger import stage_ledger
 
 
 #########################################
@@ -35,28 +37,22 @@ from icgc_utils.processes   import  *
 def remove_duplicates(table_rows, other_args, verbose=False):
 
 	table  = other_args[0]
-	db     = connect_to_mysql(Config.mysql_conf_file)
-	cursor = db.cursor()
-	switch_to_db(cursor,"icgc")
-
-	# loop over all duplicate entries
-	for line in table_rows:
-		[mega_id, ct] = line
-		if not mega_id: continue # we do not have one of the IDs (happens with TCGA)
-		[icgc_mutation_id, icgc_donor_id, icgc_specimen_id, icgc_sample_id] = mega_id.split("_")
-
-		# check the full length of the entry
-		qry  = "select * from %s " % table
-		qry += "where icgc_mutation_id = '%s' " % icgc_mutation_id
-		qry += "and icgc_donor_id = '%s' " % icgc_donor_id
-		qry += "and icgc_specimen_id = '%s' " % icgc_specimen_id
-		qry += "and icgc_sample_id = '%s' " % icgc_sample_id
-		ret2 = search_db(cursor,qry)
-
-		resolve_duplicate_mutations(cursor, table, ret2, verbose)
-
-	cursor.close()
-	db.close()
+	with pooled_cursor(Config.mysql_conf_file, "icgc") as cursor:
+		# loop over all duplicate entries
+		for line in table_rows:
+			[mega_id, ct] = line
+			if not mega_id: continue # we do not have one of the IDs (happens with TCGA)
+			[icgc_mutation_id, icgc_donor_id, icgc_specimen_id, icgc_sample_id] = mega_id.split("_")
+
+			# check the full length of the entry
+			qry  = "select * from %s " % table
+			qry += "where icgc_mutation_id = '%s' " % icgc_mutation_id
+			qry += "and icgc_donor_id = '%s' " % icgc_donor_id
+			qry += "and icgc_specimen_id = '%s' " % icgc_specimen_id
+			qry += "and icgc_sample_id = '%s' " % icgc_sample_id
+			ret2 = search_db(cursor,qry)
+
+			resolve_duplicate_mutations(cursor, table, ret2, verbose)
 
 	print ("\tprocess {} exiting; worked on table {}".format(get_process_id(), table))
 
@@ -78,7 +74,15 @@ def main():
 	tables = [field[0] for field in  search_db(cursor,qry)]
 	switch_to_db(cursor,"icgc")
 	number_of_chunks = 10 # myISAM does not deadlock
+	# the unit of work here is the table, and the duplicates within it are split between the workers
+	# (with --resume, the tables cleaned up in the previous run are skipped)
+	ledger = stage_ledger()
+	unfinished = 0
 	for table in tables:
+		if ledger.is_done(table):
+			print("\n%s done in a previous run" % table)
+			continue
+		time0 = time.time()
 		print("\n====================")
 		print("inspecting ", table)
 		# column names/headers
@@ -89,15 +93,24 @@ def main():
 
 		if not ret:
 			print("\tno duplicates found in", table)
+			ledger.record(table, time.time()-time0)
 			continue
 		print("\t%s has %d duplicates" % (table, len(ret)))
 		#print(ret)
 
-		processes = parallelize(number_of_chunks, remove_duplicates, ret, [table])
-		if processes: wait_join(processes)
+		try:
+			parallelize(number_of_chunks, remove_duplicates, ret, [table])
+		except ParallelizeError as e:
+			# a worker that raised, died, or exited on a db error (error_intolerant_search):
+			# the table is left unfinished, and not checked off; the next run (with --resume) picks it up again
+			print(e)
+			unfinished += 1
+			continue
+		ledger.record(table, time.time()-time0)
 
 	cursor.close()
 	db.close()
+	if unfinished==0: ledger.reset()
 
 
 #########################################
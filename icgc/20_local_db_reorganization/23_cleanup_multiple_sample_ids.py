@@ -97,7 +97,7 @@ def main():
 
 	number_of_chunks = 8
 
-	parallelize(number_of_chunks, cleanup, tables_mirrored, [], round_robin=True)
+	parallelize(number_of_chunks, cleanup, tables_mirrored, [], strategy='queue', weights=table_size)
 
 	return
 
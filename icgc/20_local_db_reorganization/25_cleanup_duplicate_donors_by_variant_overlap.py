@@ -191,7 +191,7 @@ def main():
 
 	#tables_sorted = ['GBM_simple_somatic']
 	#number_of_chunks = 1
-	parallelize(number_of_chunks, cleanup, tables_sorted, [], round_robin=True)
+	parallelize(number_of_chunks, cleanup, tables_sorted, [], strategy='queue', weights=table_size)
 
 
 	return
@@ -21,48 +21,12 @@
 # add info about the reliability to mutations_chrom_* tables
 # for faster search
 
-import time
-
 from icgc_utils.common_queries  import  *
-from icgc_utils.processes   import  *
 from config import Config
-from random import shuffle
-
-#########################################
-def update_reliability_column_in_mutation_tables(cursor, table):
-	chromosomes = [str(i) for i in range(1,23)] + ["X","Y"]
-	for chromosome in chromosomes:
-		qry  = "select distinct(icgc_mutation_id)  from %s " % table
-		qry += "where chromosome='%s' and reliability_estimate=1" % chromosome
-		ret = search_db(cursor,qry, verbose=False)
-		if not ret: continue
-
-		reliable_muts = [r[0] for r in ret]
-		for batch in range(len(reliable_muts),100):
-			batchstring =  ",".join(["'%s'"%m for m in reliable_muts[batch:batch+100]])
-			qry  = "update %s " % table
-			qry += "set reliability_estimate=1 where icgc_mutation_id in (%s)" % batchstring
-			ret = search_db(cursor,qry, verbose=False)
-
-########################################
-def decorate_mutations(tables, other_args):
-
-	db     = connect_to_mysql(Config.mysql_conf_file)
-	cursor = db.cursor()
-	switch_to_db(cursor,"icgc")
-	for table in tables:
 
-		time0 = time.time()
-		print("====================")
-		print("using annotations from  ", table, "to add reliability info to  mutations; pid:", os.getpid())
-		update_reliability_column_in_mutation_tables(cursor, table)
-		time1 = time.time()
-		print(("\t\t %s done in %.3f mins" % (table, float(time1-time0)/60)), os.getpid())
-
-	cursor.close()
-	db.close()
-
-	return
+# there used to be a second, per-table pass here, setting reliability_estimate=1 again for the mutations
+# found reliable in the *_simple_somatic tables; its batch loop never ran, and it could not have changed
+# anything after the update below, so it is gone
 
 #########################################
 #########################################
@@ -82,23 +46,8 @@ def main():
 		qry = "update %s set reliability_estimate=1" % table
 		search_db(cursor,qry)
 	print("... done")
-
-	#########################
-	# which temp somatic tables do we have
-	qry  = "select table_name from information_schema.tables "
-	qry += "where table_schema='icgc' and table_name like '%simple_somatic'"
-	tables = [field[0] for field in  search_db(cursor,qry)]
-	table_size = get_table_size(cursor, 'icgc', tables)
 	cursor.close()
 	db.close()
-	# parallelize on those
-	tables_sorted = sorted(tables, key=lambda t: table_size[t], reverse=True)
-	shuffle(tables_sorted)
-	number_of_chunks = 8
-
-	print("number of pll chunks", number_of_chunks)
-	parallelize(number_of_chunks, decorate_mutations, tables_sorted, [], round_robin=True)
-
 
 	return
 
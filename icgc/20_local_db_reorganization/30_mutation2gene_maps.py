@@ -21,6 +21,9 @@ import time
 
 from icgc_utils.mysql import *
 from icgc_utils.processes import *
+from icgc_utils.ledger import stage_ledger
+from icgc_utils.shards import *
+from icgc_utils.progress import progress_tick
 from random import shuffle
 from config import Config
 
@@ -48,13 +51,21 @@ def make_map_table(cursor, db_name, table_name):
 	search_db(cursor, qry, verbose=True)
 
 #########################################
-def store (cursor, mut_id, gene_symbols):
+# the maps for the mutations in the shard (the mutation ids are unique to the position)
+def delete_shard_maps(cursor, shard):
+	qry  = "delete g from mutation2gene g, mutations_chrom_%s m " % shard[0]
+	qry += "where g.icgc_mutation_id=m.icgc_mutation_id and " + shard_condition(shard, 'm.start_position')
+	error_intolerant_search(cursor, qry)
+
+
+#########################################
+def store (cursor, writer, mut_id, gene_symbols):
 
 	if len(gene_symbols)==0: return
 	# check existing
 	qry = "select gene_symbol from mutation2gene "
-	qry += "where icgc_mutation_id='%s'" % mut_id
-	ret = search_db(cursor,qry)
+	qry += "where icgc_mutation_id=%s"
+	ret = search_db(cursor,qry,args=[mut_id])
 	if not ret:
 		existing = None
 	else:
@@ -63,21 +74,40 @@ def store (cursor, mut_id, gene_symbols):
 		gene_symbols = list(set(gene_symbols).difference(existing))
 	#insert new
 	for symbol in gene_symbols:
-		qry  = "insert into mutation2gene (icgc_mutation_id,gene_symbol) "
-		qry += "values ('%s','%s')" % (mut_id, symbol)
-		if search_db(cursor,qry):
-			search_db(cursor,qry,verbose=True)
-			exit()
+		writer.add('mutation2gene', {'icgc_mutation_id':mut_id, 'gene_symbol':symbol})
 	return
 
 
 #########################################
+# ensembl gene id -> protein-coding approved symbol, read once in main() and shared with the workers;
+# the ids with more than one symbol map to None, and are left to the check in ens2hgnc()
+def share_ens2hgnc(cursor):
+	qry  = "select approved_symbol, ensembl_gene_id, ensembl_gene_id_by_hgnc from icgc.hgnc "
+	qry += "where locus_group='protein-coding gene'"
+	symbols = {}
+	for approved_symbol, ensembl_gene_id, ensembl_gene_id_by_hgnc in hard_landing_search(cursor, qry):
+		for ensid in set([ensembl_gene_id, ensembl_gene_id_by_hgnc]):
+			if not ensid: continue
+			if ensid not in symbols: symbols[ensid] = set()
+			symbols[ensid].add(approved_symbol)
+	share_lookup('ens2hgnc', {ensid:(s.pop() if len(s)==1 else None) for ensid, s in symbols.items()})
+
+
 def ens2hgnc(cursor,ensids,e2h):
 	symbols = set([])
 	unseen_ids = []
+	shared = shared_lookup('ens2hgnc')
 	for ensid in ensids:
 		if ensid in e2h:
 			symbols.add(e2h[ensid])
+		elif shared is not None:
+			# not in the shared map: not a protein-coding gene, nothing to look for
+			if ensid not in shared: continue
+			symbol = shared.get(ensid)
+			if symbol:
+				symbols.add(symbol)
+			else:
+				unseen_ids.append(ensid)
 		else:
 			unseen_ids.append(ensid)
 
@@ -113,6 +143,7 @@ def transcr2gene(cursor, transcrids):
 #########################################
 def report_progress(chrom, ct, no_rows, time0):
 	if (ct%50000>0): return
+	progress_tick(50000)
 	print("%30s   %6d lines out of %6d  (%d%%)  %d min" % \
 	(chrom, ct, no_rows, float(ct)/no_rows*100, float(time.time()-time0)/60))
 	return
@@ -128,54 +159,59 @@ def report_progress(chrom, ct, no_rows, time0):
 # installed its version (if anywhere)
 # @profile
 #########################################
-def store_maps(chromosomes, other_args ):
-
-	db     = connect_to_mysql(Config.mysql_conf_file)
-	cursor = db.cursor()
-	switch_to_db(cursor, "icgc")
-	for chrom in chromosomes:
-		e2h = {}
-		time0 = time.time()
-		print("====================")
-		print("maps for ", chrom, "pid:", os.getpid())
-
-		qry = "select m.icgc_mutation_id, l.gene_relative, l.transcript_relative "
-		qry += "from mutations_chrom_%s m, locations_chrom_%s l " % (chrom, chrom)
-		qry += "where m.start_position=l.position and (l.gene_relative is not null or l.transcript_relative is not null)"
-		ret = search_db(cursor, qry, verbose=True)
-
-		if not ret:
-			print("(?) no ret for ")
-			print(qry)
-			exit()
-		no_rows = len(ret)
-		print("chrom ", chrom, "number of rows", no_rows)
-
-		ct = 0
-		for mut_id, gene, transcr in ret:
-			ct += 1
-			report_progress(chrom, ct, no_rows, time0)
-			gene_found = False
-			if gene and gene != "":
-				geneids = set ([])
-				for ensid in gene.split(";"):
-					geneids.add(ensid)
-				if len(geneids)>0:
-					gene_found = True
-					store (cursor, mut_id, ens2hgnc(cursor,geneids, e2h))
-
-			if not gene_found and transcr and transcr != "":
-				transcrids = set ([])
-				for transcrloc in transcr.split(";"):
-					transcrid, loc = transcrloc.split(":")
-					transcrids.add(transcrid)
+def store_maps(shards, other_args ):
+
+	# the join is streamed through a connection of its own
+	with pooled_cursor(Config.mysql_conf_file, "icgc") as cursor, \
+			pooled_cursor(Config.mysql_conf_file, "icgc") as stream_cursor:
+		for shard in shards:
+			chrom = shard[0]
+			e2h = {}
+			time0 = time.time()
+			print("====================")
+			print("maps for ", shard_name(shard), "pid:", os.getpid())
+
+			qry_from  = "from mutations_chrom_%s m, locations_chrom_%s l " % (chrom, chrom)
+			qry_from += "where m.start_position=l.position and (l.gene_relative is not null or l.transcript_relative is not null) "
+			qry_from += "and " + shard_condition(shard, 'm.start_position')
+			no_rows = error_intolerant_search(cursor, "select count(*) " + qry_from)[0][0]
+			if no_rows==0:
+				# a window can legitimately come out empty; a whole chromosome cannot
+				if shard_name(shard)!="chrom %s" % chrom: continue
+				print("(?) no ret for ")
+				print(qry_from)
+				exit()
+			print(shard_name(shard), "number of rows", no_rows)
+			qry = "select m.icgc_mutation_id, l.gene_relative, l.transcript_relative " + qry_from
+
+			ct = 0
+			# each mutation appears only once per chromosome (icgc_mutation_id is the primary key
+			# in mutations_chrom_*), so the buffered inserts do not interfere with the check in store()
+			writer = BulkWriter(cursor, flush_size=10000)
+			for mut_id, gene, transcr in iter_db(stream_cursor, qry):
+				ct += 1
+				report_progress(shard_name(shard), ct, no_rows, time0)
+				gene_found = False
+				if gene and gene != "":
+					geneids = set ([])
+					for ensid in gene.split(";"):
+						geneids.add(ensid)
+					if len(geneids)>0:
+						gene_found = True
+						store (cursor, writer, mut_id, ens2hgnc(cursor,geneids, e2h))
+
+				if not gene_found and transcr and transcr != "":
+					transcrids = set ([])
+					for transcrloc in transcr.split(";"):
+						transcrid, loc = transcrloc.split(":")
+						transcrids.add(transcrid)
+					# the symbols for the full set of transcripts, stored once
 					geneids = transcr2gene(cursor, transcrids)
-					store (cursor, mut_id, ens2hgnc(cursor,geneids, e2h))
+					store (cursor, writer, mut_id, ens2hgnc(cursor,geneids, e2h))
+			writer.flush()
 
-		time1 = time.time()
-		print("chrom ", chrom, "done in %.3f mins" % (float(time1-time0)/60))
-	cursor.close()
-	db.close()
+			time1 = time.time()
+			print("chrom ", chrom, "done in %.3f mins" % (float(time1-time0)/60))
 
 	return
 
@@ -189,15 +225,29 @@ def main():
 
 	db     = connect_to_mysql(Config.mysql_conf_file)
 	cursor = db.cursor()
-	#########################
-	# note this drops the original table if it exists
-	make_map_table(cursor, "icgc", "mutation2gene")
+	share_ens2hgnc(cursor)
+
+	chromosomes = [str(i) for i in range(1,23)] + ["X","Y"]
+	# each worker streams the join through a second connection
+	number_of_chunks = worker_count(cursor=cursor, memory_per_worker=0.5, connections_per_worker=2)
+	# position windows with about the same number of mutations each (see icgc_utils/shards.py)
+	shards, shard_size = genome_shards(cursor, chromosomes, 4*number_of_chunks)
+
+	# with --resume, the shards done in the previous run stay as they are in the table,
+	# and whatever the unfinished ones managed to write is removed
+	ledger = stage_ledger()
+	if ledger.resuming:
+		check_shard_plan(ledger, shards)
+		for shard in ledger.pending(shards):
+			delete_shard_maps(cursor, shard)
+	else:
+		# note this drops the original table if it exists
+		ledger.reset()
+		make_map_table(cursor, "icgc", "mutation2gene")
 	cursor.close()
 	db.close()
 
-	chromosomes = [str(i) for i in range(1,13)] + ["Y"] + [str(i) for i in range(22,12,-1)] + ["X"]
-	number_of_chunks = 12
-	parallelize (number_of_chunks, store_maps, chromosomes, [], round_robin=True)
+	parallelize (number_of_chunks, store_maps, shards, [], strategy='queue', weights=shard_size, ledger=ledger)
 
 
 	return
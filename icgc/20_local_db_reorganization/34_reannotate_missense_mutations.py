@@ -31,6 +31,9 @@ import time
 
 from icgc_utils.common_queries import *
 from icgc_utils.processes import *
+from icgc_utils.ledger import stage_ledger
+from icgc_utils.shards import *
+from icgc_utils.progress import progress_tick
 from config import Config
 # BioPython
 from Bio.Seq      import Seq
@@ -144,6 +147,22 @@ def find_aa_change(coding_seq, strand, cds_position, nt):
 
 # ./icgc_utils/kernprof.py -l 39_reannotate_missense_mutations.py
 # python3 -m line_profiler 39_reannotate_missense_mutations.py.lprof
+#########################################
+# the canonical coding sequences are read once, in main(), and shared with the workers
+def coding_sequence(cursor, enst):
+	coding_seqs = shared_lookup('coding_seqs')
+	if coding_seqs is not None and enst in coding_seqs: return coding_seqs.get(enst)
+	qry = "select sequence from ensembl_coding_seqs where transcript_id='%s'" %  enst
+	ret = search_db(cursor, qry, verbose=False)
+	if not ret: return None
+	return ret[0][0]
+
+def share_coding_sequences(cursor):
+	qry  = "select transcript_id, sequence from icgc.ensembl_coding_seqs "
+	qry += "where transcript_id in (select distinct canonical_transcript from icgc.ensembl_ids)"
+	share_lookup('coding_seqs', dict(hard_landing_search(cursor, qry)))
+
+
 # @profile
 #########################################
 def process_aa_change_line(cursor, chrom, line):
@@ -225,12 +244,10 @@ def process_aa_change_line(cursor, chrom, line):
 			# and the 'missense' annotation refers to that other gene
 			continue
 		# find coding sequence
-		qry = "select sequence from ensembl_coding_seqs where transcript_id='%s'" %  enst
-		ret = search_db(cursor, qry, verbose=False)
-		if not ret:
+		coding_seq = coding_sequence(cursor, enst)
+		if not coding_seq:
 			print ("sequence not found for transcript_id='%s'" %  enst)
 			continue
-		coding_seq = ret[0][0]
 		# note we have evaluated cds position from the left - on the "+" strand
 		nt = {'from':named_field['reference_genome_allele'], 'to':named_field['mutated_to_allele']}
 		change_string = find_aa_change(coding_seq, coords[enst]['strand'], cds_position, nt)
@@ -266,51 +283,52 @@ def process_aa_change_line(cursor, chrom, line):
 	return annotstring, consequence_string, new_pathogenicity
 
 #########################################
-def re_annotate(chromosomes, other_args):
-	db     = connect_to_mysql(Config.mysql_conf_file)
-	cursor = db.cursor()
-	switch_to_db(cursor, "icgc")
-	for chrom in chromosomes:
-		time0 = time.time()
-		print("====================")
-		print("re-annotating  aa change for  ", chrom, "pid:", os.getpid())
-		mutations_table = "mutations_chrom_%s" % chrom
-		qry  = "select  * from %s " % mutations_table
-		# note that here we trust [whoever annotated this] to have gotten at least this part right
-		# (that the mutation results in aa change)
-		# TODO: change this into our own independent annotation
-		qry += "where aa_mutation is not null "
-		#qry += "and  icgc_mutation_id in ('MUT_12_MMB2U7QQ5O')"
-		ret  = search_db(cursor,qry)
-		if not ret:
-			print("no aa mutation entries for chrom %s (?) " % chrom)
-			continue
-		if 'error' in ret[0][0].lower():
-			search_db(cursor, qry, verbose=True)
-			exit()
-
-		total_updates = 0
-		ct = 0
-		for line in ret:
-			ct += 1
-			if ct%1000==0: print("\t\tchrom %s  %2d%% done" % (chrom, int(float(100*ct)/len(ret))) )
-			new_values =  process_aa_change_line(cursor, chrom, line)
-			if not new_values: continue
-			new_annotation, new_consequence, new_pathogenicity = new_values
-			if len(new_annotation)==0 : continue
+def re_annotate(shards, other_args):
+	# the mutations are streamed through a connection of their own,
+	# while the lookups in process_aa_change_line() go through the (plain) cursor
+	with pooled_cursor(Config.mysql_conf_file, "icgc") as cursor, \
+			pooled_cursor(Config.mysql_conf_file, "icgc") as stream_cursor:
+		for shard in shards:
+			chrom = shard[0]
+			time0 = time.time()
+			print("====================")
+			print("re-annotating  aa change for  ", shard_name(shard), "pid:", os.getpid())
+			mutations_table = "mutations_chrom_%s" % chrom
+			# note that here we trust [whoever annotated this] to have gotten at least this part right
+			# (that the mutation results in aa change)
+			# TODO: change this into our own independent annotation
+			condition = "where aa_mutation is not null and " + shard_condition(shard)
+			#condition += "and  icgc_mutation_id in ('MUT_12_MMB2U7QQ5O')"
+			total = error_intolerant_search(cursor, "select count(*) from %s %s" % (mutations_table, condition))[0][0]
+			if total==0:
+				print("no aa mutation entries for %s (?) " % shard_name(shard))
+				continue
+
+			# the streamed table is read-locked (MyISAM) until we are through with it,
+			# so the updates have to wait until the end
+			updates = []
+			ct = 0
+			for line in iter_db(stream_cursor, "select  * from %s %s" % (mutations_table, condition)):
+				ct += 1
+				if ct%1000==0:
+					print("\t\t%s  %2d%% done" % (shard_name(shard), int(float(100*ct)/total)) )
+					progress_tick(1000)
+				new_values =  process_aa_change_line(cursor, chrom, line)
+				if not new_values: continue
+				new_annotation, new_consequence, new_pathogenicity = new_values
+				if len(new_annotation)==0 : continue
+				updates.append({'icgc_mutation_id':line[0], 'aa_mutation':new_annotation,
+								'consequence':new_consequence, 'pathogenicity_estimate':new_pathogenicity})
+
 			# update table set aa_mutation to new_annotation
-			qry  = "update %s set " % mutations_table
-			qry += "aa_mutation='%s', consequence='%s', pathogenicity_estimate=%d " \
-					% (new_annotation, new_consequence, new_pathogenicity)
-			qry += "where icgc_mutation_id='%s' " % line[0]
-			search_db(cursor, qry, verbose=False)
-			total_updates += 1
+			# (the workers on the other shards of the same chromosome wait for the MyISAM write lock)
+			bulk_update(cursor, mutations_table, ['icgc_mutation_id'], updates)
+			total_updates = len(updates)
 
-		time1 = time.time()
-		print("chrom ", chrom, "done in %.3f mins, total updates %d" % (float(time1-time0)/60, total_updates))
+			time1 = time.time()
+			print(shard_name(shard), "done in %.3f mins, total updates %d" % (float(time1-time0)/60, total_updates))
 
-	cursor.close()
-	db.close()
+		lookup_cache_stats()
 
 	return
 
@@ -323,13 +341,25 @@ def main():
 	cursor = db.cursor()
 	# check that we have the index that we need
 	create_index(cursor, 'icgc', 'gene_idx', 'ensembl_ids', ['gene'])
+	# the gene -> canonical transcript map and the canonical coding sequences are read once,
+	# and the workers read them from shared memory
+	preload_gene_lookups(cursor, shared=True)
+	share_coding_sequences(cursor)
+
+	chromosomes = [str(i) for i in range(1,23)] + ["X","Y"]
+	# each worker streams through a second connection
+	number_of_chunks = worker_count(cursor=cursor, memory_per_worker=1, connections_per_worker=2)
+	# windows within chromosomes, with about the same number of mutations in each,
+	# so that chromosome 1 or 2 does not decide the runtime
+	shards, shard_size = genome_shards(cursor, chromosomes, 4*number_of_chunks)
 	cursor.close()
 	db.close()
 
-	chromosomes = [str(i) for i in range(1,13)] + ["Y"] + [str(i) for i in range(22,12,-1)] + ["X"]
-	number_of_chunks = 12
-
-	parallelize (number_of_chunks, re_annotate, chromosomes, [], round_robin=True)
+	# with --resume, the shards done in a previous (crashed) run are skipped
+	# (re-annotating a shard again gives the same answer, so the unfinished ones are simply redone)
+	ledger = stage_ledger()
+	if ledger.resuming: check_shard_plan(ledger, shards)
+	parallelize (number_of_chunks, re_annotate, shards, [], strategy='queue', weights=shard_size, ledger=ledger, retries=1)
 
 
 	return
@@ -20,10 +20,49 @@
 
 
 from icgc_utils.common_queries   import  *
+from icgc_utils.fan_out import *
 from config import Config
 verbose = True
 
 
+#########################################
+# the per-table functions run in the fan_out threads, and only count;
+# the printing is done in main, in the original table order
+def tumor_table_stats(cursor, table, other_args):
+	stats = {}
+	# total number of donors?
+	qry    = "select count(distinct icgc_donor_id) from  %s " % table
+	stats['donors'] = search_db(cursor,qry)[0][0]
+
+	# specimens per donor?
+	qry  = "select  icgc_donor_id, count(distinct  icgc_specimen_id) ct "
+	qry += "from  %s  " % table
+	qry += "group by icgc_donor_id having ct>1 order by ct desc"
+	ret = search_db(cursor,qry)
+	stats['multiple_specimens'] = len(ret) if ret else 0
+
+	# samples per donor?
+	qry  = "select  icgc_donor_id, count(distinct  icgc_sample_id) ct "
+	qry += "from  %s  " % table
+	qry += "group by icgc_donor_id having ct>1 order by ct desc"
+	ret = search_db(cursor,qry)
+	stats['multiple_samples'] = len(ret) if ret else 0
+
+	#total varinats?
+	qry  = "select count(*) from %s" % table
+	stats['variants'] = search_db(cursor,qry)[0][0]
+	return stats
+
+#########################################
+def missense_frameshift_counts(cursor, chrom, other_args):
+	table = "mutations_chrom_%s" % chrom
+	qry = "select count(*) from %s where consequence like '%%missense%%'" % table
+	miss = search_db(cursor,qry)[0][0]
+	qry = "select count(*) from %s where consequence like '%%frameshift%%'" % table
+	frm  = search_db(cursor,qry)[0][0]
+	return miss, frm
+
+
 #########################################
 #########################################
 # produce table of the format
@@ -47,44 +86,21 @@ def main():
 	total_donors = 0
 	donors_with_multiple_specimens = 0
 	donors_with_multiple_samples = 0
-	for table in tables:
-		tumor_short = table.split("_")[0]
-		fields = [tumor_short]
+	per_table = fan_out(default_number_of_connections, tumor_table_stats, tables, None, Config.mysql_conf_file)
+	for table, stats in zip(tables, per_table):
 		if verbose: print("\n=================================")
 		if verbose: print(table)
 
-		# total number of donors?
-		qry    = "select count(distinct icgc_donor_id) from  %s " % table
-		donors = search_db(cursor,qry)[0][0]
-		total_donors += donors
-		if verbose: print("total donors: ", donors)
-
-		# specimens per donor?
-		qry  = "select  icgc_donor_id, count(distinct  icgc_specimen_id) ct "
-		qry += "from  %s  " % table
-		qry += "group by icgc_donor_id having ct>1 order by ct desc"
-		ret = search_db(cursor,qry)
-		if ret:
-			donors_with_multiple_specimens += len(ret)
-			if verbose: print("donors_with_multiple_specimens: ", len(ret))
-		else:
-			if verbose: print("donors_with_multiple_specimens: 0")
-
-		# samples per donor?
-		qry  = "select  icgc_donor_id, count(distinct  icgc_sample_id) ct "
-		qry += "from  %s  " % table
-		qry += "group by icgc_donor_id having ct>1 order by ct desc"
-		ret = search_db(cursor,qry)
-		if ret:
-			donors_with_multiple_samples += len(ret)
-			if verbose: print("donors_with_multiple_samples: ", len(ret))
-		else:
-			if verbose: print("donors_with_multiple_samples: 0")
-
-		#total varinats?
-		qry  = "select count(*) from %s" % table
-		variants = search_db(cursor,qry)[0][0]
-		if verbose: print("variants: ", variants)
+		total_donors += stats['donors']
+		if verbose: print("total donors: ", stats['donors'])
+
+		donors_with_multiple_specimens += stats['multiple_specimens']
+		if verbose: print("donors_with_multiple_specimens: ", stats['multiple_specimens'])
+
+		donors_with_multiple_samples += stats['multiple_samples']
+		if verbose: print("donors_with_multiple_samples: ", stats['multiple_samples'])
+
+		if verbose: print("variants: ", stats['variants'])
 
 
 	print("total_donors:", total_donors)
@@ -92,14 +108,9 @@ def main():
 	print("donors_with_multiple_sample labels:", donors_with_multiple_samples)
 	print()
 
-
-	for chrom in [str(i) for i in range(1,23)] + ['X','Y']:
-		table = "mutations_chrom_%s" % chrom
-		qry = "select count(*) from %s where consequence like '%%missense%%'" % table
-		miss = search_db(cursor,qry)[0][0]
-		qry = "select count(*) from %s where consequence like '%%frameshift%%'" % table
-		frm  = search_db(cursor,qry)[0][0]
-
+	chromosomes = [str(i) for i in range(1,23)] + ['X','Y']
+	per_chrom = fan_out(default_number_of_connections, missense_frameshift_counts, chromosomes, None, Config.mysql_conf_file)
+	for chrom, (miss, frm) in zip(chromosomes, per_chrom):
 		print("chromosome %2s   missense: %6d  frameshift: %6d   ratio: %.2f " % (chrom, miss, frm, float(frm)/miss))
 
 
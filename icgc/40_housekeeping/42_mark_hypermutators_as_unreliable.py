@@ -39,11 +39,12 @@ def main():
 		tumor_short = table.split("_")[0]
 		# mut_count = mutation_count_per_donor(cursor, table)
 		mut_count = genes_per_patient_breakdown(cursor, table)
+		hypermutators = []
 		for donor, ct in mut_count.items():
 			if ct< 1000: continue
 			print(donor, ct)
-			qry = "update %s set reliability_estimate=0 where icgc_donor_id='%s'" % (table, donor)
-			error_intolerant_search(cursor, qry)
+			hypermutators.append({'icgc_donor_id':donor, 'reliability_estimate':0})
+		bulk_update(cursor, table, ['icgc_donor_id'], hypermutators)
 		print()
 
 
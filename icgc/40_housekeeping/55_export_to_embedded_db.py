@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+#
+# This source code is part of icgc, an ICGC processing pipeline.
+#
+# Icgc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Icgc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see<http://www.gnu.org/licenses/>.
+#
+# Contact: ivana.mihalek@gmail.com
+#
+
+# copy the tables that the production stages read into a duckdb (or sqlite) file
+# to use it, set Config.mysql_conf_file to the path of that file (see icgc_utils/embedded.py)
+
+import time
+
+from icgc_utils.mysql import *
+from icgc_utils.embedded import connect_to_embedded, embedded_engine
+from config import Config
+
+# mysql 'like' patterns
+default_table_patterns = ['%_simple_somatic', 'mutations_chrom_%', 'locations_chrom_%', 'mutation2gene',
+						'%_specimen', '%_donor', 'hgnc', 'ensembl_ids', 'ensembl_deprecated_ids', 'ensembl_coding_seqs']
+
+type_translation = {'int':'INTEGER', 'bigint':'BIGINT', 'tinyint':'INTEGER', 'smallint':'INTEGER', 'mediumint':'INTEGER',
+					'float':'DOUBLE', 'double':'DOUBLE', 'decimal':'DOUBLE',
+					'char':'VARCHAR', 'varchar':'VARCHAR', 'text':'VARCHAR', 'mediumtext':'VARCHAR', 'longtext':'VARCHAR',
+					'date':'DATE', 'datetime':'TIMESTAMP', 'timestamp':'TIMESTAMP'}
+
+
+#########################################
+def tables_to_export(cursor, db_name, patterns):
+	tables = []
+	for pattern in patterns:
+		qry  = "select table_name from information_schema.tables "
+		qry += "where table_schema='%s' and table_name like '%s'" % (db_name, pattern)
+		ret = search_db(cursor, qry)
+		if not ret: continue
+		tables += [r[0] for r in ret if r[0] not in tables]
+	return tables
+
+
+#########################################
+def create_embedded_table(mysql_cursor, emb_cursor, db_name, table):
+	qry  = "select column_name, data_type from information_schema.columns "
+	qry += "where table_schema='%s' and table_name='%s' order by ordinal_position" % (db_name, table)
+	columns = hard_landing_search(mysql_cursor, qry)
+	col_defs = ["%s %s" % (name, type_translation.get(data_type.lower(), 'VARCHAR')) for name, data_type in columns]
+	search_db(emb_cursor, "drop table if exists %s" % table)
+	error_intolerant_search(emb_cursor, "create table %s (%s)" % (table, ", ".join(col_defs)))
+	return [name for name, data_type in columns]
+
+
+#########################################
+def csv_value(value):
+	if value is None: return ""
+	if type(value) in [int, float]: return str(value)
+	return '"' + str(value).replace('"', '""') + '"'
+
+def copy_batch(emb_db, emb_cursor, table, rows):
+	if emb_db.engine=='duckdb':
+		# executemany is painfully slow in duckdb - go through csv in the in-memory filesystem
+		tmpdir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+		tmpf = tempfile.NamedTemporaryFile(mode="w", suffix=".csv", dir=tmpdir, delete=False)
+		for row in rows:
+			tmpf.write(",".join([csv_value(v) for v in row]) + "\n")
+		tmpf.close()
+		error_intolerant_search(emb_cursor, "copy %s from '%s' (format csv, header false)" % (table, tmpf.name))
+		os.remove(tmpf.name)
+	else:
+		placeholders = ",".join(["?"]*len(rows[0]))
+		emb_cursor.native.execute("begin")
+		emb_cursor.native.executemany("insert into %s values (%s)" % (table, placeholders), rows)
+		emb_cursor.native.execute("commit")
+
+
+#########################################
+def export_table(mysql_cursor, emb_db, emb_cursor, db_name, table, batch_size=100000):
+	columns = create_embedded_table(mysql_cursor, emb_cursor, db_name, table)
+	batch = []
+	ct = 0
+	qry = "select %s from %s.%s" % (",".join(columns), db_name, table)
+	for row in iter_db(mysql_cursor, qry, batch_size=batch_size):
+		batch.append(row)
+		if len(batch)>=batch_size:
+			copy_batch(emb_db, emb_cursor, table, batch)
+			ct += len(batch)
+			batch = []
+	if batch:
+		copy_batch(emb_db, emb_cursor, table, batch)
+		ct += len(batch)
+	return ct
+
+
+#########################################
+#########################################
+def main():
+
+	if len(sys.argv)<2 or not embedded_engine(sys.argv[1]):
+		print("usage: %s <target.duckdb|target.sqlite> [<table name pattern> ...]" % sys.argv[0])
+		print("default table patterns:", " ".join(default_table_patterns))
+		exit()
+	target = sys.argv[1]
+	patterns = sys.argv[2:] if len(sys.argv)>2 else default_table_patterns
+
+	db     = connect_to_mysql(Config.mysql_conf_file)
+	cursor = db.cursor()
+	db_name = "icgc"
+	tables = tables_to_export(cursor, db_name, patterns)
+	print("exporting %d tables to %s" % (len(tables), target))
+
+	emb_db     = connect_to_embedded(target, databases=[db_name])
+	emb_cursor = emb_db.cursor()
+	for table in tables:
+		time0 = time.time()
+		rows = export_table(cursor, emb_db, emb_cursor, db_name, table)
+		print("\t %-35s  %10d rows   %.1f mins" % (table, rows, float(time.time()-time0)/60))
+	emb_cursor.close()
+	emb_db.close()
+
+	cursor.close()
+	db.close()
+
+
+#########################################
+if __name__ == '__main__':
+	main()
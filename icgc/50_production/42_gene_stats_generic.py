@@ -81,9 +81,9 @@ def gnomad_info(cursor, mutation, chromosome):
 	[start_position, assembly, reference_genome_allele, mutated_to_allele] = [None]*4
 	qry  = "select start_position, assembly, reference_genome_allele, mutated_to_allele "
 	qry += "from mutations_chrom_%s " % chromosome
-	qry += "where icgc_mutation_id='%s'" % mutation
+	qry += "where icgc_mutation_id=%s"
 
-	ret = search_db(cursor,qry,verbose=True)
+	ret = search_db(cursor,qry,verbose=True,args=[mutation])
 	if len(ret)>1:
 		print(("we should not be here: multiple returns for \n", qry))
 		exit()
@@ -98,10 +98,9 @@ def gnomad_info(cursor, mutation, chromosome):
 
 	if assembly:
 		qry  = "select variant_count,total_count  from gnomad.gnomad_freqs_chr_%s " % chromosome
-		qry += "where position=%d " % start_position
-		qry += "and reference='%s' and variant='%s' " % (reference_genome_allele,mutated_to_allele )
+		qry += "where position=%s and reference=%s and variant=%s "
 
-		ret = search_db(cursor,qry)
+		ret = search_db(cursor,qry,args=[start_position, reference_genome_allele, mutated_to_allele])
 		if ret:
 			if len(ret)>1:
 				print(("we should not be here: multiple returns for \n", qry))
@@ -111,7 +110,7 @@ def gnomad_info(cursor, mutation, chromosome):
 				returnval = "%.1e"%(float(variant_count)/total_count)
 			else:
 				print("unexpected type for variant and total counts")
-				print((search_db(cursor, qry, verbose=True)))
+				print((search_db(cursor, qry, verbose=True, args=[start_position, reference_genome_allele, mutated_to_allele])))
 				exit()
 		else:
 			returnval = "0.0"
@@ -327,6 +326,7 @@ def main():
 		outf.flush()
 
 	outf.close()
+	if verbose: lookup_cache_stats()
 
 	cursor.close()
 	db.close()
@@ -18,6 +18,7 @@
 # Contact: ivana.mihalek@gmail.com
 #
 from icgc_utils.common_queries   import  *
+from icgc_utils.fan_out import *
 from config import Config
 verbose = True
 
@@ -53,6 +54,64 @@ def avg_number_of_muts_per_patient(cursor, table, donors):
 	return [number_of_patients_w_pathogenic_mutations, avg_no_muts]
 
 
+#########################################
+# runs in one of the fan_out threads - collect the verbose output
+# in the report, so that it does not get interleaved with other tumors
+def tumor_mutation_freqs(cursor, variant_table, other_args):
+
+	[gene1, gene2, number_of_genes_in_human_genome] = other_args
+	report = []
+	tumor_short = variant_table.split("_")[0]
+	fields = [tumor_short]
+	report.append("=================================")
+	report.append(variant_table)
+
+	# total number of donors?
+	qry  = "select distinct(icgc_donor_id) from %s " % variant_table
+	donors = [ret[0] for ret in hard_landing_search(cursor,qry)]
+	report.append("\t donors: %d" % len(donors))
+	fields.append(len(donors))
+
+	qry  = "select distinct(icgc_specimen_id) from %s " % variant_table
+	specimens = [ret[0] for ret in hard_landing_search(cursor,qry)]
+	report.append("\t specimens: %d" % len(specimens))
+	#fields.append(len(specimens))
+
+	# number of unique mutations for each patient
+	[number_of_patients_w_pathogenic_mutations,avg_no_muts] = avg_number_of_muts_per_patient(cursor, variant_table, donors)
+	pct = float(number_of_patients_w_pathogenic_mutations)/len(donors)*100
+	report.append("\t number of patients with pathogenic mutations: %d \t (%d%%)" % (number_of_patients_w_pathogenic_mutations, pct))
+	#fields.append(number_of_patients_w_pathogenic_mutations)
+	fields.append("%.0f" % pct)
+
+	report.append("\t avg number of mutations  %.1f " % avg_no_muts)
+	fields.append(" %.1f " % avg_no_muts)
+
+	patients_with_muts_in_gene = patients_per_gene_breakdown(cursor, variant_table)
+	if patients_with_muts_in_gene.get(gene1,0)==0  and \
+			patients_with_muts_in_gene.get(gene2,0)==0: return report, None
+
+	report.append("\t patients with mutations in  (gene| donors | genes w more donors)")
+	for gene in [gene1, gene2]:
+		if gene in patients_with_muts_in_gene:
+			nr_donors =  patients_with_muts_in_gene[gene]
+			genes_w_eq_or_gt_number_of_donors = len([g for g in list(patients_with_muts_in_gene.keys()) if patients_with_muts_in_gene[g]>=nr_donors])
+			report.append("\t\t  %s %d %d" % (gene, nr_donors, genes_w_eq_or_gt_number_of_donors))
+			pct  = float(nr_donors)/number_of_patients_w_pathogenic_mutations*100
+			fields.append(nr_donors)
+			fields.append("%.1f" % pct)
+			fields.append(genes_w_eq_or_gt_number_of_donors)
+			fields.append("%.0f" % (genes_w_eq_or_gt_number_of_donors/number_of_genes_in_human_genome*100.0))
+		else:
+			report.append("\t\t  %s 0" % gene)
+			fields.append(0)
+			fields.append(0.0)
+			fields.append(number_of_genes_in_human_genome)
+			fields.append(100)
+
+	return report, fields
+
+
 #########################################
 #########################################
 # produce table of the format
@@ -91,56 +150,12 @@ def main():
 							"genes wiht path muts in more donors than %s"%gene2, "pct genome"
 							])+"\n")
 
-	for variant_table in variant_tables:
-
-		tumor_short = variant_table.split("_")[0]
-		fields = [tumor_short]
-		if verbose: print("=================================")
-		if verbose: print(variant_table)
-
-		# total number of donors?
-		qry  = "select distinct(icgc_donor_id) from %s " % variant_table
-		donors = [ret[0] for ret in hard_landing_search(cursor,qry)]
-		if verbose: print("\t donors: ", len(donors))
-		fields.append(len(donors))
-
-		qry  = "select distinct(icgc_specimen_id) from %s " % variant_table
-		specimens = [ret[0] for ret in hard_landing_search(cursor,qry)]
-		if verbose: print("\t specimens: ", len(specimens))
-		#fields.append(len(specimens))
-
-		# number of unique mutations for each patient
-		[number_of_patients_w_pathogenic_mutations,avg_no_muts] = avg_number_of_muts_per_patient(cursor, variant_table, donors)
-		if verbose: print("\t number of patients with pathogenic mutations: %d" % number_of_patients_w_pathogenic_mutations, end=' ')
-		pct = float(number_of_patients_w_pathogenic_mutations)/len(donors)*100
-		if verbose: print("\t (%d%%)" % (pct))
-		#fields.append(number_of_patients_w_pathogenic_mutations)
-		fields.append("%.0f" % pct)
-
-		if verbose: print("\t avg number of mutations  %.1f " % avg_no_muts)
-		fields.append(" %.1f " % avg_no_muts)
-
-		patients_with_muts_in_gene = patients_per_gene_breakdown(cursor, variant_table)
-		if patients_with_muts_in_gene.get(gene1,0)==0  and \
-				patients_with_muts_in_gene.get(gene2,0)==0: continue
-
-		if verbose: print("\t patients with mutations in  (gene| donors | genes w more donors)")
-		for gene in [gene1, gene2]:
-			if gene in patients_with_muts_in_gene:
-				nr_donors =  patients_with_muts_in_gene[gene]
-				genes_w_eq_or_gt_number_of_donors = len([g for g in list(patients_with_muts_in_gene.keys()) if patients_with_muts_in_gene[g]>=nr_donors])
-				if verbose: print("\t\t ", gene, nr_donors,   genes_w_eq_or_gt_number_of_donors)
-				pct  = float(nr_donors)/number_of_patients_w_pathogenic_mutations*100
-				fields.append(nr_donors)
-				fields.append("%.1f" % pct)
-				fields.append(genes_w_eq_or_gt_number_of_donors)
-				fields.append("%.0f" % (genes_w_eq_or_gt_number_of_donors/number_of_genes_in_human_genome*100.0))
-			else:
-				if verbose: print("\t\t ", gene,0)
-				fields.append(0)
-				fields.append(0.0)
-				fields.append(number_of_genes_in_human_genome)
-				fields.append(100)
+	# the per-tumor queries run concurrently; the lines are written in the original table order
+	other_args = [gene1, gene2, number_of_genes_in_human_genome]
+	per_tumor = fan_out(default_number_of_connections, tumor_mutation_freqs, variant_tables, other_args, Config.mysql_conf_file)
+	for report, fields in per_tumor:
+		if verbose: print("\n".join(report))
+		if not fields: continue
 		outf.write("\t".join([str(f) for f in fields])+"\n")
 		outf.flush()
 
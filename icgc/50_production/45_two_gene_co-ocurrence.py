@@ -20,6 +20,7 @@
 
 from icgc_utils.common_queries import *
 from icgc_utils.icgc_stats  import *
+from icgc_utils.fan_out import *
 from config import Config
 from numpy  import cumsum
 from time   import time
@@ -27,6 +28,27 @@ from math import log10
 verbose = False
 
 
+###################################
+# the queries for one tumor - run in the fan_out threads
+# returns None if the bg gene, or all of the other genes, are not mutated in this tumor
+def tumor_cooccurrence_counts(cursor, table, other_args):
+	[bg_gene, other_genes] = other_args
+	# mut_count = mutation_count_per_donor(cursor, table)
+	mut_count = genes_per_patient_breakdown(cursor, table)
+
+	patients_with_muts_in_gene = patients_per_gene_breakdown(cursor, table)
+	if patients_with_muts_in_gene.get(bg_gene,0)==0: return None
+	no_mutant = True
+	for gene in other_genes:
+		if patients_with_muts_in_gene.get(gene,0)==0: continue
+		no_mutant = False
+		break
+	if no_mutant: return None
+
+	other_mutated = patients_with_muts_in_gene_group(cursor, table, other_genes)
+	cooc = co_ocurrence_w_group_count(cursor, table, bg_gene, other_genes)
+	return [mut_count, patients_with_muts_in_gene, other_mutated, cooc]
+
 
 ###################################
 def main():
@@ -76,19 +98,13 @@ def main():
 
 	pancan_mut_count_values = []
 	p_smaller_sc, p_bigger_sc = 0 ,0 # to make the code checker shut up
-	for table in tables:
+	# the counting queries for all tumors run concurrently; the simulation and the output follow the table order
+	per_tumor = fan_out(default_number_of_connections, tumor_cooccurrence_counts, tables,
+						[bg_gene, other_genes], Config.mysql_conf_file)
+	for table, counts in zip(tables, per_tumor):
+		if not counts: continue
 		tumor_short = table.split("_")[0]
-		# mut_count = mutation_count_per_donor(cursor, table)
-		mut_count = genes_per_patient_breakdown(cursor, table)
-
-		patients_with_muts_in_gene = patients_per_gene_breakdown(cursor, table)
-		if patients_with_muts_in_gene.get(bg_gene,0)==0: continue
-		no_mutant = True
-		for gene in other_genes:
-			if patients_with_muts_in_gene.get(gene,0)==0: continue
-			no_mutant = False
-			break
-		if no_mutant: continue
+		[mut_count, patients_with_muts_in_gene, other_mutated, cooc] = counts
 
 		cumulative_size = [0]
 
@@ -122,12 +138,9 @@ def main():
 			print(gene, patients_with_muts_in_gene.get(gene, 0))
 
 		bg_gene_mutated  = patients_with_muts_in_gene.get(bg_gene,0)
-		other_mutated    = patients_with_muts_in_gene_group(cursor, table, other_genes)
 		pancan_bg_gene  += bg_gene_mutated
 		pancan_other    += other_mutated
-
-		cooc = co_ocurrence_w_group_count(cursor, table, bg_gene, other_genes)
-		pancan_cooc += cooc
+		pancan_cooc     += cooc
 
 		#
 		p_smaller, p_bigger = myfisher(total_patients, bg_gene_mutated, other_mutated, cooc)
@@ -25,6 +25,8 @@ from config import Config
 from random import shuffle
 
 verbose = False
+# per-table runtimes from the previous runs - the best guess for the load balancing in the next one
+runtimes_file = "cooccurrence_runtimes.tsv"
 
 def progress_rept(tumor_short, nr_genes, ctr, t0):
 	if (ctr%5000)>0: return
@@ -82,6 +84,7 @@ def cooccurrence(tables, other_args):
 			outf.close()
 
 		print(table, "donors: ", total_number_of_donors, "done, %.1f mins" % (float(time.time() - t0) / 60))
+		append_runtime(runtimes_file, table, time.time() - t0)
 
 	cursor.close()
 	db.close()
@@ -106,12 +109,15 @@ def main():
 	qry = "select table_name from information_schema.tables "
 	qry += "where table_schema='icgc' and table_name like '%_simple_somatic'"
 	tables = [field[0] for field in search_db(cursor, qry)]
+	# the runtimes measured in the previous run, if any; otherwise the table size is our best guess
+	weights = read_runtimes(runtimes_file, tables)
+	if not weights: weights = get_table_size(cursor, 'icgc', tables)
 
 	# ###################################
 	# #number_of_chunks = 1
 	# tables = ['UCEC_simple_somatic', 'BLCA_simple_somatic', 'THCA_simple_somatic', 'BRCA_simple_somatic']
-	number_of_chunks = 12
-	processes = parallelize(number_of_chunks, cooccurrence, tables, [bg_gene, outdir])
+	number_of_chunks = worker_count(len(tables), cursor=cursor, memory_per_worker=1)
+	processes = parallelize(number_of_chunks, cooccurrence, tables, [bg_gene, outdir], strategy='weighted', weights=weights)
 	if processes: wait_join(processes)
 
 	cursor.close()
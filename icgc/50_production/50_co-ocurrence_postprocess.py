@@ -140,7 +140,10 @@ def main():
 	if not os.path.exists(outdir): os.mkdir(outdir)
 	other_args = [rbf, precision, outdir, bg_gene, pancan_mutations, pancan_bg, pancan_cooc, pancan_mut_count_values, pancan_donors]
 	number_of_chunks = 10
-	parallelize(number_of_chunks, gene_stats, list(pancan_mutations.keys()), other_args)
+	# the simulation time goes with the number of donors (bins), and genes with <10 mutations are skipped
+	genes = list(pancan_mutations.keys())
+	gene_weights = {gene: (len(pancan_mut_count_values[gene]) if pancan_mutations[gene]>=10 else 0) for gene in genes}
+	parallelize(number_of_chunks, gene_stats, genes, other_args, strategy='weighted', weights=gene_weights)
 
 
 
@@ -48,14 +48,10 @@ def avg_for_random_gene_sel(cursor, table, all_genes, sel_size, nr_sim_steps):
 def avg_pll_chunk(tables, other_args, return_dict):
 	[all_genes, selection_size, nr_sim_steps] = other_args
 	avg_estimates = {}
-	db     = connect_to_mysql(Config.mysql_conf_file)
-	cursor = db.cursor()
-	switch_to_db(cursor, 'icgc')
-	for table in tables:
-		avg, stdev = avg_for_random_gene_sel(cursor, table, all_genes, selection_size, nr_sim_steps)
-		avg_estimates[table] = (avg,stdev)
-	cursor.close()
-	db.close()
+	with pooled_cursor(Config.mysql_conf_file, "icgc") as cursor:
+		for table in tables:
+			avg, stdev = avg_for_random_gene_sel(cursor, table, all_genes, selection_size, nr_sim_steps)
+			avg_estimates[table] = (avg,stdev)
 	return_dict[get_process_id()]=avg_estimates
 
 	return
@@ -102,12 +98,13 @@ def main():
 		other_args = [all_genes, selection_size, nr_sim_steps]
 		avg_estimates = pll_w_return(number_of_chunks, avg_pll_chunk, tables, other_args, table_sizes)
 		print("                       ... done in %.1f mins" %( (float(time.time()-time0))/60) )
-		for table, stats in avg_estimates.items():
-			tumor_short = table.split("_")[0]
-			avg, stdev = stats
-			parameters = "{};{}".format(tumor_short, selection_size)
-			stats_string = "%.1f;%.1f"%(avg, stdev)
-			store_without_checking(cursor, 'stats',{'stats_id':stats_id, 'parameters':parameters, 'stats':stats_string})
+		with BulkWriter(cursor) as writer:
+			for table, stats in avg_estimates.items():
+				tumor_short = table.split("_")[0]
+				avg, stdev = stats
+				parameters = "{};{}".format(tumor_short, selection_size)
+				stats_string = "%.1f;%.1f"%(avg, stdev)
+				writer.add('stats', {'stats_id':stats_id, 'parameters':parameters, 'stats':stats_string})
 	cursor.close()
 	db.close()
 
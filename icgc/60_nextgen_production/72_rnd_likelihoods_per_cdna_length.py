@@ -57,37 +57,32 @@ def avg_for_random_gene_sel(cursor, table, all_genes, nr_sim_steps):
 ###############
 def store_stats(cursor, tumor_short, stats_id, stats):
 	bin_population, avg_bin, avg_sq_bin = stats
-	for bin_idx in sorted(bin_population.keys()):
-		if bin_population[bin_idx]<5: continue
-		pop = bin_population[bin_idx]
-		avg = avg_bin[bin_idx]/pop
-		avg_sq = avg_sq_bin[bin_idx]/pop
-		stdev  = sqrt(avg_sq-avg*avg)
-
-		parameters = "{};{};{}".format(tumor_short, bin_idx*1000, pop)
-		stats_string = "%.1f;%.1f"%(avg, stdev)
-		#print("storing", parameters, stats_string)
-		store_without_checking(cursor, 'stats',{'stats_id':stats_id, 'parameters':parameters, 'stats':stats_string})
+	with BulkWriter(cursor) as writer:
+		for bin_idx in sorted(bin_population.keys()):
+			if bin_population[bin_idx]<5: continue
+			pop = bin_population[bin_idx]
+			avg = avg_bin[bin_idx]/pop
+			avg_sq = avg_sq_bin[bin_idx]/pop
+			stdev  = sqrt(avg_sq-avg*avg)
+
+			parameters = "{};{};{}".format(tumor_short, bin_idx*1000, pop)
+			stats_string = "%.1f;%.1f"%(avg, stdev)
+			#print("storing", parameters, stats_string)
+			writer.add('stats', {'stats_id':stats_id, 'parameters':parameters, 'stats':stats_string})
 	return
 
 ###############
 def avg_pll_chunk(tables, other_args):
 	[all_genes, nr_sim_steps, stats_id] = other_args
-	db     = connect_to_mysql(Config.mysql_conf_file)
-	cursor = db.cursor()
-	switch_to_db(cursor, 'icgc')
-
-	print("{} working on".format(os.getpid()), tables)
-
-	for table in tables:
-		tumor_short = table.split("_")[0]
-		time0 = time.time()
-		stats  = avg_for_random_gene_sel(cursor, table, all_genes, nr_sim_steps)
-		store_stats(cursor, tumor_short, stats_id, stats)
-		print("%s done in %.1f mins" %(table,  (float(time.time()-time0))/60) )
-
-	cursor.close()
-	db.close()
+	with pooled_cursor(Config.mysql_conf_file, "icgc") as cursor:
+		print("{} working on".format(os.getpid()), tables)
+
+		for table in tables:
+			tumor_short = table.split("_")[0]
+			time0 = time.time()
+			stats  = avg_for_random_gene_sel(cursor, table, all_genes, nr_sim_steps)
+			store_stats(cursor, tumor_short, stats_id, stats)
+			print("%s done in %.1f mins" %(table,  (float(time.time()-time0))/60) )
 
 	return
 
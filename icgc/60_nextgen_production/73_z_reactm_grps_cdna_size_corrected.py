@@ -21,6 +21,7 @@
 from config import Config
 from icgc_utils.reactome import *
 from icgc_utils.common_queries import *
+from icgc_utils.fan_out import *
 import numpy as np
 from matplotlib import pyplot as plt
 import bezier
@@ -110,8 +111,24 @@ def curve_value_at_x (curve, x):
 
 
 ####################################################
+# the queries for one tumor - run in the fan_out threads
+def tumor_group_counts(cursor, table, gene_groups):
+	number_of_donors = len(get_donors(cursor, table))
+	number_of_genes_mutated = get_number_of_genes_affected(cursor, table)
+	group_mutated = {}
+	for parent, group in gene_groups.items():
+		if len(group)==0: continue
+		gene_string = ",".join([quotify(g) for g in group])
+		qry  = "select count(distinct icgc_sample_id) from %s " % table
+		qry += "where pathogenicity_estimate=1 and reliability_estimate=1 "
+		qry += "and gene_symbol in (%s)" % gene_string
+		group_mutated[parent] = error_intolerant_search(cursor, qry)[0][0]
+	return [number_of_donors, number_of_genes_mutated, group_mutated]
+
 
-def reactome_groups_in_tumor(cursor, table, number_of_donors, number_of_genes_mutated,  stats_id, gene_groups, cdna_length, plot=False):
+####################################################
+def reactome_groups_in_tumor(cursor, table, number_of_donors, number_of_genes_mutated, group_mutated_count,
+							stats_id, gene_groups, cdna_length, plot=False):
 
 	if not number_of_donors:
 		print("no samples for %s (?)"% table)
@@ -141,11 +158,7 @@ def reactome_groups_in_tumor(cursor, table, number_of_donors, number_of_genes_mu
 		if group_size==0: continue
 
 		pathway = get_pathway_name(cursor, parent)
-		gene_string = ",".join([quotify(g) for g in group])
-		qry  = "select count(distinct icgc_sample_id) from %s " % table
-		qry += "where pathogenicity_estimate=1 and reliability_estimate=1 "
-		qry += "and gene_symbol in (%s)" % gene_string
-		group_mutated = error_intolerant_search(cursor, qry)[0][0]
+		group_mutated = group_mutated_count[parent]
 		scaled_donors_affected = float(group_mutated)/number_of_donors
 
 		cdnal = cdna_length[parent]
@@ -297,18 +310,20 @@ def main():
 	# note the plural: groupS
 	cdna_length = gene_groups_cdna_length(cursor, gene_groups)
 
-	# for all tables fit the Bezier curve to avg and stdev
+	# the per-tumor counts run concurrently, each table on its own connection
 	number_of_donors = {}
 	number_of_genes_mutated = {}
-	for table in tables:
-		number_of_donors[table] = len(get_donors(cursor, table))
-		number_of_genes_mutated[table] = get_number_of_genes_affected(cursor, table)
+	group_mutated_count = {}
+	per_tumor = fan_out(default_number_of_connections, tumor_group_counts, tables, gene_groups, Config.mysql_conf_file)
+	for table, counts in zip(tables, per_tumor):
+		[number_of_donors[table], number_of_genes_mutated[table], group_mutated_count[table]] = counts
 		print(table, number_of_donors[table], number_of_genes_mutated [table])
 
-	# the main loop
+	# the main loop - for all tables fit the Bezier curve to avg and stdev
+	# (matplotlib is not thread safe, so this stays serial)
 	for table in tables:
 		reactome_groups_in_tumor(cursor, table, number_of_donors[table], number_of_genes_mutated[table],
-								stats_id, gene_groups, cdna_length, plot=plot)
+								group_mutated_count[table], stats_id, gene_groups, cdna_length, plot=plot)
 
 	cursor.close()
 	db.close()
@@ -30,6 +30,12 @@ class Config:
 	mysql_conf_file = "/home/ivana/.tcga_conf"
 	ucsc_mysql_conf_file  = "/home/ivana/.ucsc_mysql_conf"
 
+	# number of parallel workers, by stage (script name without .py);
+	# the stages not listed here size their pools from the cores, memory and mysql connections available
+	worker_counts = {
+		# "13_reorganize_mutations": 12,
+	}
+
 	tcga_icgc_table_correspondence = {
 		"ACC_somatic_mutations" : None,
 		"ALL_somatic_mutations" : "ALL_simple_somatic",
@@ -19,8 +19,133 @@
 #
 
 from icgc_utils.tcga import *
+from icgc_utils.processes import SharedLookup
+from collections import OrderedDict
+import functools, threading
 
 #########################################
+# process-local memo for the per-gene/per-specimen lookups below
+# the cursor is not a part of the key - the answers do not depend on the connection
+# forked workers inherit whatever the parent has cached (or preloaded) before the fork;
+# share() moves the entries into a SharedLookup (see processes.py), so that they are not copied into each worker
+# the threads started by fan_out() share it, hence the lock
+class LookupCache:
+
+	def __init__(self, name, maxsize=None):
+		self.name    = name
+		self.maxsize = maxsize # None is unbounded, otherwise the least recently used entries go first
+		self.entries = OrderedDict()
+		self.shared  = None
+		self.hits    = 0
+		self.misses  = 0
+		self.lock    = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			if key in self.entries:
+				self.hits += 1
+				if self.maxsize: self.entries.move_to_end(key)
+				return True, self.entries[key]
+			if self.shared is not None and key in self.shared:
+				self.hits += 1
+				return True, self.shared.get(key)
+			self.misses += 1
+			return False, None
+
+	def put(self, key, value):
+		with self.lock:
+			self.entries[key] = value
+			if self.maxsize:
+				self.entries.move_to_end(key)
+				while len(self.entries)>self.maxsize: self.entries.popitem(last=False)
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.shared = None
+			self.hits   = 0
+			self.misses = 0
+
+	def share(self):
+		with self.lock:
+			self.shared = SharedLookup(self.entries)
+			self.entries.clear()
+
+lookup_caches = {}
+def lookup_cache(name, maxsize=None):
+	if name not in lookup_caches: lookup_caches[name] = LookupCache(name, maxsize)
+	return lookup_caches[name]
+
+#########################################
+# for lookups of the form fn(cursor, key, [verbose]) - memo on the key
+def memoized_lookup(name, maxsize=None):
+	def decorator(lookup_fn):
+		cache = lookup_cache(name, maxsize)
+		@functools.wraps(lookup_fn)
+		def wrapper(cursor, key, *args, **kwargs):
+			found, value = cache.get(key)
+			if found: return value
+			value = lookup_fn(cursor, key, *args, **kwargs)
+			cache.put(key, value)
+			return value
+		return wrapper
+	return decorator
+
+#########################################
+def lookup_cache_stats(verbose=True):
+	stats = {}
+	for name, cache in lookup_caches.items():
+		size = len(cache.entries) + (len(cache.shared) if cache.shared is not None else 0)
+		stats[name] = {'size':size, 'hits':cache.hits, 'misses':cache.misses}
+		if verbose: print("%-45s  size %8d   hits %10d   misses %8d" % (name, size, cache.hits, cache.misses))
+	return stats
+
+#########################################
+def clear_lookup_caches():
+	for cache in lookup_caches.values(): cache.clear()
+
+#########################################
+# the full hgnc and ensembl_ids mappings are a few MB - if the whole gene set is going to be
+# looked at, it is cheaper to read it in two queries (preferably before forking the workers)
+# only the straightforward cases are preloaded - the deprecated ids etc are still resolved on demand
+# shared: pack the preloaded maps into shared memory, for the workers to read in place
+def preload_gene_lookups(cursor, shared=False):
+
+	canonical = {}
+	qry = "select distinct gene, canonical_transcript from icgc.ensembl_ids"
+	for gene, canonical_transcript in hard_landing_search(cursor, qry):
+		if gene not in canonical: canonical[gene] = set()
+		canonical[gene].add(canonical_transcript)
+	# gene_stable_id_2_canonical_transcript_id() returns None if there is no unique canonical transcript
+	gene2canonical = lookup_cache('gene_stable_id_2_canonical_transcript_id')
+	for gene in canonical.keys():
+		canonical[gene] = canonical[gene].pop() if len(canonical[gene])==1 else None
+		gene2canonical.put(gene, canonical[gene])
+
+	symbol2chrom     = lookup_cache('find_chromosome')
+	ensembl2symbol   = lookup_cache('ensembl_gene_id2approved_symbol')
+	symbol2canonical = lookup_cache('approved_symbol2ensembl_canonical_transcript')
+	qry = "select approved_symbol, ensembl_gene_id, chromosome from icgc.hgnc"
+	seen_symbols = set()
+	seen_ensembl_ids = set()
+	for approved_symbol, ensembl_gene_id, chromosome in hard_landing_search(cursor, qry):
+		# the lookups return the first hit, so we do the same here
+		if approved_symbol in seen_symbols: continue
+		seen_symbols.add(approved_symbol)
+		symbol2chrom.put(approved_symbol, chromosome)
+		if not ensembl_gene_id: continue
+		if ensembl_gene_id not in seen_ensembl_ids:
+			seen_ensembl_ids.add(ensembl_gene_id)
+			ensembl2symbol.put(ensembl_gene_id, approved_symbol)
+		if ensembl_gene_id in canonical:
+			symbol2canonical.put(approved_symbol, canonical[ensembl_gene_id])
+	if shared:
+		for cache in [gene2canonical, symbol2chrom, ensembl2symbol, symbol2canonical]: cache.share()
+	return
+
+
+#########################################
+@memoized_lookup('silent_nonsilent_retrieve', maxsize=100000)
 def silent_nonsilent_retrieve(cursor, gene):
 	transcript_id = approved_symbol2ensembl_canonical_transcript(cursor, gene)
 	if not transcript_id: return -5, -5
@@ -501,6 +626,7 @@ def patients_with_muts_in_gene_group(cursor, table, gene_list):
 	return ret[0][0]
 
 ########################################
+@memoized_lookup('find_chromosome')
 def find_chromosome(cursor, gene):
 	qry = "select chromosome from icgc.hgnc where approved_symbol = '%s'" % gene
 	ret = search_db(cursor,qry)
@@ -539,11 +665,16 @@ def get_specimens_from_donor(cursor, table, icgc_donor_id):
 	return [r[0] for r in search_db(cursor,qry)]
 
 def get_specimen_type(cursor, tumor_short, spec_ids):
+	cache = lookup_cache('get_specimen_type', maxsize=200000)
 	specimen_type = {}
 	for spec_id in spec_ids:
-		qry = " select specimen_type from %s_specimen " % tumor_short
-		qry += "where icgc_specimen_id = '%s'" % spec_id
-		specimen_type[spec_id] = search_db(cursor,qry)[0][0]
+		found, value = cache.get((tumor_short, spec_id))
+		if not found:
+			qry = " select specimen_type from %s_specimen " % tumor_short
+			qry += "where icgc_specimen_id = '%s'" % spec_id
+			value = search_db(cursor,qry)[0][0]
+			cache.put((tumor_short, spec_id), value)
+		specimen_type[spec_id] = value
 	return specimen_type
 
 def get_mutations_from_donor(cursor, table, icgc_donor_id):
@@ -607,6 +738,7 @@ def pathogenic_mutations_in_gene(cursor, approved_symbol, chromosome, use_reliab
 
 
 #########################################
+@memoized_lookup('ensembl_gene_id2approved_symbol', maxsize=200000)
 def ensembl_gene_id2approved_symbol(cursor, ensembl_gene_id):
 	symbol = None
 	qry = "select approved_symbol from icgc.hgnc where ensembl_gene_id='%s'"% ensembl_gene_id
@@ -635,6 +767,7 @@ def attempt_resolve_deprecated(cursor, stable_id_old, verbose=False):
 # python3 -m line_profiler 39_reannotate_missense_mutations.py.lprof
 #@profile
 #########################################
+@memoized_lookup('gene_stable_id_2_canonical_transcript_id', maxsize=200000)
 def gene_stable_id_2_canonical_transcript_id(cursor, gene_stable_id, verbose=False):
 	qry  = "select  distinct(canonical_transcript) from icgc.ensembl_ids where  gene ='%s' " % gene_stable_id
 	ret = search_db(cursor,qry)
@@ -669,6 +802,7 @@ def list_of_transcript_ids_2_canonical_transcript_id(cursor, list_of_stable_tran
 
 
 #########################################
+@memoized_lookup('approved_symbol2ensembl_canonical_transcript', maxsize=200000)
 def approved_symbol2ensembl_canonical_transcript(cursor, gene_symbol):
 	qry  = "select ensembl_gene_id from icgc.hgnc "
 	qry += "where approved_symbol = '%s' " % gene_symbol
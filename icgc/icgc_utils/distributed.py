@@ -0,0 +1,351 @@
+#! /usr/bin/python3
+#
+# This source code is part of icgc, an ICGC processing pipeline.
+#
+# Icgc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Icgc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see<http://www.gnu.org/licenses/>.
+#
+# Contact: ivana.mihalek@gmail.com
+#
+
+# Spreading the units of work (tables, chromosomes ...) of a stage over several boxes that share one mysql.
+# The stage runs as usual on one box; its parallelize() call starts a coordinator, which hands out
+# the units over TCP, one at a time, to the agents that connect to it. The box running the stage
+# starts number_of_chunks agents of its own; on each of the other boxes run
+#     ICGC_AUTHKEY=<secret> icgc_utils/distributed.py <coordinator host>:<port> [number of workers]
+# The agents are told which stage script and worker function to run; the script is looked up
+# relative to the icgc directory, so the boxes need the same checkout (and the same Config, and a shared
+# filesystem if the stage writes files). The module level of the script is executed in the agent, main() is not.
+#
+# A unit handed out is leased to the agent: the agent keeps the lease alive while it works on the unit,
+# and the unit goes back in the queue if the agent fails on it, loses the connection, or stops responding.
+# A unit that fails max_attempts times (parallelize: retries+1), or calls exit(), is given up on, and reported at the end.
+# The return values of the worker function are not sent back; the units write their results to the db or to files.
+#
+# Set ICGC_COORDINATOR=<host>:<port> in the environment of the stage, and the queue strategy of
+# parallelize() goes distributed. The messages are pickled, so ICGC_AUTHKEY is not optional
+# once the coordinator listens beyond localhost, and the port should not be open beyond the boxes in question.
+
+import os, sys, time, socket, threading, traceback, importlib, importlib.util
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import Listener, Client
+
+default_port  = 50123
+lease_seconds = 300
+max_attempts  = 3
+
+# the icgc directory, wherever we were imported from (icgc_utils is symlinked into the stage directories)
+icgc_root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+#########################################
+def coordinator_address():
+	address = os.environ.get("ICGC_COORDINATOR", "localhost:%d" % default_port)
+	host, port = address.rsplit(":", 1)
+	return (host, int(port))
+
+def coordinator_authkey():
+	key = os.environ.get("ICGC_AUTHKEY")
+	return key.encode() if key else None
+
+def distributed_mode():
+	return bool(os.environ.get("ICGC_COORDINATOR"))
+
+def worker_name():
+	return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+#########################################
+# how the agent on another box finds the worker function: the stage script (relative to the icgc dir)
+# or the module it lives in, and its name
+def function_spec(embarassingly_pllbl_fn):
+	if embarassingly_pllbl_fn.__module__ == '__main__':
+		script = os.path.relpath(os.path.realpath(sys.argv[0]), icgc_root)
+		return ['script', script, embarassingly_pllbl_fn.__name__]
+	return ['module', embarassingly_pllbl_fn.__module__, embarassingly_pllbl_fn.__name__]
+
+def load_function(spec):
+	[kind, where, fn_name] = spec
+	if kind=='module':
+		module = importlib.import_module(where)
+	else:
+		path = os.path.join(icgc_root, where)
+		# the stage directories have icgc_utils and config.py symlinked in
+		sys.path.insert(0, os.path.dirname(path))
+		module_spec = importlib.util.spec_from_file_location("icgc_stage", path)
+		module = importlib.util.module_from_spec(module_spec)
+		module_spec.loader.exec_module(module)
+	return getattr(module, fn_name)
+
+
+#########################################
+class Coordinator:
+
+	def __init__(self, units, task_spec, other_args, address, authkey, ledger=None, progress_channel=None,
+					max_attempts=max_attempts, fail_fast=False):
+		# the units come in the order in which they should be handed out
+		self.units = {str(unit):unit for unit in units}
+		self.pending = deque([str(unit) for unit in units])
+		self.leases = {}    # unit key -> [worker, lease expiration time, start time]
+		self.attempts = {}  # unit key -> number of times handed out
+		self.done = set()   # unit keys; the return values of the worker function are not kept
+		self.failures = {}  # unit key -> the last error
+		self.task = ['task', task_spec, other_args, os.path.relpath(os.getcwd(), icgc_root)]
+		self.ledger = ledger
+		self.progress_channel = progress_channel
+		self.max_attempts = max_attempts
+		self.fail_fast = fail_fast
+		self.condition = threading.Condition()
+		self.closed = False
+		self.listener = Listener(address, authkey=authkey)
+		self.address = self.listener.address
+
+	def finished(self):
+		if self.fail_fast and self.failures: return True
+		return len(self.pending)==0 and len(self.leases)==0
+
+	# the methods below are called with the condition held
+	# final: the unit gave up on its own (exit()), and is not handed out again
+	def give_back(self, key, error, final=False):
+		[worker, expires, started] = self.leases.pop(key)
+		if self.progress_channel: self.progress_channel.put(('abandoned', worker, key, time.time(), 0))
+		if self.attempts[key] < self.max_attempts and not self.fail_fast and not final:
+			print("unit %s on %s: %s; back in the queue (attempt %d of %d)" %
+					(key, worker, error.split("\n")[0], self.attempts[key], self.max_attempts))
+			# first in line - it was probably a big one
+			self.pending.appendleft(key)
+		else:
+			print("unit %s on %s: %s; giving up after %d attempts" % (key, worker, error.split("\n")[0], self.attempts[key]))
+			self.failures[key] = error
+			if self.progress_channel: self.progress_channel.put(('failed', worker, key, time.time(), error))
+			if self.fail_fast:
+				# the units still out there are not waited for
+				for other in list(self.pending) + list(self.leases.keys()):
+					self.failures[other] = "not done (fail fast)"
+				self.pending.clear()
+		self.condition.notify_all()
+
+	def expire_leases(self):
+		now = time.time()
+		for key, [worker, expires, started] in list(self.leases.items()):
+			if expires<now: self.give_back(key, "lease expired")
+
+	#############
+	def lease(self, worker):
+		with self.condition:
+			self.expire_leases()
+			if self.closed or self.finished(): return ['done']
+			if len(self.pending)==0: return ['wait', 5]
+			key = self.pending.popleft()
+			self.attempts[key] = self.attempts.get(key, 0) + 1
+			now = time.time()
+			self.leases[key] = [worker, now+lease_seconds, now]
+			if self.progress_channel: self.progress_channel.put(('start', worker, key, now, 0))
+			return ['unit', key, self.units[key]]
+
+	def heartbeat(self, worker, key):
+		with self.condition:
+			if key in self.leases and self.leases[key][0]==worker:
+				self.leases[key][1] = time.time()+lease_seconds
+
+	def complete(self, worker, key, result, seconds):
+		with self.condition:
+			# a result that comes in after the lease was given to someone else still counts, but only once
+			if key in self.done or key in self.failures: return
+			if key in self.pending: self.pending.remove(key)
+			self.leases.pop(key, None)
+			self.done.add(key)
+			if self.ledger: self.ledger.record(self.units[key], seconds)
+			if self.progress_channel: self.progress_channel.put(('done', worker, key, time.time(), seconds))
+			self.condition.notify_all()
+
+	def fail(self, worker, key, error, final=False):
+		with self.condition:
+			if key in self.leases and self.leases[key][0]==worker: self.give_back(key, error, final)
+
+	def worker_lost(self, worker):
+		with self.condition:
+			for key in [k for k, lease in self.leases.items() if lease[0]==worker]:
+				self.give_back(key, "lost connection")
+
+	#############
+	def handle(self, conn):
+		worker = None
+		try:
+			while True:
+				message = conn.recv()
+				kind = message[0]
+				if kind=='hello':
+					worker = message[1]
+					conn.send(self.task)
+				elif kind=='lease':
+					conn.send(self.lease(worker))
+				elif kind=='heartbeat':
+					self.heartbeat(worker, message[1])
+					conn.send(['ok'])
+				elif kind=='result':
+					self.complete(worker, message[1], message[2], message[3])
+					conn.send(['ok'])
+				elif kind=='failed':
+					self.fail(worker, message[1], message[2], message[3])
+					conn.send(['ok'])
+		except (EOFError, OSError):
+			pass
+		finally:
+			conn.close()
+			if worker: self.worker_lost(worker)
+
+	def accept(self):
+		while not self.closed:
+			try:
+				conn = self.listener.accept()
+			except multiprocessing.AuthenticationError:
+				print("coordinator: an agent with the wrong authkey tried to connect")
+				continue
+			except OSError:
+				return # the listener is closed
+			threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+	# blocks until all units are done or given up on
+	def serve(self):
+		threading.Thread(target=self.accept, daemon=True).start()
+		with self.condition:
+			while not self.finished():
+				self.condition.wait(timeout=10)
+				self.expire_leases()
+		self.closed = True
+		self.listener.close()
+		return self.failures
+
+
+#########################################
+# task: the worker function itself, for the agents forked by the coordinating process;
+# the others get it by name, from the coordinator
+def agent(address, authkey, task=None):
+	worker = worker_name()
+	try:
+		conn = Client(address, authkey=authkey)
+	except (OSError, multiprocessing.AuthenticationError) as e:
+		print("agent %s: cannot connect to the coordinator at %s:%d (%s)" % (worker, address[0], address[1], str(e)))
+		return
+	lock = threading.Lock()
+	def ask(message):
+		with lock:
+			conn.send(message)
+			return conn.recv()
+
+	try:
+		[kind, task_spec, other_args, cwd] = ask(['hello', worker])
+		if task is None:
+			# the same relative place as the coordinator, if we have it
+			if os.path.isdir(os.path.join(icgc_root, cwd)): os.chdir(os.path.join(icgc_root, cwd))
+			task = load_function(task_spec)
+		while True:
+			reply = ask(['lease'])
+			if reply[0]=='done': break
+			if reply[0]=='wait':
+				time.sleep(reply[1])
+				continue
+			[kind, key, unit] = reply
+			working = threading.Event()
+			beat = threading.Thread(target=keep_lease, args=(ask, key, working), daemon=True)
+			beat.start()
+			time0 = time.time()
+			try:
+				# the return value stays here: the units write their results to the db or to files
+				if other_args is None:
+					task([unit])
+				else:
+					task([unit], other_args)
+				status = ['result', key, None, time.time()-time0]
+			except KeyboardInterrupt:
+				raise
+			except BaseException as e:
+				# including the exit() from error_intolerant_search and hard_landing_search
+				status = ['failed', key, "%s %s\n%s" % (type(e).__name__, str(e), traceback.format_exc(limit=3)),
+							isinstance(e, SystemExit)]
+			finally:
+				working.set()
+				beat.join()
+			ask(status)
+	except (EOFError, OSError):
+		pass # the coordinator is gone: either done, or nothing we can do about it
+	finally:
+		conn.close()
+
+def keep_lease(ask, key, working):
+	while not working.wait(lease_seconds/3):
+		ask(['heartbeat', key])
+
+
+#########################################
+# units: in the order in which they should be handed out
+# number_of_chunks: the number of agents on this box
+# returns the local agent processes (joined) and the failures, as a dict unit key -> the last error
+def distributed_pll(number_of_chunks, embarassingly_pllbl_fn, units, other_args, ledger=None, progress_channel=None,
+					max_attempts=max_attempts, fail_fast=False):
+	address = coordinator_address()
+	authkey = coordinator_authkey()
+	if authkey is None:
+		if address[0] not in ["localhost", "127.0.0.1"]:
+			print("please set ICGC_AUTHKEY for the coordinator listening on %s" % address[0])
+			exit(1)
+		# good for the local agents only
+		authkey = os.urandom(16)
+	coordinator = Coordinator(units, function_spec(embarassingly_pllbl_fn), other_args, address, authkey,
+								ledger=ledger, progress_channel=progress_channel, max_attempts=max_attempts, fail_fast=fail_fast)
+	print("coordinator listening on %s:%d, %d units" % (coordinator.address[0], coordinator.address[1], len(units)))
+
+	processes = []
+	for ps in range(number_of_chunks):
+		process = multiprocessing.Process(target=agent, args=(coordinator.address, authkey, embarassingly_pllbl_fn))
+		process.start()
+		processes.append(process)
+
+	failures = coordinator.serve()
+	for process in processes:
+		# with fail fast, the local agents do not get to finish what they are on
+		if fail_fast and failures: process.terminate()
+		process.join()
+	return processes, failures
+
+
+#########################################
+def main():
+	if len(sys.argv)<2:
+		print("usage: %s <coordinator host>:<port> [number of workers]" % sys.argv[0])
+		print("(with ICGC_AUTHKEY set to the same secret as in the coordinator's environment)")
+		exit()
+	host, port = sys.argv[1].rsplit(":", 1)
+	address = (host, int(port))
+	authkey = coordinator_authkey()
+	if authkey is None:
+		print("please set ICGC_AUTHKEY")
+		exit(1)
+	sys.path.insert(0, icgc_root)
+	if len(sys.argv)>2:
+		number_of_workers = int(sys.argv[2])
+	else:
+		from icgc_utils.processes import worker_count
+		number_of_workers = worker_count()
+	processes = []
+	for ps in range(number_of_workers):
+		process = multiprocessing.Process(target=agent, args=(address, authkey))
+		process.start()
+		processes.append(process)
+	for process in processes: process.join()
+
+
+#########################################
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,222 @@
+#
+# This source code is part of icgc, an ICGC processing pipeline.
+#
+# Icgc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Icgc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see<http://www.gnu.org/licenses/>.
+#
+# Contact: ivana.mihalek@gmail.com
+#
+
+# Embedded (serverless) stand-in for the mysql connection.
+# If Config.mysql_conf_file points to a *.duckdb or *.sqlite file instead of a mysql option file,
+# connect_to_mysql() returns an EmbeddedConnection, and search_db() & co work as before.
+# DuckDB is columnar, and a good deal faster than MyISAM on the big group-by queries
+# in 50_production and 60_nextgen_production; sqlite3 comes with python and is there as a fallback.
+# The file can be filled from the mysql database using 40_housekeeping/55_export_to_embedded_db.py
+#
+# This is meant for the read-heavy stages. Only the bits of mysql dialect that the pipeline
+# actually uses are translated (use, show tables/index, engine=..., insert ignore, information_schema, last_insert_id).
+
+import os, re, sqlite3
+import MySQLdb
+
+try:
+	import duckdb
+except ImportError:
+	duckdb = None
+
+embedded_suffixes = {'.duckdb':'duckdb', '.sqlite':'sqlite', '.sqlite3':'sqlite'}
+
+# statements that are expected to return something
+row_returning = ('select', 'show', 'with', 'describe', 'explain', 'pragma', 'values')
+
+#########################################
+def embedded_engine(path):
+	if not path: return None
+	return embedded_suffixes.get(os.path.splitext(path)[1].lower())
+
+
+#########################################
+def connect_to_embedded(path, databases=('icgc',)):
+	engine = embedded_engine(path)
+	if engine=='duckdb' and duckdb is None:
+		print("%s looks like a duckdb file, but the duckdb module is not installed (pip3 install duckdb)" % path)
+		exit(1)
+	try:
+		return EmbeddedConnection(path, engine, databases)
+	except Exception as e:
+		print("Error connecting to %s (%s) " % (path, str(e)))
+		exit(1)
+
+
+#########################################
+class EmbeddedConnection:
+
+	def __init__(self, path, engine, databases):
+		self.path   = path
+		self.engine = engine
+		# for duckdb, the databases are schemas within the file;
+		# sqlite does not do schemas, so there the db qualifiers are stripped from the queries
+		self.databases = list(databases)
+		# parametrized statements: template -> translated template
+		self.statement_cache = {}
+		if engine=='duckdb':
+			self.native = duckdb.connect(path)
+			for db_name in self.databases:
+				self.native.execute("create schema if not exists %s" % db_name)
+			self.native.execute("use %s" % self.databases[0])
+		else:
+			# isolation_level=None is autocommit, as with MyISAM
+			self.native = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+			self.create_sqlite_information_schema()
+
+	def create_sqlite_information_schema(self):
+		schema = self.databases[0]
+		qry  = "create temp view if not exists information_schema_tables as "
+		qry += "select '%s' as table_schema, name as table_name from sqlite_master where type='table'" % schema
+		self.native.execute(qry)
+		qry  = "create temp view if not exists information_schema_columns as "
+		qry += "select '%s' as table_schema, m.name as table_name, p.name as column_name, " % schema
+		qry += "p.type as data_type, p.cid+1 as ordinal_position "
+		qry += "from sqlite_master m join pragma_table_info(m.name) p where m.type='table'"
+		self.native.execute(qry)
+
+	# search_db uses this as the connection key (in the schema cache)
+	def thread_id(self):
+		return id(self)
+
+	# cursorclass is there to swallow MySQLdb.cursors.SSCursor from iter_db -
+	# both engines stream results with fetchmany anyway
+	def cursor(self, cursorclass=None):
+		return EmbeddedCursor(self)
+
+	def commit(self):
+		if self.engine=='sqlite': return
+		self.native.commit()
+
+	def close(self):
+		self.native.close()
+
+
+#########################################
+class EmbeddedCursor:
+
+	def __init__(self, connection):
+		self.connection = connection
+		self.native = connection.native.cursor()
+		self.rowcount = -1
+		self.has_rows = False
+		self.pending  = None
+
+	def execute(self, qry, args=None):
+		if args is None:
+			translated = translate_qry(qry, self.connection)
+		else:
+			translated = translate_prepared(qry, self.connection)
+		self.has_rows = False
+		self.pending  = None
+		self.rowcount = -1
+		if translated is None: return  # nothing to do in the embedded world
+		if type(translated)==list:     # the answer is known without asking
+			self.pending  = translated
+			self.has_rows = True
+			return
+		try:
+			if args is None:
+				self.native.execute(translated)
+			else:
+				self.native.execute(translated, list(args))
+		except Exception as e:
+			# keep the search_db() error handling as it is
+			raise MySQLdb.OperationalError(0, "%s (embedded qry: %s)" % (str(e), translated))
+		self.has_rows = translated.lstrip()[:8].lower().startswith(row_returning)
+		self.rowcount = getattr(self.native, 'rowcount', -1)
+
+	def fetchall(self):
+		if not self.has_rows: return []
+		if self.pending is not None:
+			rows, self.pending = self.pending, []
+			return rows
+		return self.native.fetchall()
+
+	def fetchmany(self, size):
+		if not self.has_rows: return []
+		if self.pending is not None:
+			rows, self.pending = self.pending[:size], self.pending[size:]
+			return rows
+		return self.native.fetchmany(size)
+
+	def executemany(self, qry, rows):
+		self.native.executemany(translate_qry(qry, self.connection), rows)
+
+	def close(self):
+		self.native.close()
+
+
+#########################################
+engine_clause  = re.compile(r"\s+engine\s*=\s*\w+", re.IGNORECASE)
+use_stmt       = re.compile(r"^\s*use\s+(\w+)\s*;?\s*$", re.IGNORECASE)
+show_tables    = re.compile(r"^\s*show\s+tables\s+like\s+('[^']*')\s*$", re.IGNORECASE)
+show_index     = re.compile(r"^\s*show\s+index\s+from\s+", re.IGNORECASE)
+create_index   = re.compile(r"^\s*create\s+index\s+(\w+)\s+on\s+([\w\.]+)\s*(\(.*\))\s*$", re.IGNORECASE|re.DOTALL)
+last_insert_id = re.compile(r"last_insert_id\(\)", re.IGNORECASE)
+mysql_insert   = re.compile(r"^\s*insert\s+(ignore\s+)?(into\s+)?", re.IGNORECASE)
+
+# the parametrized statements are translated once per template;
+# both engines take ? for the placeholders
+mysql_placeholder = re.compile(r"%(s|%)")
+def translate_prepared(qry, connection):
+	if qry not in connection.statement_cache:
+		translated = translate_qry(qry, connection)
+		if type(translated)==str:
+			translated = mysql_placeholder.sub(lambda m: "?" if m.group(1)=="s" else "%", translated)
+		connection.statement_cache[qry] = translated
+	return connection.statement_cache[qry]
+
+def translate_qry(qry, connection):
+	engine = connection.engine
+	qry = engine_clause.sub("", qry)
+	# mysql is fine with 'insert ignore table ...'
+	match = mysql_insert.match(qry)
+	if match: qry = ("insert or ignore into " if match.group(1) else "insert into ") + qry[match.end():]
+
+	if use_stmt.match(qry):
+		return qry if engine=='duckdb' else None
+
+	match = show_tables.match(qry)
+	if match:
+		if engine=='duckdb':
+			return "select table_name from information_schema.tables where table_schema=current_schema() and table_name like %s" % match.group(1)
+		return "select name from sqlite_master where type='table' and name like %s" % match.group(1)
+
+	# index bookkeeping is not worth emulating: pretend there is none ...
+	if show_index.match(qry): return []
+	match = create_index.match(qry)
+	if match:
+		# ... and in the columnar world we do not need them, while sqlite wants index names unique per db
+		if engine=='duckdb': return None
+		index_name, table, columns = match.groups()
+		table = table.split(".")[-1]
+		return "create index if not exists %s_%s on %s %s" % (table, index_name, table, columns)
+
+	if engine=='duckdb':
+		if last_insert_id.search(qry): return None
+		return qry
+
+	# sqlite from here on
+	qry = last_insert_id.sub("last_insert_rowid()", qry)
+	qry = qry.replace("information_schema.tables", "information_schema_tables")
+	qry = qry.replace("information_schema.columns", "information_schema_columns")
+	for db_name in connection.databases:
+		qry = re.sub(r"\b%s\." % db_name, "", qry)
+	return qry
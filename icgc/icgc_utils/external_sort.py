@@ -0,0 +1,64 @@
+#
+# This source code is part of icgc, an ICGC processing pipeline.
+#
+# Icgc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Icgc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see<http://www.gnu.org/licenses/>.
+#
+# Contact: ivana.mihalek@gmail.com
+#
+
+# External merge sort, with bounded memory: the rows are sorted in runs of run_rows at a time,
+# each run goes to a temporary tsv file, and heapq.merge reads them back in order,
+# holding one row per run in memory. If everything fits in a single run, the disk is not touched.
+# The rows are lists (or tuples) of strings or None; the sort is stable.
+#     for row in external_sort(rows, key=position_key, tmpdir="tsvs"): ...
+
+import os, heapq, shutil, tempfile
+from itertools import islice
+
+#########################################
+def encode_row(row):
+	return "\t".join(["\\N" if value is None else value for value in row]) + "\n"
+
+
+def decode_row(line):
+	return [None if value=="\\N" else value for value in line.rstrip("\n").split("\t")]
+
+
+#########################################
+def external_sort(rows, key, run_rows=500000, tmpdir=None):
+	rows = iter(rows)
+	first_run = list(islice(rows, run_rows))
+	first_run.sort(key=key)
+	if len(first_run)<run_rows:
+		yield from first_run
+		return
+
+	workdir = tempfile.mkdtemp(prefix="external_sort_", dir=tmpdir)
+	try:
+		runs = []
+		run, first_run = first_run, None
+		while run:
+			path = os.path.join(workdir, "run_%05d.tsv" % len(runs))
+			with open(path, "w") as outf:
+				outf.writelines(map(encode_row, run))
+			runs.append(path)
+			run = list(islice(rows, run_rows))
+			run.sort(key=key)
+		run_files = [open(path) for path in runs]
+		try:
+			yield from heapq.merge(*[map(decode_row, run_file) for run_file in run_files], key=key)
+		finally:
+			for run_file in run_files: run_file.close()
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
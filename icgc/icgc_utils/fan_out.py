@@ -0,0 +1,80 @@
+#
+# This source code is part of icgc, an ICGC processing pipeline.
+#
+# Icgc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Icgc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see<http://www.gnu.org/licenses/>.
+#
+# Contact: ivana.mihalek@gmail.com
+#
+
+# Per-table (per-tumor) query fan-out for the production scripts.
+# The production scripts spend almost all of their time waiting on mysql, one tumor table at a time.
+# fan_out() runs the per-table function in a small pool of threads, each with its own connection,
+# and hands the results back in the order of the input tables, so the output files
+# come out exactly as they did in the serial version.
+# MySQLdb releases the GIL while waiting on the server, so threads are enough here,
+# and unlike parallelize() the results come back without any pickling.
+# Keep the per-table function to queries and number crunching - printing, plotting (matplotlib is
+# not thread safe) and writing to files belong in the main loop, which gets the results in order.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from icgc_utils.mysql import connect_to_mysql, switch_to_db
+
+# the server has its own opinion about how many heavy group-by queries it can run at once
+default_number_of_connections = 4
+
+#########################################
+def fan_out(number_of_connections, per_table_fn, tables, other_args, conf_file, db_name="icgc"):
+	# per_table_fn(cursor, table, other_args) -> whatever the main loop needs for this table
+	# returns the list of results, in the same order as tables
+
+	if number_of_connections < 1:
+		print("number of connections is expected to be >= 1")
+		return False
+	number_of_connections = min(number_of_connections, len(tables))
+	if number_of_connections <= 1:
+		db = connect_to_mysql(conf_file)
+		cursor = db.cursor()
+		if db_name: switch_to_db(cursor, db_name)
+		results = [per_table_fn(cursor, table, other_args) for table in tables]
+		cursor.close()
+		db.close()
+		return results
+
+	local = threading.local()
+	opened = []
+	opened_lock = threading.Lock()
+
+	def thread_cursor():
+		if not hasattr(local, 'cursor'):
+			local.db = connect_to_mysql(conf_file)
+			local.cursor = local.db.cursor()
+			if db_name: switch_to_db(local.cursor, db_name)
+			with opened_lock: opened.append((local.db, local.cursor))
+		return local.cursor
+
+	def run(table):
+		return per_table_fn(thread_cursor(), table, other_args)
+
+	try:
+		with ThreadPoolExecutor(max_workers=number_of_connections) as executor:
+			# map() preserves the input order; an exception in any of the
+			# workers (including exit() from hard_landing_search) is re-raised here
+			results = list(executor.map(run, tables))
+	finally:
+		for db, cursor in opened:
+			cursor.close()
+			db.close()
+
+	return results
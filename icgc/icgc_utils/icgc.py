@@ -18,11 +18,14 @@
 # Contact: ivana.mihalek@gmail.com
 #
 from icgc_utils.mysql import switch_to_db, search_db, check_table_exists
+from icgc_utils.schema_manifest import manifest_column_definitions
+from icgc_utils.somatic_tsv import temp_table_columns
 
 
 #########################################
 # these are original ICGC tables
-def make_temp_somatic_muts_table(cursor, db_name, table_name):
+# with the manifest (see schema_manifest.py) the column types and widths are the ones found in the release
+def make_temp_somatic_muts_table(cursor, db_name, table_name, manifest=None):
 
 	switch_to_db (cursor, db_name)
 
@@ -30,6 +33,10 @@ def make_temp_somatic_muts_table(cursor, db_name, table_name):
 		qry = "drop table " + table_name
 		search_db(cursor, qry, verbose=True)
 
+	if manifest:
+		make_temp_somatic_muts_table_from_manifest(cursor, table_name, manifest)
+		return
+
 
 	qry = ""
 	qry += "  CREATE TABLE  %s (" % table_name
@@ -74,6 +81,36 @@ def make_temp_somatic_muts_table(cursor, db_name, table_name):
 	print(rows)
 
 
+#########################################
+# the indices on the temp tables, built by 10_make_indices_on_temp_tables
+# (or by 09_load_mysql, from the sorted tsvs)
+temp_table_indices = [
+	['somatic_mut_idx',     ['icgc_mutation_id']],
+	['somatic_donor_idx',   ['icgc_donor_id']],
+	['sample_idx',          ['submitted_sample_id']],
+	['mut_gene_idx',        ['icgc_mutation_id', 'gene_affected']],
+	['chrom_start_pos_idx', ['chromosome', 'start_position']],
+	['chrom_end_pos_idx',   ['chromosome', 'end_position']]
+]
+
+
+#########################################
+def make_temp_somatic_muts_table_from_manifest(cursor, table_name, manifest):
+	# the ids and the like are strings, even when they look like numbers
+	string_columns = [name for name in temp_table_columns if name not in
+						['start_position', 'end_position', 'total_read_count', 'mutant_allele_read_count']]
+	definitions = manifest_column_definitions(manifest, 'simple_somatic_temp', temp_table_columns[1:], string_columns)
+	qry  = "CREATE TABLE  %s (" % table_name
+	qry += "id INT NOT NULL, "
+	qry += ", ".join(definitions) + ", "
+	qry += "PRIMARY KEY (id) "
+	qry += ") ENGINE=MyISAM"
+
+	rows = search_db(cursor, qry)
+	print(qry)
+	print(rows)
+
+
 #########################################
 # icgc_donor_id,submitted_donor_id,donor_sex,donor_diagnosis_icd10
 # submitted donor ids can be very long especially for TCGA donors
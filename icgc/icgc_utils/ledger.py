@@ -0,0 +1,133 @@
+#
+# This source code is part of icgc, an ICGC processing pipeline.
+#
+# Icgc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Icgc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see<http://www.gnu.org/licenses/>.
+#
+# Contact: ivana.mihalek@gmail.com
+#
+
+# Checkpoint/resume ledger for the long parallel stages.
+# Each stage gets a small sqlite file in the working directory (<script>.v<release>.<db>.ledger.sqlite), with one row
+# per finished unit of work (a table, a chromosome, a (table, chromosome) pair ...) and the time it took.
+# Resuming is explicit: only when the stage is run with --resume does parallelize(..., ledger=stage_ledger())
+# skip the units already in the ledger, so that after a crash only the unfinished part is rerun.
+# Without --resume the ledger is cleared as the stage starts, and parallelize clears it again once all units are done,
+# so a finished stage leaves nothing behind for the next run (or the next release) to skip.
+# While a run is going on (or after it crashed), the timings can serve as weights: parallelize(..., weights=ledger.runtimes()).
+
+import os, sys, time, sqlite3
+
+#########################################
+def resume_requested():
+	return "--resume" in sys.argv[1:]
+
+
+#########################################
+# db_name: the database the stage writes to
+# ledger.resuming tells the stage whether there is a previous run to pick up from
+def stage_ledger(db_name="icgc", namespace="", path=None):
+	if not path:
+		script = os.path.basename(sys.argv[0]).replace(".py", "") if sys.argv and sys.argv[0] else "interactive"
+		try:
+			from config import Config
+			release = Config.icgc_release
+		except ImportError:
+			release = "unknown"
+		path = "{}/{}.v{}.{}.ledger.sqlite".format(os.getcwd(), script, release, db_name)
+	ledger = Ledger(path, namespace)
+	if resume_requested():
+		ledger.resuming = len(ledger.completed())>0
+		if ledger.resuming: print("resuming from %s" % ledger.path)
+	else:
+		ledger.reset()
+	return ledger
+
+
+#########################################
+class Ledger:
+
+	def __init__(self, path, namespace=""):
+		self.path = os.path.abspath(path)
+		self.namespace = namespace
+		# the sqlite connection is opened lazily, and per process -
+		# a connection must not cross the fork into the parallelized workers
+		self.handle = None
+		self.pid = None
+		self.resuming = False
+		self.connection().execute("create table if not exists units (namespace text, unit text, " +
+								"seconds real, pid integer, finished text, primary key (namespace, unit))")
+
+	def connection(self):
+		if self.handle is None or self.pid!=os.getpid():
+			# several workers write at the same time; wait for the lock rather than fail
+			# (in the distributed mode the records are written from the coordinator's connection threads, one at a time)
+			self.handle = sqlite3.connect(self.path, timeout=120, isolation_level=None, check_same_thread=False)
+			self.handle.execute("pragma journal_mode=wal")
+			self.handle.execute("pragma synchronous=normal")
+			self.pid = os.getpid()
+		return self.handle
+
+	# the units are whatever parallelize hands out; they are stored as strings
+	@staticmethod
+	def unit_key(unit):
+		return str(unit)
+
+	def completed(self):
+		qry = "select unit from units where namespace=?"
+		return set([row[0] for row in self.connection().execute(qry, (self.namespace,))])
+
+	def is_done(self, unit):
+		qry = "select 1 from units where namespace=? and unit=?"
+		return self.connection().execute(qry, (self.namespace, self.unit_key(unit))).fetchone() is not None
+
+	def record(self, unit, seconds):
+		qry = "insert or replace into units values (?, ?, ?, ?, ?)"
+		finished = time.strftime("%Y-%m-%d %H:%M:%S")
+		self.connection().execute(qry, (self.namespace, self.unit_key(unit), seconds, os.getpid(), finished))
+
+	def pending(self, units):
+		done = self.completed()
+		return [unit for unit in units if self.unit_key(unit) not in done]
+
+	# the recorded units that are not among the ones given - the plan changed since the last run
+	def unknown(self, units):
+		keys = set([self.unit_key(unit) for unit in units])
+		return [key for key in self.completed() if key not in keys]
+
+	def runtimes(self):
+		qry = "select unit, seconds from units where namespace=?"
+		return dict(self.connection().execute(qry, (self.namespace,)).fetchall())
+
+	def reset(self):
+		self.connection().execute("delete from units where namespace=?", (self.namespace,))
+
+
+#########################################
+# parallelize wraps the worker function in this when given a ledger:
+# the function is called one unit at a time, and each unit is recorded when it returns
+# (a unit that crashes the worker, or exits on a db error, does not make it to the ledger)
+class LedgeredTask:
+
+	def __init__(self, embarassingly_pllbl_fn, ledger):
+		self.embarassingly_pllbl_fn = embarassingly_pllbl_fn
+		self.ledger = ledger
+
+	def __call__(self, units, other_args):
+		for unit in units:
+			time0 = time.time()
+			if other_args==None:
+				self.embarassingly_pllbl_fn([unit])
+			else:
+				self.embarassingly_pllbl_fn([unit], other_args)
+			self.ledger.record(unit, time.time()-time0)
@@ -1,4 +1,4 @@
-import MySQLdb, sys, os
+import MySQLdb, MySQLdb.cursors, sys, os, tempfile, time, threading
 #
 # This source code is part of icgc, an ICGC processing pipeline.
 # 
@@ -46,13 +46,38 @@ def check_null (variable):
 	return variable
 
 
+########
+# what we know about the schema, per connection: the current database,
+# and, per (db, table), the column names, the index names, and whether the table exists
+# the cache for the connection is dropped on every DDL statement that goes through search_db
+schema_cache = {}
+ddl_keywords = ('create', 'drop', 'alter', 'rename')
+
+def connection_schema_cache(cursor):
+	# thread_id is the server side connection id; it changes on reconnect,
+	# in which case we start with a clean slate
+	key = cursor.connection.thread_id()
+	if key not in schema_cache:
+		schema_cache[key] = {'current_db':None, 'tables':set(), 'columns':{}, 'indices':{}}
+	return schema_cache[key]
+
+def clear_schema_cache(cursor):
+	cache = connection_schema_cache(cursor)
+	cache['tables'].clear()
+	cache['columns'].clear()
+	cache['indices'].clear()
+
+
 ########
 def switch_to_db (cursor, db_name):
+	cache = connection_schema_cache(cursor)
+	if cache['current_db']==db_name: return True
 	qry = "use %s" % db_name
 	rows = search_db (cursor, qry, verbose=False)
 	if (rows):
 		print(rows)
 		return False
+	cache['current_db'] = db_name
 	return True
 
 
@@ -71,6 +96,18 @@ def get_table_size(cursor, db_name, tables, as_list = False):
 	return table_size
 
 
+########
+# how many more connections the server is willing to take (None if we cannot tell - e.g. the embedded db)
+def mysql_spare_connections(cursor, reserve=5):
+	limits = {}
+	for qry in ["show variables like 'max_connections'", "show status like 'Threads_connected'"]:
+		ret = search_db(cursor, qry)
+		if not ret or type(ret[0][0])!=str or len(ret[0])<2 or 'error' in ret[0][0].lower(): return None
+		limits[ret[0][0].lower()] = int(ret[0][1])
+	# leave a few for the interactive sessions and the parent process
+	return max(0, limits['max_connections'] - limits['threads_connected'] - reserve)
+
+
 ########
 def val2mysqlval(value):
 	if  value is None:
@@ -164,6 +201,196 @@ def store_or_update (cursor, table, fixed_fields, update_fields, verbose=False,
 	return row_id
 
 
+#########################################
+def val2tsvval(value):
+	if value is None:
+		return "\\N"
+	value = "{}".format(value)
+	for special, escaped in [("\\","\\\\"), ("\t","\\t"), ("\n","\\n")]:
+		value = value.replace(special, escaped)
+	return value
+
+
+#########################################
+# buffers rows per (table, columns) and sends them in one go,
+# either as a multi-row insert or through load data local infile
+# use it as
+#    with BulkWriter(cursor, flush_size=5000) as writer:
+#        writer.add('mutation2gene', {'icgc_mutation_id':mut_id, 'gene_symbol':symbol})
+# whatever is left in the buffer gets flushed on the exit from the with-block
+# note that, unlike store_without_checking, the writer does not return row ids
+class BulkWriter:
+
+	def __init__(self, cursor, flush_size=1000, database=None, ignore=False, load_data=False, verbose=False):
+		self.cursor     = cursor
+		self.flush_size = flush_size
+		self.database   = database
+		self.ignore     = ignore
+		# load data local infile needs local_infile enabled both on the client and the server
+		self.load_data  = load_data
+		self.verbose    = verbose
+		self.buffer     = {}
+		self.rows_written = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		# if we are on the way out because of an exception, we do not want to store half-baked stuff
+		if exc_type is None: self.flush()
+		return False
+
+	def add(self, table, fields):
+		key = (table, tuple(fields.keys()))
+		if key not in self.buffer: self.buffer[key] = []
+		self.buffer[key].append(tuple(fields.values()))
+		if len(self.buffer[key])>=self.flush_size: self.flush_buffer(key)
+
+	def flush(self):
+		for key in list(self.buffer.keys()):
+			self.flush_buffer(key)
+
+	def flush_buffer(self, key):
+		rows = self.buffer.pop(key, None)
+		if not rows: return
+		table, columns = key
+		full_table_name = "%s.%s"%(self.database, table) if self.database else table
+		if self.load_data:
+			self.load_rows(full_table_name, columns, rows)
+		else:
+			self.insert_rows(full_table_name, columns, rows)
+		self.rows_written += len(rows)
+
+	def insert_rows(self, full_table_name, columns, rows):
+		qry  = "insert "
+		if self.ignore: qry += "ignore "
+		qry += "into %s (%s) values " % (full_table_name, ",".join(columns))
+		qry += ",".join(["(" + ",".join([val2mysqlval(v) for v in row]) + ")" for row in rows])
+		ret = search_db(self.cursor, qry)
+		if ret:
+			# do not print the whole qry - it can be megabytes long
+			print("Error in bulk insert into %s (%d rows):" % (full_table_name, len(rows)), ret[1])
+			exit()
+
+	def load_rows(self, full_table_name, columns, rows):
+		# /dev/shm is in-memory filesystem, so nothing hits the disk on the client side
+		tmpdir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+		tmpf = tempfile.NamedTemporaryFile(mode="w", suffix=".tsv", dir=tmpdir, delete=False)
+		for row in rows:
+			tmpf.write("\t".join([val2tsvval(v) for v in row]) + "\n")
+		tmpf.close()
+		qry  = "load data local infile '%s' " % tmpf.name
+		if self.ignore: qry += "ignore "
+		qry += "into table %s (%s)" % (full_table_name, ",".join(columns))
+		ret = search_db(self.cursor, qry, verbose=self.verbose)
+		os.remove(tmpf.name)
+		if ret:
+			print("Error in bulk load into %s (%d rows):" % (full_table_name, len(rows)), ret[1])
+			exit()
+
+
+#########################################
+# load data local infile straight from a generator, with nothing written to disk:
+# a thread writes the rows into a named pipe, and mysql reads them from the other end
+# rows: tuples in the order of the columns; returns the number of rows sent
+# if the generator fails half way, whatever was sent is loaded, and the exception is raised here
+def stream_load(cursor, table, columns, rows, ignore=False, verbose=False):
+
+	if getattr(cursor.connection, 'engine', None):
+		# the embedded backends do not do load data; multi-row inserts will have to do
+		with BulkWriter(cursor, flush_size=10000, ignore=ignore) as writer:
+			for row in rows: writer.add(table, dict(zip(columns, row)))
+		return writer.rows_written
+
+	tmpdir = tempfile.mkdtemp(prefix="stream_load_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+	fifo = os.path.join(tmpdir, "rows.tsv")
+	os.mkfifo(fifo)
+	sent   = [0]
+	errors = []
+	def feed():
+		try:
+			with open(fifo, "w") as outf:
+				for row in rows:
+					outf.write("\t".join([val2tsvval(v) for v in row]) + "\n")
+					sent[0] += 1
+		except BrokenPipeError:
+			pass # mysql stopped reading - the error is in ret below
+		except Exception as e:
+			errors.append(e)
+	feeder = threading.Thread(target=feed, daemon=True)
+	feeder.start()
+
+	qry  = "load data local infile '%s' " % fifo
+	if ignore: qry += "ignore "
+	qry += "into table %s (%s)" % (table, ",".join(columns))
+	try:
+		ret = search_db(cursor, qry, verbose=verbose)
+	finally:
+		# if mysql never opened the pipe, or stopped reading, the feeder is stuck: open the other end and drain it
+		while feeder.is_alive():
+			fd = os.open(fifo, os.O_RDONLY|os.O_NONBLOCK)
+			try:
+				while os.read(fd, 1<<16): pass
+			except BlockingIOError:
+				pass
+			os.close(fd)
+			feeder.join(timeout=1)
+		os.remove(fifo)
+		os.rmdir(tmpdir)
+
+	if errors: raise errors[0]
+	if ret:
+		print("Error in stream load into %s (%d rows sent):" % (table, sent[0]), ret[1])
+		exit()
+	return sent[0]
+
+
+#########################################
+# set-based replacement for a loop of single-row updates:
+# rows is a list of dicts, each containing the key_cols and the columns to be updated, as in
+#    bulk_update(cursor, 'mutations_chrom_1', ['icgc_mutation_id'], [{'icgc_mutation_id':'MU1', 'pathogenicity_estimate':1}, ...])
+# the rows are loaded into a temporary table, and the target is updated in a single update ... join
+# if the same key appears more than once, the last row wins
+def bulk_update(cursor, table, key_cols, rows, load_data=True, verbose=False):
+
+	if not rows: return 0
+	value_cols = [col for col in rows[0].keys() if col not in key_cols]
+	if not value_cols:
+		print("bulk_update: no columns to update in", table)
+		exit()
+	columns = key_cols + value_cols
+
+	latest = {}
+	for row in rows:
+		latest[tuple([row[col] for col in key_cols])] = row
+
+	# the temp table inherits the column types from the target;
+	# MEMORY engine does not do text columns, in which case we fall back on MyISAM
+	tmp_table = "bulk_update_%d_%s" % (os.getpid(), table.split(".")[-1])
+	search_db(cursor, "drop temporary table if exists %s" % tmp_table)
+	for engine in ["MEMORY", "MyISAM"]:
+		qry  = "create temporary table %s engine=%s " % (tmp_table, engine)
+		qry += "select %s from %s limit 0" % (",".join(columns), table)
+		ret = search_db(cursor, qry, verbose=(engine=="MyISAM"))
+		if not ret: break
+	if ret: exit()
+	error_intolerant_search(cursor, "alter table %s add primary key (%s)" % (tmp_table, ",".join(key_cols)))
+
+	with BulkWriter(cursor, flush_size=50000, load_data=load_data, verbose=verbose) as writer:
+		for row in latest.values():
+			writer.add(tmp_table, {col:row[col] for col in columns})
+
+	qry  = "update %s t join %s u on " % (table, tmp_table)
+	qry += " and ".join(["t.{}=u.{}".format(col, col) for col in key_cols])
+	qry += " set " + ",".join(["t.{}=u.{}".format(col, col) for col in value_cols])
+	error_intolerant_search(cursor, qry)
+	rows_updated = cursor.rowcount
+
+	search_db(cursor, "drop temporary table if exists %s" % tmp_table)
+	if verbose: print("bulk_update: %d rows staged, %d rows in %s updated" % (len(latest), rows_updated, table))
+	return rows_updated
+
+
 #########################################
 def create_index (cursor, db_name, index_name, table, columns, verbose=False):
 
@@ -171,9 +398,7 @@ def create_index (cursor, db_name, index_name, table, columns, verbose=False):
 		return False
 
 	# check whether this index exists already
-	qry = "show index from %s where key_name like '%s'" % ( table, index_name)
-	rows = error_intolerant_search(cursor, qry)
-	if (rows):return True
+	if index_name in get_index_names(cursor, db_name, table): return True
 
 	# columns is a list of columns that we want to have indexed
 	qry = "create index %s on %s (%s)" % (index_name, table, ",".join(columns))
@@ -182,9 +407,85 @@ def create_index (cursor, db_name, index_name, table, columns, verbose=False):
 	return True
 
 
+#########################################
+# all the indices in one alter table: MyISAM copies the table and sorts the keys once,
+# rather than once per create index
+# index_specs: [[index_name, [columns]], ...]; the indices that exist already are skipped
+# disable_keys: leave the (non-unique) indices disabled, to be filled in by enable_keys()
+# after the table is loaded - for the indices that go on an empty table
+def create_indices(cursor, db_name, table, index_specs, disable_keys=False, verbose=False):
+
+	if  not switch_to_db (cursor, db_name):
+		return False
+
+	if getattr(cursor.connection, 'engine', None):
+		# the embedded backends do not do alter table ... add index
+		return all([create_index(cursor, db_name, name, table, columns, verbose) for name, columns in index_specs])
+
+	existing = get_index_names(cursor, db_name, table)
+	clauses = ["add index %s (%s)" % (name, ",".join(columns)) for name, columns in index_specs if name not in existing]
+	if clauses:
+		qry = "alter table %s.%s %s" % (db_name, table, ", ".join(clauses))
+		if verbose: print(qry)
+		rows = error_intolerant_search(cursor, qry)
+		if (rows): return False
+	if disable_keys: set_keys(cursor, db_name, table, enabled=False)
+	return True
+
+
+#########################################
+# disable keys stops the updates of the non-unique MyISAM indices; enable keys rebuilds them, by sorting
+def set_keys(cursor, db_name, table, enabled=True):
+	if getattr(cursor.connection, 'engine', None): return
+	error_intolerant_search(cursor, "alter table %s.%s %s keys" % (db_name, table, "enable" if enabled else "disable"))
+
+
+def enable_keys(cursor, db_name, table):
+	set_keys(cursor, db_name, table, enabled=True)
+
+
+#########################################
+# for the loads into a table that has its indices already:
+#     with keys_disabled(cursor, "icgc", table):
+#         stream_load(cursor, table, ...)
+# the non-unique indices are rebuilt once at the end, rather than updated row by row
+class keys_disabled:
+
+	def __init__(self, cursor, db_name, table):
+		self.cursor  = cursor
+		self.db_name = db_name
+		self.table   = table
+
+	def __enter__(self):
+		set_keys(self.cursor, self.db_name, self.table, enabled=False)
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		# even if the load failed - a table with disabled keys looks fine, but the queries do not use them
+		set_keys(self.cursor, self.db_name, self.table, enabled=True)
+		return False
+
+
+#########################################
+def get_index_names (cursor, db_name, table_name):
+
+	indices = connection_schema_cache(cursor)['indices']
+	if (db_name, table_name) in indices: return indices[(db_name, table_name)]
+
+	qry = "show index from %s.%s" % (db_name, table_name)
+	rows = error_intolerant_search(cursor, qry)
+	# the third field is key_name; multi-column indices appear once per column
+	index_names = set([row[2] for row in rows]) if rows else set()
+	indices[(db_name, table_name)] = index_names
+	return index_names
+
+
 #########################################
 def get_column_names (cursor, db_name, table_name):
 
+	columns = connection_schema_cache(cursor)['columns']
+	if (db_name, table_name) in columns: return list(columns[(db_name, table_name)])
+
 	qry  = "select c.column_name from information_schema.columns c "
 	qry += "where c.table_schema='%s' and c.table_name='%s'" % (db_name, table_name)
 
@@ -194,7 +495,8 @@ def get_column_names (cursor, db_name, table_name):
 			rows = search_db (cursor, qry, verbose=True)
 			return False
 		else:
-			return [row[0] for row in rows]
+			columns[(db_name, table_name)] = [row[0] for row in rows]
+			return list(columns[(db_name, table_name)])
 	else:
 		return False
 
@@ -205,15 +507,10 @@ def column_exists (cursor, db_name, table_name, column_name):
 	if  not switch_to_db (cursor, db_name):
 		return False
 
-	qry = "show columns from "+ table_name + " like '%s'" % column_name
-	rows = search_db (cursor, qry, verbose=False)
-	if (rows):
-		if ( 'Error' in rows[0]):
-			return False
-		else:
-			return True
-	else:
-		return False
+	column_names = get_column_names(cursor, db_name, table_name)
+	if not column_names: return False
+	# mysql column names are case insensitive
+	return column_name.lower() in [c.lower() for c in column_names]
 
 
 #########################################
@@ -250,12 +547,17 @@ def check_table_exists (cursor, db_name, table_name):
 	if  not switch_to_db (cursor, db_name):
 		return False
 
+	# only the existing tables are remembered - the missing ones tend to get created
+	tables = connection_schema_cache(cursor)['tables']
+	if (db_name, table_name) in tables: return True
+
 	qry = "show tables like '%s'" % table_name
 	rows = search_db (cursor, qry, verbose=False)
 	if (rows):
 		if ( 'Error' in rows[0]):
 			return False
 		else:
+			tables.add((db_name, table_name))
 			return True
 	else:
 		return False
@@ -280,30 +582,45 @@ def table_create_time (cursor, db_name, table_name):
 		return rows[0][0]
 
 import warnings
+from icgc_utils.query_stats import query_stats, record_query
+from icgc_utils.embedded import embedded_engine, connect_to_embedded
 #######
-def search_db(cursor, qry, verbose=False):
+# parametrized form, for the per-row lookups in the hot loops:
+#    search_db(cursor, "select ... from mutations_chrom_%s where icgc_mutation_id=%%s" % chrom, args=[mut_id])
+# the values in args are escaped by the driver (so no quotify), and the statement template
+# (the qry itself) is what the query stats and the embedded backend translation are keyed on;
+# note that in a parametrized qry a literal % has to be written as %%
+def search_db(cursor, qry, verbose=False, args=None):
 	warnings.filterwarnings('ignore', category=MySQLdb.Warning)
+	# whatever we knew about the schema might not be true any more
+	if qry.lstrip()[:6].lower().startswith(ddl_keywords): clear_schema_cache(cursor)
+	time0 = time.time() if query_stats['enabled'] else None
 	try:
-		cursor.execute(qry)
+		if args is None:
+			cursor.execute(qry)
+		else:
+			cursor.execute(qry, args)
 	except MySQLdb.Error as e:
 		if verbose:
-			print("Error running cursor.execute() for  qry:\n%s\n%s" % (qry, e.args[1]))
+			print("Error running cursor.execute() for  qry:\n%s\n%s" % (qry_w_args(qry, args), e.args[1]))
 		return [["Error"], e.args]
 	except MySQLdb.Warning as e: # this does not work for me - therefore filterwarnings
 		if verbose:
-			print("Warning running cursor.execute() for  qry:\n%s\n%s" % (qry, e.args[1]))
+			print("Warning running cursor.execute() for  qry:\n%s\n%s" % (qry_w_args(qry, args), e.args[1]))
 		return [["Warning"], e.args]
 
 	try:
 		rows = cursor.fetchall()
 	except MySQLdb.Error as e:
 		if verbose:
-			print("Error running cursor.fetchall() for  qry:\n%s\n%s" % (qry, e.args[1]))
+			print("Error running cursor.fetchall() for  qry:\n%s\n%s" % (qry_w_args(qry, args), e.args[1]))
 		return [["Error"], e.args]
 
+	if time0 is not None: record_query(cursor, qry, time.time()-time0, len(rows), args)
+
 	if len(rows) == 0:
 		if verbose:
-			print("No return for query:\n%s" % qry)
+			print("No return for query:\n%s" % qry_w_args(qry, args))
 		return False
 
 	# since python3 fetchall returns bytes inst of str in some  random fashion
@@ -316,19 +633,55 @@ def search_db(cursor, qry, verbose=False):
 	return rows_clean
 
 #########################################
-def error_intolerant_search(cursor, qry):
-	ret =  search_db(cursor, qry)
+def qry_w_args(qry, args):
+	if args is None: return qry
+	return "%s\n(args: %s)" % (qry, ", ".join([str(a) for a in args]))
+
+#########################################
+# generator version of search_db: rows are streamed from the server (SSCursor)
+# and fetched batch_size at a time, so the full result never sits in the memory
+# note: until the result is exhausted, the connection cannot be used for anything else,
+# and with MyISAM the tables read are locked for writing  - use a separate connection
+# for the lookups/inserts in the loop body, and do not update the table being streamed
+def iter_db(cursor, qry, batch_size=10000, verbose=False):
+	warnings.filterwarnings('ignore', category=MySQLdb.Warning)
+	ss_cursor = cursor.connection.cursor(MySQLdb.cursors.SSCursor)
+	try:
+		ss_cursor.execute(qry)
+	except MySQLdb.Error as e:
+		print("Error running cursor.execute() for  qry:\n%s\n%s" % (qry, e.args[1]))
+		ss_cursor.close()
+		exit()
+	try:
+		while True:
+			try:
+				rows = ss_cursor.fetchmany(batch_size)
+			except MySQLdb.Error as e:
+				print("Error running cursor.fetchmany() for  qry:\n%s\n%s" % (qry, e.args[1]))
+				exit()
+			if not rows: break
+			for row in rows:
+				yield [r.decode('utf-8') if type(r)==bytes else r for r in row]
+	finally:
+		# if the consumer bails out early, the remaining rows still have to be drained
+		ss_cursor.close()
+	if verbose: print("iter_db done for  qry:\n%s" % qry)
+
+
+#########################################
+def error_intolerant_search(cursor, qry, args=None):
+	ret =  search_db(cursor, qry, args=args)
 	if not ret: return ret
 	if type(ret[0][0])==str and 'error' in ret[0][0].lower():
-		search_db(cursor, qry, verbose=True)
+		search_db(cursor, qry, verbose=True, args=args)
 		exit()
 	return ret
 
 #########################################
-def hard_landing_search(cursor, qry):
-	ret =  search_db(cursor, qry)
+def hard_landing_search(cursor, qry, args=None):
+	ret =  search_db(cursor, qry, args=args)
 	if not ret or (type(ret[0][0])==str and 'error' in ret[0][0].lower()):
-		search_db(cursor, qry, verbose=True)
+		search_db(cursor, qry, verbose=True, args=args)
 		exit()
 	return ret
 
@@ -336,6 +689,8 @@ def hard_landing_search(cursor, qry):
 
 ########
 def connect_to_mysql (conf_file):
+	# a duckdb or sqlite file in place of the option file: run without the mysql server
+	if embedded_engine(conf_file): return connect_to_embedded(conf_file)
 	try:
 		mysql_conn_handle = MySQLdb.connect(read_default_file=conf_file)
 	except  MySQLdb.Error as e:
@@ -358,3 +713,187 @@ def connect_to_db (db_name, user=None, passwd=None):
 
 	return db
 
+
+
+#########################################
+# per-process connection pool
+# The parallelized workers used to open a connection each, and had no way back if the server
+# dropped it in the middle of a long run. Here the connections are kept per process (and per conf file),
+# pinged before reuse if they were idle for a while, reconnected if dead, and the queries that fail
+# on a transient error (server gone, deadlock, lock wait timeout) are retried.
+# Usage:
+#     with pooled_cursor(Config.mysql_conf_file, "icgc") as cursor:
+#         search_db(cursor, qry) ...
+# A connection that comes back to the pool keeps its schema cache (the current db in particular),
+# so the next checkout does not need the 'use' round trip.
+# The pool is not shared between threads - fan_out() gives each thread its own connection.
+
+import multiprocessing.util, re
+
+# mysql error codes worth another try
+connection_lost_codes = (2006, 2013, 2055)  # server has gone away, lost connection during query, lost connection at ...
+lock_codes            = (1205, 1213)        # lock wait timeout, deadlock - the statement was rolled back
+connect_retry_codes   = (1040, 2002, 2003)  # too many connections, can't connect (server restarting)
+read_only_statements  = ('select', 'show', 'describe', 'explain', 'use')
+
+pool_settings = {
+	'max_retries': 3,
+	'retry_wait': 2.0,   # seconds, multiplied by the attempt number
+	'ping_after': 60.0   # seconds of idleness after which the connection is pinged before reuse
+}
+connection_pool = {'pid': None, 'idle': {}, 'in_use': [], 'inherited': []}
+use_qry = re.compile(r"^\s*use\s+(\w+)", re.IGNORECASE)
+
+#########################################
+def pool_connect(conf_file):
+	if embedded_engine(conf_file): return connect_to_embedded(conf_file)
+	for attempt in range(pool_settings['max_retries']):
+		try:
+			return MySQLdb.connect(read_default_file=conf_file)
+		except MySQLdb.Error as e:
+			if e.args[0] not in connect_retry_codes: break
+			time.sleep(pool_settings['retry_wait']*(attempt+1))
+	# the last attempt the usual way - exits with the error message if the server is still not there
+	return connect_to_mysql(conf_file)
+
+#########################################
+class PooledConnection:
+
+	def __init__(self, conf_file):
+		self.conf_file = conf_file
+		self.handle    = pool_connect(conf_file)
+		self.last_used = time.time()
+
+	def is_alive(self):
+		# the embedded backends do not ping, and do not go away
+		if not hasattr(self.handle, 'ping'): return True
+		try:
+			self.handle.ping()
+		except MySQLdb.Error:
+			return False
+		return True
+
+	def reconnect(self):
+		try:
+			self.handle.close()
+		except MySQLdb.Error:
+			pass
+		self.handle = pool_connect(self.conf_file)
+
+	def checkout(self):
+		if time.time()-self.last_used>pool_settings['ping_after'] and not self.is_alive():
+			self.reconnect()
+		return self
+
+	def close(self):
+		try:
+			self.handle.close()
+		except MySQLdb.Error:
+			pass
+
+
+#########################################
+class PooledCursor:
+	# looks like a MySQLdb cursor to search_db() & co; execute() retries the transient errors
+	def __init__(self, pooled_connection):
+		self.pooled_connection = pooled_connection
+		self.handle  = pooled_connection.handle.cursor()
+		self.db_name = None
+
+	# search_db keys the schema cache on cursor.connection, and iter_db opens its streaming cursor there
+	@property
+	def connection(self):
+		return self.pooled_connection.handle
+
+	def __getattr__(self, name):
+		# fetchall, fetchmany, rowcount, lastrowid, description ...
+		return getattr(self.handle, name)
+
+	def retry_worth_it(self, e, qry):
+		code = e.args[0] if e.args else None
+		if code in lock_codes: return True
+		if code not in connection_lost_codes: return False
+		# if the connection was lost mid-statement, we do not know if a write went through
+		return code==2006 or qry.lstrip()[:8].lower().startswith(read_only_statements)
+
+	def reconnect(self):
+		self.pooled_connection.reconnect()
+		self.handle = self.pooled_connection.handle.cursor()
+		if self.db_name: self.handle.execute("use %s" % self.db_name)
+
+	def execute(self, qry, args=None):
+		for attempt in range(pool_settings['max_retries']+1):
+			try:
+				ret = self.handle.execute(qry) if args is None else self.handle.execute(qry, args)
+				break
+			except MySQLdb.OperationalError as e:
+				if attempt==pool_settings['max_retries'] or not self.retry_worth_it(e, qry): raise
+				print("pid %d: %s - retrying (attempt %d)" % (os.getpid(), e.args, attempt+1))
+				time.sleep(pool_settings['retry_wait']*(attempt+1))
+				if e.args[0] in connection_lost_codes: self.reconnect()
+		# keep track of the db, in case we need to reconnect
+		match = use_qry.match(qry)
+		if match: self.db_name = match.group(1)
+		return ret
+
+	def close(self):
+		try:
+			self.handle.close()
+		except MySQLdb.Error:
+			pass
+
+
+#########################################
+def connection_pool_for_this_process():
+	pid = os.getpid()
+	if connection_pool['pid']!=pid:
+		# forked worker: the parent's connections are not ours to use - or to close, since closing
+		# would hang up on the parent's socket; just hold on to them, so they are not garbage collected
+		for pooled_connections in connection_pool['idle'].values():
+			connection_pool['inherited'].extend(pooled_connections)
+		connection_pool['inherited'].extend(connection_pool['in_use'])
+		connection_pool['idle']   = {}
+		connection_pool['in_use'] = []
+		connection_pool['pid'] = pid
+		# unlike atexit, the multiprocessing finalizers also run when a Process worker exits
+		multiprocessing.util.Finalize(None, close_connection_pool, exitpriority=50)
+	return connection_pool
+
+
+def close_connection_pool():
+	if connection_pool['pid']!=os.getpid(): return
+	for pooled_connections in connection_pool['idle'].values():
+		for pooled_connection in pooled_connections: pooled_connection.close()
+	connection_pool['idle'] = {}
+
+
+#########################################
+class pooled_cursor:
+	# context manager handing out a cursor already switched to db_name
+	def __init__(self, conf_file, db_name=None):
+		self.conf_file = conf_file
+		self.db_name   = db_name
+		self.pooled_connection = None
+		self.cursor = None
+
+	def __enter__(self):
+		pool = connection_pool_for_this_process()
+		idle = pool['idle'].get(self.conf_file, [])
+		self.pooled_connection = idle.pop().checkout() if idle else PooledConnection(self.conf_file)
+		pool['in_use'].append(self.pooled_connection)
+		self.cursor = PooledCursor(self.pooled_connection)
+		if self.db_name and not switch_to_db(self.cursor, self.db_name):
+			print("pid %d: failed to switch to %s" % (os.getpid(), self.db_name))
+			exit(1)
+		# switch_to_db might have skipped the 'use' - the connection was already there
+		self.cursor.db_name = connection_schema_cache(self.cursor)['current_db']
+		return self.cursor
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.cursor.close()
+		pool = connection_pool_for_this_process()
+		if self.pooled_connection in pool['in_use']:
+			pool['in_use'].remove(self.pooled_connection)
+			self.pooled_connection.last_used = time.time()
+			pool['idle'].setdefault(self.conf_file, []).append(self.pooled_connection)
+		return False
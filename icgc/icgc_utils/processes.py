@@ -17,8 +17,11 @@
 # 
 # Contact: ivana.mihalek@gmail.com
 #
-import multiprocessing
-import os
+import multiprocessing, multiprocessing.connection, multiprocessing.util
+import os, sys, time, traceback, heapq, queue
+from icgc_utils.ledger import LedgeredTask
+from icgc_utils.progress import ProgressMonitor, set_channel
+from icgc_utils.distributed import distributed_mode, distributed_pll
 
 ########################################
 def get_process_id():
@@ -74,29 +77,63 @@ def linear_pll(number_of_chunks, embarassingly_pllbl_fn, input_list, other_args,
 
 
 ########################################
+# longest processing time first: hand out the items from the heaviest down,
+# each to the currently least loaded chunk - O(n log n) for sorting + O(n log k) for the heap
+# weights: dict item -> weight, or a list parallel to input_list;
+# runtimes measured in a previous run (see read_runtimes) work better than table sizes, if we have them
 def weighted_partition(number_of_chunks, input_list,  weights):
-	if len(input_list)!=len(weights):
-		print("input list and the weights must be of the same length")
-		exit()
 	if len(input_list)==0:
 		return [],[]
-	input_sorted   = sorted(input_list, key=lambda t: weights[input_list.index(t)], reverse=True)
-	weights_sorted = sorted(weights, reverse=True)
-	input_list = input_sorted
-	weights = weights_sorted
-	#partition = [[]]*number_of_chunks # bizarre: this is n ptrs to the same list, set to be empty
+	weights = item_weights(input_list, weights)
+	order = sorted(range(len(input_list)), key=lambda i: weights[i], reverse=True)
 	partition = []
 	for i in range(number_of_chunks): partition.append([])
 	partition_weight = [0]*number_of_chunks
-	for i, element in enumerate(input_list):
-		min_part_wt, min_part_idx = min((val, idx) for (idx, val) in enumerate(partition_weight))
-		partition[min_part_idx].append(element)
-		partition_weight[min_part_idx] += weights[i]
+	heap = [(0, idx) for idx in range(number_of_chunks)]
+	for i in order:
+		load, idx = heapq.heappop(heap)
+		partition[idx].append(input_list[i])
+		partition_weight[idx] += weights[i]
+		heapq.heappush(heap, (partition_weight[idx], idx))
 	return partition, partition_weight
 
+##############
+def report_imbalance(partition_weight):
+	if not partition_weight: return 0.0
+	mean = float(sum(partition_weight))/len(partition_weight)
+	makespan = max(partition_weight)
+	imbalance = makespan/mean-1 if mean>0 else 0.0
+	print("weighted partition: %d chunks, predicted makespan %.3g, mean load %.3g, imbalance %.1f%%" %
+			(len(partition_weight), makespan, mean, 100*imbalance))
+	return imbalance
+
+##############
+# per-item runtimes, one "item<tab>seconds" per line - written by one run, and used as weights in the next
+# the workers append to the same file; a single short write in append mode does not get interleaved
+def append_runtime(fname, item, seconds):
+	with open(fname, "a") as outf:
+		outf.write("%s\t%.3f\n" % (item, seconds))
+
+def read_runtimes(fname, input_list=None):
+	runtimes = {}
+	if not os.path.exists(fname): return runtimes
+	with open(fname) as inf:
+		for line in inf:
+			fields = line.rstrip("\n").split("\t")
+			if len(fields)!=2: continue
+			runtimes[fields[0]] = float(fields[1]) # the latest run wins
+	if input_list and runtimes:
+		# the items we have not seen before get the average
+		avg = sum(runtimes.values())/len(runtimes)
+		for item in input_list:
+			if str(item) not in runtimes: runtimes[str(item)] = avg
+		runtimes = {item:runtimes[str(item)] for item in input_list}
+	return runtimes
+
 ##############
 def weighted_pll(number_of_chunks, embarassingly_pllbl_fn, input_list,  weights, other_args, return_dict=None):
 	partition, partition_weight = weighted_partition(number_of_chunks, input_list,  weights)
+	report_imbalance(partition_weight)
 	# for s, sublist in enumerate(partition):
 	# 	print(" ========= sublist  wt: %10d  (%.2e )=======" % (partition_weight[s],partition_weight[s]) )
 	# 	for idx, element in enumerate(sublist):
@@ -143,13 +180,305 @@ def round_robin_pll(number_of_chunks,embarassingly_pllbl_fn, list, other_args,):
 	return processes
 
 
+########################################
+# weights can be given as a dict (item -> weight) or as a list parallel to input_list
+def item_weights(input_list, weights):
+	if isinstance(weights, dict):
+		return [weights.get(item, 0) for item in input_list]
+	if len(input_list)!=len(weights):
+		print("input list and the weights must be of the same length")
+		exit()
+	return list(weights)
+
+def largest_first(input_list, weights):
+	if not weights: return list(input_list)
+	wts = item_weights(input_list, weights)
+	order = sorted(range(len(input_list)), key=lambda i: wts[i], reverse=True)
+	return [input_list[i] for i in order]
+
+##############
+# dynamic scheduling: the workers pull the next item from a shared queue as soon as they are
+# done with the previous one, so a single huge item (like chromosome 2 in 13_reorganize_mutations)
+# does not hold up the rest of its chunk while the other workers sit idle
+# embarassingly_pllbl_fn is called with a single-item list, so the existing workers can be used as they are
+def queue_worker(task_queue, embarassingly_pllbl_fn, other_args):
+	while True:
+		item = task_queue.get()
+		if item is None: break
+		embarassingly_pllbl_fn([item], other_args)
+
+def queue_pll(number_of_chunks, embarassingly_pllbl_fn, input_list, other_args, weights=None):
+	task_queue = multiprocessing.Queue()
+	# the biggest items go first, if we know which ones they are (table sizes will do)
+	for item in largest_first(input_list, weights): task_queue.put(item)
+	# one stop sign per worker
+	for ps in range(number_of_chunks): task_queue.put(None)
+
+	processes = []
+	for ps in range (number_of_chunks):
+		process = multiprocessing.Process(target=queue_worker, args=(task_queue, embarassingly_pllbl_fn, other_args))
+		try:
+			process.start()
+			processes.append(process)
+		except:
+			print("Error: unable to start process")
+			return False
+
+	return processes
+
+
 ###########
-def parallelize(number_of_chunks, embarassingly_pllbl_fn, list, other_args, strategy=None, weights=None):
+# number of workers for a stage, if not set by hand: as many as there are cores, but no more than
+#   - fit in the available memory, given memory_per_worker (in GB), the stage's own guess of what a worker needs
+#   - the mysql server has connections for (given the cursor), with connections_per_worker per worker
+#   - there are units of work
+# the per-stage override goes in Config.worker_counts (script name without .py -> number of workers);
+# the environment variable ICGC_WORKERS overrides everything, for a one-off run
+def available_cores():
+	if hasattr(os, "sched_getaffinity"): return len(os.sched_getaffinity(0))
+	return os.cpu_count() or 1
+
+def available_memory_gb():
+	try:
+		with open("/proc/meminfo") as inf:
+			for line in inf:
+				if line.startswith("MemAvailable:"):
+					return float(line.split()[1])/(1<<20) # kB to GB
+	except OSError:
+		pass
+	try:
+		return float(os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE'))/(1<<30)
+	except (ValueError, OSError, AttributeError):
+		return None
+
+def stage_worker_override():
+	if os.environ.get("ICGC_WORKERS"): return int(os.environ["ICGC_WORKERS"])
+	try:
+		from config import Config
+	except ImportError:
+		return None
+	stage = os.path.basename(sys.argv[0]).replace(".py", "") if sys.argv and sys.argv[0] else ""
+	return getattr(Config, 'worker_counts', {}).get(stage)
+
+def worker_count(number_of_units=None, cursor=None, memory_per_worker=None, connections_per_worker=1, verbose=True):
+	override = stage_worker_override()
+	if override:
+		if verbose: print("number of workers: %d (set by hand)" % override)
+		return override
+
+	limits = {'cores':available_cores()}
+	if memory_per_worker:
+		memory = available_memory_gb()
+		# 20% of what is free now is left for mysql and the file cache
+		if memory is not None: limits['memory'] = int(0.8*memory/memory_per_worker)
+	if cursor:
+		from icgc_utils.mysql import mysql_spare_connections
+		spare = mysql_spare_connections(cursor)
+		if spare is not None: limits['mysql connections'] = int(spare/connections_per_worker)
+	if number_of_units: limits['units of work'] = number_of_units
+
+	bottleneck = min(limits, key=limits.get)
+	number_of_workers = max(1, limits[bottleneck])
+	if verbose:
+		print("number of workers: %d (limited by %s; %s)" % (number_of_workers, bottleneck,
+					", ".join(["%s %d" % (k, v) for k, v in limits.items()])))
+	return number_of_workers
+
+
+###########
+# failures: a worker that raises, calls exit(), or dies is raised in the parent as ParallelizeError.
+# With a ledger, retries, fail_fast, progress, or the queue strategy, the worker function is called one unit
+# at a time, and the failed units are named in the error; otherwise the chunks go to the worker function
+# as they are (see ChunkTask), and all the units of a failed chunk are named.
+# retries: a unit that raises is tried again in the same worker, up to `retries` times, and the units left over
+# by the workers that died are run again, in a new round (also up to `retries` times). Off by default:
+# only a stage whose units are safe to rerun (truncate first, or skip what is there) should ask for it.
+# A unit that calls exit() (as error_intolerant_search and hard_landing_search do) is not tried again.
+# With fail_fast, the first failure terminates all the workers.
+failure_settings = {'retries': 0, 'fail_fast': False, 'retry_wait': 5}
+
+class ParallelizeError(Exception):
+	def __init__(self, failures):
+		# unit -> error
+		self.failures = failures
+		lines = ["%d units failed:" % len(failures)]
+		for unit, error in failures.items():
+			lines.append("\t%s: %s" % (unit, error.rstrip("\n").split("\n")[-1]))
+		Exception.__init__(self, "\n".join(lines))
+
+##############
+class UnitTask:
+
+	def __init__(self, embarassingly_pllbl_fn, channel, retries, fail_fast):
+		self.embarassingly_pllbl_fn = embarassingly_pllbl_fn
+		self.channel = channel
+		self.retries = retries
+		self.fail_fast = fail_fast
+
+	def __call__(self, units, other_args=None):
+		# progress_tick() in the worker function reports through the same channel
+		# (in a serial run this is the parent process, which should not keep on ticking afterwards)
+		previous = set_channel(self.channel)
+		pid = os.getpid()
+		try:
+			for unit in units:
+				time0 = time.time()
+				self.channel.put(('start', pid, str(unit), time0, 0))
+				error = self.attempt(unit, other_args)
+				if error is None:
+					time1 = time.time()
+					self.channel.put(('done', pid, str(unit), time1, time1-time0))
+					continue
+				self.channel.put(('failed', pid, str(unit), time.time(), error))
+				if self.fail_fast: raise ParallelizeError({str(unit):error})
+		finally:
+			set_channel(previous)
+
+	def attempt(self, unit, other_args):
+		for attempt in range(self.retries+1):
+			try:
+				if other_args==None:
+					self.embarassingly_pllbl_fn([unit])
+				else:
+					self.embarassingly_pllbl_fn([unit], other_args)
+				return None
+			except KeyboardInterrupt:
+				raise
+			except SystemExit as e:
+				# the worker function gave up on purpose; trying again will not help
+				return "exit(%s) - see the output above\n" % e.code
+			except BaseException as e:
+				error = traceback.format_exc()
+				if attempt<self.retries:
+					print("unit %s failed in %d (%s), trying again" % (unit, os.getpid(), error.rstrip("\n").split("\n")[-1]))
+					time.sleep(failure_settings['retry_wait']*(attempt+1))
+		return error
+
+
+###########
+# with a ledger (icgc_utils/ledger.py) the units finished in a previous run are skipped,
+# and each is checked off as it is done; once all of them are done the ledger is cleared
+# (clear_ledger=False keeps it, for a caller that runs parallelize more than once under the same ledger)
+# progress (icgc_utils/progress.py): the throughput, ETA and stragglers are reported while the workers run;
+# by default on for the queue strategy and with a ledger
+# distributed (icgc_utils/distributed.py): the units are handed out over TCP to the agents on this and other boxes;
+# the queue strategy goes distributed if ICGC_COORDINATOR is set
+# retries, fail_fast: see failure_settings above
+# parallelize returns when all the workers are done; the processes it returns are joined already
+# (if there is a single chunk, the worker function is called directly, and parallelize returns what it returns;
+# when it is called one unit at a time, there is nothing to return, and parallelize returns [])
+def parallelize(number_of_chunks, embarassingly_pllbl_fn, list, other_args, strategy=None, weights=None, ledger=None,
+				progress=None, retries=None, fail_fast=None, clear_ledger=True):
 
 	if number_of_chunks < 1:
 		print("number of processes is expected to be >= 1")
 		return False
+	if retries is None: retries = failure_settings['retries']
+	if fail_fast is None: fail_fast = failure_settings['fail_fast']
+	if strategy=='queue' and distributed_mode(): strategy = 'distributed'
+	# a unit is checked off in the ledger only once the worker function has returned on it, so with a ledger
+	# the units are always tracked one by one, whatever the strategy
+	per_unit = ledger is not None or retries>0 or fail_fast or progress or strategy in ['queue', 'distributed']
+	if not per_unit:
+		return chunk_pll(number_of_chunks, embarassingly_pllbl_fn, list, other_args, strategy, weights)
+
+	if ledger:
+		done = ledger.completed()
+		todo = [ledger.unit_key(item) not in done for item in list]
+		if not all(todo):
+			print("ledger %s: %d out of %d units already done" % (ledger.path, todo.count(False), len(list)))
+		if weights and not isinstance(weights, dict):
+			weights = [w for w, keep in zip(weights, todo) if keep]
+		list = [item for item, keep in zip(list, todo) if keep]
+	if len(list)==0:
+		if ledger and clear_ledger: ledger.reset()
+		return []
+
+	if progress is None: progress = (strategy in ['queue', 'distributed'] or ledger is not None)
+	# the monitor keeps track of what got done even when it does not report on it
+	monitor = ProgressMonitor(list, item_weights(list, weights) if weights else None, number_of_chunks,
+								report=progress, fail_fast=fail_fast)
+
+	if strategy == 'distributed':
+		# the coordinator checks off the units in the ledger, and reports the progress, as the results come in
+		monitor.watch()
+		try:
+			processes, failures = distributed_pll(number_of_chunks, embarassingly_pllbl_fn, largest_first(list, weights), other_args,
+								ledger=ledger, progress_channel=monitor.channel, max_attempts=retries+1, fail_fast=fail_fast)
+		finally:
+			monitor.stop()
+		if failures: raise ParallelizeError(failures)
+		if ledger and clear_ledger: ledger.reset()
+		# as with the local strategies: the worker processes on this box, joined
+		return processes
+
+	task = embarassingly_pllbl_fn
+	if ledger: task = LedgeredTask(task, ledger)
+	task = UnitTask(task, monitor.channel, retries, fail_fast)
 
+	if number_of_chunks == 1:
+		monitor.watch()
+		try:
+			task(list, other_args)
+		finally:
+			monitor.stop()
+		processes = []
+	else:
+		if strategy == 'queue':
+			processes = queue_pll(number_of_chunks, task, list, other_args, weights)
+		else:
+			processes = dispatch_pll(number_of_chunks, task, list, other_args, strategy, weights)
+		if not processes: return processes
+		# the monitor runs in a thread of its own, until all the workers are gone
+		monitor.watch(processes)
+		wait_join(processes)
+		monitor.stop()
+
+	failures = dict(monitor.failed)
+	# the units the dead workers were working on, or never got to
+	left_over = [item for item in list if str(item) not in monitor.done_units and str(item) not in failures]
+	if left_over and retries>0 and not fail_fast:
+		print("%d units left over by the workers that died (%s); running them again" %
+				(len(left_over), ", ".join(["%s exit code %s" % (pid, code) for pid, code in monitor.died.items()])))
+		try:
+			parallelize(min(number_of_chunks, len(left_over)), embarassingly_pllbl_fn, left_over, other_args,
+						strategy='queue', weights=weights if isinstance(weights, dict) else None, ledger=ledger,
+						progress=progress, retries=retries-1, fail_fast=fail_fast, clear_ledger=False)
+		except ParallelizeError as e:
+			failures.update(e.failures)
+		left_over = []
+	for item in left_over:
+		failures[str(item)] = monitor.lost.get(str(item), "not done (the worker died or was terminated)")
+	if failures: raise ParallelizeError(failures)
+	if ledger and clear_ledger: ledger.reset()
+	return processes
+
+
+###########
+# the chunks go to the worker function as they are, as before the units were tracked one by one
+# a worker that raises, or calls exit() - which on its own ends the worker with exit code 0 - reports its chunk
+# through failure_queue, and the units of that chunk are named in the ParallelizeError
+class ChunkTask:
+
+	def __init__(self, embarassingly_pllbl_fn, failure_queue):
+		self.embarassingly_pllbl_fn = embarassingly_pllbl_fn
+		self.failure_queue = failure_queue
+
+	def __call__(self, units, other_args):
+		try:
+			self.embarassingly_pllbl_fn(units, other_args)
+			return
+		except KeyboardInterrupt:
+			raise
+		except SystemExit as e:
+			error = "exit(%s) - see the output above\n" % e.code
+		except BaseException as e:
+			error = traceback.format_exc()
+			sys.stderr.write(error)
+		self.failure_queue.put((os.getpid(), [str(unit) for unit in units], error))
+		exit(1)
+
+def chunk_pll(number_of_chunks, embarassingly_pllbl_fn, list, other_args, strategy=None, weights=None):
 	if number_of_chunks == 1:
 		if other_args==None:
 			ret = embarassingly_pllbl_fn(list)
@@ -157,19 +486,163 @@ def parallelize(number_of_chunks, embarassingly_pllbl_fn, list, other_args, stra
 			ret = embarassingly_pllbl_fn(list, other_args)
 		return ret
 
+	failure_queue = multiprocessing.Queue()
+	task = ChunkTask(embarassingly_pllbl_fn, failure_queue)
+	processes = dispatch_pll(number_of_chunks, task, list, other_args, strategy, weights)
+	if not processes: return processes
+	failures = {}
+	reported = set()
+	for pid, units, error in chunk_failures(failure_queue, processes):
+		reported.add(pid)
+		for unit in units: failures[unit] = "worker %d: %s" % (pid, error)
+	wait_join(processes)
+	for process in processes:
+		# killed, or died without getting to report which chunk it was on
+		if process.exitcode!=0 and process.pid not in reported:
+			failures["worker %d" % process.pid] = "exit code %s" % process.exitcode
+	if failures: raise ParallelizeError(failures)
+	return processes
+
+# read while the workers are running, so that a big chunk does not block its worker on a full pipe
+def chunk_failures(failure_queue, processes):
+	reports = []
+	while True:
+		try:
+			reports.append(failure_queue.get(timeout=1))
+		except queue.Empty:
+			if not any([process.is_alive() for process in processes]): break
+	# whatever was sent just before the last worker exited
+	while True:
+		try:
+			reports.append(failure_queue.get(timeout=0.1))
+		except queue.Empty:
+			break
+	return reports
+
+def dispatch_pll(number_of_chunks, embarassingly_pllbl_fn, list, other_args, strategy=None, weights=None):
 	if strategy == 'round_robin':
-		return round_robin_pll(number_of_chunks,embarassingly_pllbl_fn, list, other_args)
+		return round_robin_pll(number_of_chunks, embarassingly_pllbl_fn, list, other_args)
 	elif strategy == 'weighted':
 		if not weights:
 			print("need wights for the weighted pll")
 			exit()
 		return weighted_pll(number_of_chunks, embarassingly_pllbl_fn, list,  weights, other_args)
 	else:
-		return linear_pll(number_of_chunks,embarassingly_pllbl_fn, list, other_args)
+		return linear_pll(number_of_chunks, embarassingly_pllbl_fn, list, other_args)
+
+
+########################################
+# result transport for pll_w_return: each worker fills a plain local dict,
+# and sends it back in one piece through a pipe when done
+# (with Manager().dict() every single assignment was a round trip to the manager process)
+# with shared_numpy, the numpy arrays of at least shm_min_bytes go through shared memory instead of pickle
+shm_min_bytes = 1<<20
+shm_tag = "__shared_ndarray__"
+
+# the segment is made in the worker, but belongs to the parent: the worker's resource tracker
+# must not know about it, or it unlinks the segment as the worker exits (python < 3.13 has no track=False)
+def shared_memory_for_parent(nbytes):
+	from multiprocessing import shared_memory, resource_tracker
+	try:
+		return shared_memory.SharedMemory(create=True, size=nbytes, track=False)
+	except TypeError:
+		shm = shared_memory.SharedMemory(create=True, size=nbytes)
+		resource_tracker.unregister(shm._name, "shared_memory")
+		return shm
+
+def arrays_to_shm(payload):
+	if type(payload)==dict:
+		return {k:arrays_to_shm(v) for k, v in payload.items()}
+	if type(payload) in [list, tuple]:
+		return type(payload)([arrays_to_shm(v) for v in payload])
+	if type(payload).__name__=='ndarray' and payload.nbytes>=shm_min_bytes:
+		from multiprocessing import shared_memory
+		import numpy
+		shm = shared_memory_for_parent(payload.nbytes)
+		numpy.ndarray(payload.shape, dtype=payload.dtype, buffer=shm.buf)[...] = payload
+		descriptor = (shm_tag, shm.name, payload.shape, payload.dtype.str)
+		shm.close() # the segment lives on until the parent unlinks it
+		return descriptor
+	return payload
+
+def arrays_from_shm(payload):
+	if type(payload)==dict:
+		return {k:arrays_from_shm(v) for k, v in payload.items()}
+	if type(payload)==tuple and len(payload)==4 and payload[0]==shm_tag:
+		from multiprocessing import shared_memory
+		import numpy
+		[tag, name, shape, dtype] = payload
+		shm = shared_memory.SharedMemory(name=name)
+		array = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+		shm.close()
+		shm.unlink()
+		return array
+	if type(payload) in [list, tuple]:
+		return type(payload)([arrays_from_shm(v) for v in payload])
+	return payload
+
+##############
+def pipe_worker(conn, embarassingly_pllbl_fn, input_list, other_args, shared_numpy):
+	return_dict = {}
+	embarassingly_pllbl_fn(input_list, other_args, return_dict)
+	conn.send(arrays_to_shm(return_dict) if shared_numpy else return_dict)
+	conn.close()
+
+def pipe_pll(number_of_chunks, embarassingly_pllbl_fn, input_list, other_args, weights=None, shared_numpy=False):
+	if weights:
+		partition, partition_weight = weighted_partition(number_of_chunks, input_list,  weights)
+		report_imbalance(partition_weight)
+	else:
+		partition = [input_list[ps_from:ps_to] for ps_from, ps_to in partition_load(number_of_chunks, len(input_list)).values()]
+
+	processes = []
+	connections = []
+	chunks = []
+	for chunk in partition:
+		if len(chunk)==0: continue
+		parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+		process = multiprocessing.Process(target=pipe_worker,
+						args=(child_conn, embarassingly_pllbl_fn, chunk, other_args, shared_numpy))
+		try:
+			process.start()
+		except:
+			print("Error: unable to start process")
+			return False
+		child_conn.close() # otherwise we never see the EOF if the worker dies
+		processes.append(process)
+		connections.append(parent_conn)
+		chunks.append(chunk)
+
+	# collect in the order of completion; a big payload has to be read
+	# before its worker can exit, so join only after that
+	return_dict = {}
+	lost = []  # the processes that did not send their results
+	pending = list(connections)
+	while pending:
+		for conn in multiprocessing.connection.wait(pending):
+			try:
+				payload = conn.recv()
+				return_dict.update(arrays_from_shm(payload) if shared_numpy else payload)
+			except EOFError:
+				lost.append(processes[connections.index(conn)])
+			conn.close()
+			pending.remove(conn)
+	wait_join(processes)
+
+	# a worker that sent its results and then exited with an error counts as failed too
+	failures = {}
+	for process, chunk in zip(processes, chunks):
+		if process not in lost and process.exitcode==0: continue
+		error = "the worker %s exited (exit code %s) %s" % (process.pid, process.exitcode,
+					"without returning its results" if process in lost else "with an error")
+		for unit in chunk: failures[str(unit)] = error
+	if failures: raise ParallelizeError(failures)
+	return return_dict
 
 
 ###########
-def pll_w_return(number_of_chunks, embarassingly_pllbl_fn, input_list, other_args, weights=None, dehash = True):
+# a worker that dies (or exits with an error) takes its chunk with it: that is raised as ParallelizeError
+def pll_w_return(number_of_chunks, embarassingly_pllbl_fn, input_list, other_args, weights=None, dehash = True, shared_numpy=False):
 	if number_of_chunks < 1:
 		print("number of processes is expected to be >= 1")
 		return False
@@ -179,13 +652,7 @@ def pll_w_return(number_of_chunks, embarassingly_pllbl_fn, input_list, other_arg
 		embarassingly_pllbl_fn(input_list, other_args, return_dict)
 
 	else:
-		manager = multiprocessing.Manager()
-		return_dict = manager.dict()
-		if not weights:
-			processes = linear_pll(number_of_chunks, embarassingly_pllbl_fn, input_list, other_args, return_dict)
-		else:
-			processes = weighted_pll(number_of_chunks, embarassingly_pllbl_fn, input_list,  weights, other_args, return_dict)
-		wait_join(processes)
+		return_dict = pipe_pll(number_of_chunks, embarassingly_pllbl_fn, input_list, other_args, weights, shared_numpy)
 
 	if dehash:
 		# return dict is dict with process ids as keys
@@ -198,6 +665,111 @@ def pll_w_return(number_of_chunks, embarassingly_pllbl_fn, input_list, other_arg
 	else: # return raw
 		return return_dict
 
+########################################
+# read-only lookup tables, built once in the parent, and read by the forked workers in place.
+# A dict inherited through fork gets copied page by page as the workers touch the refcounts of
+# its keys and values - with 12 workers that is 12 copies of the same gene maps in the end.
+# Here the keys (sorted) and values are packed into a single shared memory segment, with the offsets
+# in two int64 arrays, and looked up by bisection; the only python objects are the ones a lookup returns.
+# The values are str, int or None.
+#     share_lookup('ens2hgnc', mapping)   # in the parent, before parallelize()
+#     shared_lookup('ens2hgnc')           # anywhere; None if nothing was shared under that name
+shared_lookups = {}
+
+def share_lookup(name, mapping):
+	shared_lookups[name] = SharedLookup(mapping)
+	return shared_lookups[name]
+
+def shared_lookup(name):
+	return shared_lookups.get(name)
+
+class SharedLookup:
+
+	def __init__(self, mapping):
+		from multiprocessing import shared_memory
+		import struct
+		keys = sorted([str(k).encode() for k in mapping.keys()])
+		lookup_key = {str(k).encode():k for k in mapping.keys()}
+		values = [self.encode(mapping[lookup_key[k]]) for k in keys]
+		self.size = len(keys)
+		key_offsets   = self.offsets(keys)
+		value_offsets = self.offsets(values)
+		# layout: key offsets | value offsets | keys | values
+		header = 8*(self.size+1)
+		self.keys_start   = 2*header
+		self.values_start = self.keys_start + key_offsets[-1]
+		nbytes = max(1, self.values_start + value_offsets[-1])
+		self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+		buf = self.shm.buf
+		buf[0:header] = struct.pack("%dq" % (self.size+1), *key_offsets)
+		buf[header:2*header] = struct.pack("%dq" % (self.size+1), *value_offsets)
+		buf[self.keys_start:self.values_start] = b"".join(keys)
+		buf[self.values_start:self.values_start+value_offsets[-1]] = b"".join(values)
+		self.key_offsets   = buf[0:header].cast('q')
+		self.value_offsets = buf[header:2*header].cast('q')
+		# only the process that made the segment removes it
+		self.owner = os.getpid()
+		multiprocessing.util.Finalize(self, SharedLookup.release, args=(self.shm, self.key_offsets, self.value_offsets, self.owner),
+										exitpriority=10)
+
+	@staticmethod
+	def offsets(blobs):
+		offsets = [0]
+		for blob in blobs: offsets.append(offsets[-1]+len(blob))
+		return offsets
+
+	@staticmethod
+	def encode(value):
+		if value is None: return b"n"
+		if type(value)==int: return b"i" + str(value).encode()
+		return b"s" + str(value).encode()
+
+	@staticmethod
+	def decode(blob):
+		if blob[:1]==b"n": return None
+		if blob[:1]==b"i": return int(blob[1:])
+		return blob[1:].decode()
+
+	@staticmethod
+	def release(shm, key_offsets, value_offsets, owner):
+		key_offsets.release()
+		value_offsets.release()
+		shm.close()
+		if os.getpid()==owner: shm.unlink()
+
+	def key_at(self, i):
+		return bytes(self.shm.buf[self.keys_start+self.key_offsets[i]:self.keys_start+self.key_offsets[i+1]])
+
+	def index(self, key):
+		key = str(key).encode()
+		lo, hi = 0, self.size
+		while lo<hi:
+			mid = (lo+hi)//2
+			if self.key_at(mid)<key:
+				lo = mid+1
+			else:
+				hi = mid
+		if lo<self.size and self.key_at(lo)==key: return lo
+		return None
+
+	def get(self, key, default=None):
+		i = self.index(key)
+		if i is None: return default
+		start = self.values_start+self.value_offsets[i]
+		return self.decode(bytes(self.shm.buf[start:self.values_start+self.value_offsets[i+1]]))
+
+	def __getitem__(self, key):
+		i = self.index(key)
+		if i is None: raise KeyError(key)
+		return self.get(key)
+
+	def __contains__(self, key):
+		return self.index(key) is not None
+
+	def __len__(self):
+		return self.size
+
+
 #########################################
 def wait_join(processes):
 	for process in processes:
@@ -206,11 +778,57 @@ def wait_join(processes):
 
 def test_fn(list, other_args, return_dict):
 	pid = get_process_id()
-	new_list = [l+pid for l in list]
-	return_dict[pid] = new_list
+	return_dict[pid] = {l:l+pid for l in list}
 	return
 
+# exit() in the worker, as in error_intolerant_search
+def test_exit_fn(list, other_args):
+	if 3 in list: exit()
+
+def test_exit_in_chunk():
+	for strategy in [None, 'round_robin', 'weighted']:
+		try:
+			parallelize(3, test_exit_fn, [1, 2, 3, 4, 5, 6], [], strategy=strategy, weights=[1, 1, 1, 1, 1, 1])
+		except ParallelizeError as e:
+			assert "3" in e.failures, e.failures
+			# 1 and 3 do not end up in the same chunk with any of the three
+			assert "1" not in e.failures, e.failures
+			print("strategy %s: %s" % (strategy, str(e).replace("\n", "; ")))
+			continue
+		raise AssertionError("strategy %s: exit() in the worker went unnoticed" % strategy)
+
+# as in 18_cleanup_duplicate_entries: a table is checked off only if parallelize returns
+def test_exit_not_recorded():
+	import tempfile
+	from icgc_utils.ledger import Ledger
+	with tempfile.TemporaryDirectory() as tmpdir:
+		ledger = Ledger(os.path.join(tmpdir, "test.ledger.sqlite"))
+		for table in ["table_a", "table_b"]:
+			rows = [1, 2, 3, 4] if table=="table_a" else [5, 6, 7, 8]
+			try:
+				parallelize(2, test_exit_fn, rows, [])
+			except ParallelizeError:
+				continue
+			ledger.record(table, 0)
+		assert ledger.completed()==set(["table_b"]), ledger.completed()
+		print("a table whose worker called exit() is not recorded")
+
+		# with a ledger, the units are tracked one by one on the chunk strategies too
+		ledger.reset()
+		try:
+			parallelize(2, test_exit_fn, [1, 2, 3, 4], [], ledger=ledger, progress=False)
+		except ParallelizeError as e:
+			assert list(e.failures.keys())==["3"], e.failures
+		else:
+			raise AssertionError("exit() in a ledgered unit went unnoticed")
+		assert ledger.completed()==set(["1", "2", "4"]), ledger.completed()
+		print("a unit whose worker called exit() is not recorded")
+
 def main():
+	test_exit_in_chunk()
+	test_exit_not_recorded()
+	print("==============")
+
 	inlist = [-3, -2, -1, 0, 0, 0, 1, 2, 3 ]
 	number_of_chunks = 3
 	other_args = []
@@ -219,7 +837,9 @@ def main():
 		print (k,v)
 
 	print("==============")
-	weighted_partition(3, [1,2,3,4,5,6,7,8],  [36, 25, 18, 7, 5, 3, 1, 1])
+	partition, partition_weight = weighted_partition(3, [1,2,3,4,5,6,7,8],  [36, 25, 18, 7, 5, 3, 1, 1])
+	print(partition, partition_weight)
+	report_imbalance(partition_weight)
 
 #########################################
 if __name__ == '__main__':
@@ -0,0 +1,249 @@
+#
+# This source code is part of icgc, an ICGC processing pipeline.
+#
+# Icgc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Icgc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see<http://www.gnu.org/licenses/>.
+#
+# Contact: ivana.mihalek@gmail.com
+#
+
+# Progress channel for parallelize().
+# The workers put (event, pid, unit, time, value) tuples on a multiprocessing queue - a unit started,
+# a unit done, failed (or abandoned), or a tick (rows, lines, genes ... whatever the stage counts, see progress_tick()).
+# A thread in the parent process reads them and every progress_settings['interval'] seconds prints
+# the number of units done, the throughput, the ETA, and the workers that have been stuck on a single
+# unit much longer than a typical unit takes (chromosome 2, say).
+# All events and the summaries also go to <cwd>/<script>.progress.jsonl, one json record per line,
+# so that the runs can be compared across releases.
+# With report=False the monitor only keeps track of which units are done and which ones failed,
+# and of the workers that died - parallelize() uses that to tell whether the stage went through.
+
+import os, sys, time, json, socket, threading
+import multiprocessing
+
+progress_settings = {
+	'interval': 60,          # seconds between the printed summaries
+	'straggler_factor': 3.0, # a worker is a straggler if it has been on its unit this many times the median unit time
+	'log': True              # write the jsonl log
+}
+
+# set in the worker process by parallelize's UnitTask
+channel = None
+
+def set_channel(new_channel):
+	global channel
+	previous, channel = channel, new_channel
+	return previous
+
+#########################################
+# to be called from within the worker loops, for the throughput finer than one unit
+def progress_tick(count=1):
+	if channel is None: return
+	channel.put(('tick', os.getpid(), None, time.time(), count))
+
+
+#########################################
+def progress_log_path():
+	script = os.path.basename(sys.argv[0]).replace(".py", "") if sys.argv and sys.argv[0] else "interactive"
+	return "{}/{}.progress.jsonl".format(os.getcwd(), script)
+
+
+#########################################
+class ProgressMonitor:
+
+	# weights (optional) is a list parallel to units; with it, the ETA is based on
+	# the weight done so far rather than on the unit count
+	# fail_fast: the workers are terminated as soon as one unit fails or one worker dies
+	def __init__(self, units, weights=None, number_of_workers=1, report=True, fail_fast=False):
+		# SimpleQueue writes straight into the pipe - with Queue, the last few events of
+		# a worker that dies abruptly can get lost in its feeder thread
+		self.channel = multiprocessing.SimpleQueue()
+		self.reporting = report
+		self.fail_fast = fail_fast
+		self.total = len(units)
+		self.weight = {}
+		if weights: self.weight = dict(zip([str(u) for u in units], weights))
+		self.total_weight = sum(self.weight.values())
+		self.number_of_workers = number_of_workers
+
+		self.started = time.time()
+		self.done = 0
+		self.done_weight = 0
+		self.ticks = 0
+		self.unit_seconds = {}  # unit -> seconds
+		self.current = {}       # pid (or host:pid in the distributed mode) -> [unit, start time]
+		self.workers = {}       # pid -> [units done, busy seconds, ticks]
+		self.done_units = set()
+		self.failed = {}        # unit -> error, as reported by the worker
+		self.died = {}          # pid -> exit code, for the workers that exited with one other than 0
+		self.lost = {}          # unit -> error, for the units the workers died on
+
+		self.stage = os.path.basename(sys.argv[0]).replace(".py", "") if sys.argv and sys.argv[0] else "interactive"
+		self.run_id = time.strftime("%Y-%m-%d_%H:%M:%S", time.localtime(self.started))
+		self.logf = open(progress_log_path(), "a") if progress_settings['log'] and report else None
+		self.processes = None
+		self.stopped = threading.Event()
+		self.thread = None
+
+	def log(self, record):
+		if not self.logf: return
+		record.update({'stage':self.stage, 'run':self.run_id})
+		self.logf.write(json.dumps(record)+"\n")
+		self.logf.flush()
+
+	#############
+	# processes: the ones parallelize started; the monitor stops when they are all gone
+	# None: the run is serial, in this process, and the monitor stops on stop()
+	def watch(self, processes=None):
+		self.processes = processes
+		self.log({'event':'started', 'units':self.total, 'workers':self.number_of_workers,
+					'host':socket.gethostname(), 'argv':sys.argv})
+		# not a daemon: the final summary gets written even if the main
+		# process has nothing left to do after wait_join()
+		self.thread = threading.Thread(target=self.run, name="progress monitor")
+		self.thread.start()
+
+	def stop(self):
+		self.stopped.set()
+		if self.thread: self.thread.join()
+
+	def finished(self):
+		if self.processes is None: return self.stopped.is_set()
+		return not any([p.is_alive() for p in self.processes])
+
+	def run(self):
+		last_report = time.time()
+		exited = set()
+		while True:
+			# check before draining: whatever the workers sent before they exited is in the queue by now
+			all_gone = self.finished()
+			gone = [p for p in (self.processes or []) if p.pid not in exited and p.exitcode is not None]
+			self.drain(timeout=1.0)
+			for process in gone:
+				exited.add(process.pid)
+				if process.exitcode!=0: self.worker_died(process.pid, process.exitcode)
+			if all_gone: break
+			if self.reporting and time.time()-last_report >= progress_settings['interval']:
+				self.report()
+				last_report = time.time()
+		if self.reporting: self.final_report()
+		if self.logf: self.logf.close()
+
+	def terminate(self):
+		for process in (self.processes or []):
+			if process.is_alive(): process.terminate()
+
+	def worker_died(self, pid, exitcode):
+		self.died[pid] = exitcode
+		if pid in self.current:
+			unit = self.current.pop(pid)[0]
+			self.lost[unit] = "worker %s died (exit code %s) while working on it" % (pid, exitcode)
+			print("unit %s: %s" % (unit, self.lost[unit]))
+			self.log({'event':'lost', 'pid':pid, 'unit':unit, 'exitcode':exitcode})
+		if self.fail_fast: self.terminate()
+
+	def drain(self, timeout):
+		deadline = time.time()+timeout
+		while self.channel.empty():
+			if time.time()>deadline: return
+			time.sleep(0.05)
+		while not self.channel.empty():
+			self.process(self.channel.get())
+
+	def process(self, event):
+		[kind, pid, unit, t, value] = event
+		worker = self.workers.setdefault(pid, [0, 0.0, 0])
+		if kind=='start':
+			self.current[pid] = [unit, t]
+			self.log({'event':'start', 'pid':pid, 'unit':unit, 't':t})
+		elif kind=='done':
+			self.current.pop(pid, None)
+			self.done += 1
+			self.done_units.add(unit)
+			self.done_weight += self.weight.get(unit, 0)
+			self.unit_seconds[unit] = value
+			worker[0] += 1
+			worker[1] += value
+			self.log({'event':'done', 'pid':pid, 'unit':unit, 't':t, 'seconds':round(value, 3)})
+		elif kind=='failed':
+			if pid in self.current and self.current[pid][0]==unit: self.current.pop(pid)
+			self.failed[unit] = value
+			print("unit %s failed in %s: %s" % (unit, pid, value.rstrip("\n").split("\n")[-1]))
+			self.log({'event':'failed', 'pid':pid, 'unit':unit, 't':t, 'error':value})
+			if self.fail_fast: self.terminate()
+		elif kind=='abandoned':
+			# the worker failed on the unit, or was lost
+			if pid in self.current and self.current[pid][0]==unit: self.current.pop(pid)
+			self.log({'event':'abandoned', 'pid':pid, 'unit':unit, 't':t})
+		elif kind=='tick':
+			self.ticks += value
+			worker[2] += value
+
+	#############
+	def eta(self, elapsed):
+		if self.done_weight>0 and self.total_weight>0:
+			return max(0.0, elapsed*(self.total_weight-self.done_weight)/self.done_weight)
+		if self.done>0:
+			return elapsed*(self.total-self.done)/self.done
+		return None
+
+	def median_unit_seconds(self):
+		if not self.unit_seconds: return None
+		seconds = sorted(self.unit_seconds.values())
+		return seconds[len(seconds)//2]
+
+	def stragglers(self, now):
+		median = self.median_unit_seconds()
+		if not median: return []
+		lagging = []
+		for pid, [unit, t] in self.current.items():
+			if now-t > progress_settings['straggler_factor']*median:
+				lagging.append([pid, unit, now-t])
+		return sorted(lagging, key=lambda x: x[2], reverse=True)
+
+	def report(self):
+		now = time.time()
+		elapsed = now-self.started
+		eta = self.eta(elapsed)
+		units_per_min = 60.0*self.done/elapsed if elapsed>0 else 0
+		ticks_per_sec = float(self.ticks)/elapsed if elapsed>0 else 0
+		out  = "progress %s: %d/%d units (%.0f%%), %.2f units/min" % \
+				(self.stage, self.done, self.total, 100.0*self.done/self.total if self.total else 100, units_per_min)
+		if self.ticks>0: out += ", %.0f rows/s" % ticks_per_sec
+		out += ", elapsed %.1f min" % (elapsed/60)
+		out += ", eta %.1f min" % (eta/60) if eta is not None else ", eta unknown"
+		print(out)
+		lagging = self.stragglers(now)
+		median = self.median_unit_seconds()
+		for pid, unit, seconds in lagging:
+			print("\t straggler: pid %s on %s for %.1f min (median unit %.1f min)" % (pid, unit, seconds/60, median/60))
+		self.log({'event':'summary', 't':now, 'done':self.done, 'total':self.total, 'units_per_min':round(units_per_min, 3),
+					'rows_per_sec':round(ticks_per_sec, 1), 'eta_seconds':round(eta, 1) if eta is not None else None,
+					'stragglers':[{'pid':pid, 'unit':unit, 'seconds':round(seconds, 1)} for pid, unit, seconds in lagging]})
+
+	def final_report(self):
+		elapsed = time.time()-self.started
+		print("progress %s: %d/%d units done in %.1f min" % (self.stage, self.done, self.total, elapsed/60))
+		if self.done<self.total:
+			print("\t not done: %d units (%d failed, %d workers died)" % (self.total-self.done, len(self.failed), len(self.died)))
+		record = {'event':'finished', 'done':self.done, 'total':self.total, 'seconds':round(elapsed, 1), 'rows':self.ticks,
+					'failed':len(self.failed), 'workers_died':len(self.died)}
+		if self.unit_seconds:
+			slowest = max(self.unit_seconds, key=self.unit_seconds.get)
+			record.update({'median_unit_seconds':round(self.median_unit_seconds(), 3),
+							'slowest_unit':slowest, 'slowest_unit_seconds':round(self.unit_seconds[slowest], 3)})
+		# how busy the workers were: the idle time is the imbalance the scheduling did not get rid of
+		record['workers'] = [{'pid':pid, 'units':units, 'busy_seconds':round(busy, 1),
+								'utilization':round(busy/elapsed, 3) if elapsed>0 else None, 'rows':ticks}
+								for pid, [units, busy, ticks] in self.workers.items()]
+		self.log(record)
@@ -0,0 +1,173 @@
+#
+# This source code is part of icgc, an ICGC processing pipeline.
+#
+# Icgc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Icgc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see<http://www.gnu.org/licenses/>.
+#
+# Contact: ivana.mihalek@gmail.com
+#
+
+# per-query-template bookkeeping for search_db
+# switch it on with
+#    export ICGC_QUERY_STATS=1
+# (optionally ICGC_SLOW_QUERY_SECS=<seconds>, default 10, and ICGC_QUERY_STATS_DIR=<dir>, default cwd at import)
+# or by calling enable_query_stats() at the top of the script.
+# Each process (including each worker started by parallelize) writes
+# query_stats.<script>.<pid>.txt on exit: query templates ranked by total time,
+# followed by the slow queries and their EXPLAIN output.
+
+import os, re, sys, time, random
+import multiprocessing.util
+
+reservoir_size = 10000
+max_slow_log   = 50
+
+query_stats = {
+	'enabled': False,
+	'slow_threshold': 10.0,
+	'outdir': None,
+	'pid': None,
+	'templates': {},
+	'slow': []
+}
+
+#########################################
+literal_patterns = [
+	(re.compile(r"'(?:[^'\\]|\\.)*'"), "?"),   # quoted strings
+	(re.compile(r'"(?:[^"\\]|\\.)*"'), "?"),
+	(re.compile(r"\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.IGNORECASE), "?"), # numbers
+	(re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?+)"),   # in-lists of any length
+	(re.compile(r"\s+"), " ")
+]
+
+# numbers that are a part of a name (mutations_chrom_12, MU113501933) are left alone by \b,
+# so the per-chromosome tables keep their own templates
+def query_template(qry):
+	template = qry.strip()
+	for pattern, replacement in literal_patterns:
+		template = pattern.sub(replacement, template)
+	return template.lower()
+
+
+# the statement templates of the parametrized queries are templates already - just normalize them once
+prepared_templates = {}
+def prepared_template(qry):
+	if qry not in prepared_templates:
+		prepared_templates[qry] = re.sub(r"\s+", " ", qry.strip()).lower()
+	return prepared_templates[qry]
+
+
+#########################################
+def percentile(sorted_values, pct):
+	if not sorted_values: return 0.0
+	idx = int(round(pct/100.0*(len(sorted_values)-1)))
+	return sorted_values[idx]
+
+
+#########################################
+def enable_query_stats(slow_threshold=None, outdir=None):
+	query_stats['enabled'] = True
+	if slow_threshold is not None: query_stats['slow_threshold'] = slow_threshold
+	query_stats['outdir'] = os.path.abspath(outdir if outdir else os.getcwd())
+
+
+def disable_query_stats():
+	query_stats['enabled'] = False
+
+
+#########################################
+def start_process_bookkeeping():
+	# a forked worker inherits the parent's numbers - these are not its own
+	query_stats['pid'] = os.getpid()
+	query_stats['templates'] = {}
+	query_stats['slow'] = []
+	# unlike atexit, the multiprocessing finalizers also run when a Process worker exits
+	multiprocessing.util.Finalize(None, write_query_stats, exitpriority=100)
+
+
+#########################################
+def explain(cursor, qry, args=None):
+	# only selects can be explained on older servers; do not go through search_db here
+	if not qry.lstrip()[:6].lower()=='select': return []
+	try:
+		if args is None:
+			cursor.execute("explain " + qry)
+		else:
+			cursor.execute("explain " + qry, args)
+		return [[r.decode('utf-8') if type(r)==bytes else r for r in row] for row in cursor.fetchall()]
+	except Exception as e:
+		return [["explain failed: %s" % str(e)]]
+
+
+#########################################
+def record_query(cursor, qry, elapsed, number_of_rows, args=None):
+	if query_stats['pid'] != os.getpid(): start_process_bookkeeping()
+
+	template = query_template(qry) if args is None else prepared_template(qry)
+	templates = query_stats['templates']
+	if template not in templates:
+		templates[template] = {'calls':0, 'total':0.0, 'rows':0, 'latencies':[], 'explained':False}
+	stats = templates[template]
+	stats['calls'] += 1
+	stats['total'] += elapsed
+	stats['rows']  += number_of_rows
+	# reservoir sampling keeps the percentile estimate honest with bounded memory
+	if len(stats['latencies'])<reservoir_size:
+		stats['latencies'].append(elapsed)
+	else:
+		idx = random.randrange(stats['calls'])
+		if idx<reservoir_size: stats['latencies'][idx] = elapsed
+
+	# explain the first slow instance of each template
+	if elapsed>=query_stats['slow_threshold'] and not stats['explained'] and len(query_stats['slow'])<max_slow_log:
+		stats['explained'] = True
+		explanation = explain(cursor, qry, args)
+		if args is not None: qry = "%s  -- args: %s" % (qry, ", ".join([str(a) for a in args]))
+		query_stats['slow'].append((elapsed, qry, explanation))
+
+
+#########################################
+def write_query_stats():
+	templates = query_stats['templates']
+	if not templates: return
+	script = os.path.basename(sys.argv[0]).replace(".py", "") if sys.argv and sys.argv[0] else "interactive"
+	outdir = query_stats['outdir'] if query_stats['outdir'] else os.getcwd()
+	outname = "{}/query_stats.{}.{}.txt".format(outdir, script, os.getpid())
+
+	grand_total = sum([stats['total'] for stats in templates.values()])
+	outf = open(outname, "w")
+	outf.write("# %d query templates, %d queries, %.1f s in total\n" %
+				(len(templates), sum([stats['calls'] for stats in templates.values()]), grand_total))
+	outf.write("\t".join(["# rank", "total_s", "pct", "calls", "p50_ms", "p99_ms", "rows", "template"]) + "\n")
+	ranked = sorted(templates.items(), key=lambda item: item[1]['total'], reverse=True)
+	for rank, (template, stats) in enumerate(ranked):
+		latencies = sorted(stats['latencies'])
+		fields  = [str(rank+1), "%.2f" % stats['total']]
+		fields += ["%.1f" % (100*stats['total']/grand_total if grand_total>0 else 0)]
+		fields += [str(stats['calls'])]
+		fields += ["%.2f" % (1000*percentile(latencies, 50)), "%.2f" % (1000*percentile(latencies, 99))]
+		fields += [str(stats['rows']), template]
+		outf.write("\t".join(fields) + "\n")
+
+	if query_stats['slow']:
+		outf.write("\n# slow queries (>= %.1f s)\n" % query_stats['slow_threshold'])
+		for elapsed, qry, explanation in sorted(query_stats['slow'], reverse=True):
+			outf.write("\n%.2f s\t%s\n" % (elapsed, qry.strip()))
+			for row in explanation:
+				outf.write("\t" + "\t".join([str(r) for r in row]) + "\n")
+	outf.close()
+
+
+#########################################
+if os.environ.get('ICGC_QUERY_STATS', '') not in ['', '0']:
+	enable_query_stats(float(os.environ.get('ICGC_SLOW_QUERY_SECS', 10)), os.environ.get('ICGC_QUERY_STATS_DIR'))
@@ -0,0 +1,118 @@
+#
+# This source code is part of icgc, an ICGC processing pipeline.
+#
+# Icgc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Icgc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see<http://www.gnu.org/licenses/>.
+#
+# Contact: ivana.mihalek@gmail.com
+#
+
+# Schema manifest for a release: what 10_local_db_loading/05a_schema_manifest.py found in the
+# simple somatic files, in one pass - per column of the temp table the type, the max width, the null rate
+# and the value counts for the enum-like columns; per file and per cancer type the number of rows.
+# It is kept as json next to the data (<data_home_local>/schema_manifest.json), and used
+#   - by make_temp_somatic_muts_table (icgc.py), to size the columns
+#   - as the scheduling weights: parallelize(..., weights=[row_counts[ct] for ct in cancer_types])
+
+import os, json
+from icgc_utils.somatic_tsv import FieldStats, temp_table_columns
+
+# the widths found in the data get this much room on top, rounded up to tens (200 -> 210, 401 -> 430)
+width_headroom = 0.05
+max_int = (1<<31)-1
+
+#########################################
+def manifest_path(data_home_local):
+	return "{}/schema_manifest.json".format(data_home_local)
+
+
+#########################################
+def read_manifest(data_home_local):
+	path = manifest_path(data_home_local)
+	if not os.path.exists(path): return None
+	with open(path) as inf:
+		return json.load(inf)
+
+
+#########################################
+def write_manifest(data_home_local, manifest):
+	path = manifest_path(data_home_local)
+	with open(path+".tmp", "w") as outf:
+		json.dump(manifest, outf, indent=1, sort_keys=True)
+	os.replace(path+".tmp", path)
+	return path
+
+
+#########################################
+# file_parts: {path: {'cancer_type':..., 'bytes':..., 'stats': FieldStats.to_dict()}}, one per file
+def build_manifest(release, file_parts):
+	total = FieldStats()
+	row_counts = {}
+	files = {}
+	for path, part in file_parts.items():
+		stats = FieldStats().from_dict(part['stats'])
+		total.merge(stats)
+		cancer_type = part['cancer_type']
+		row_counts[cancer_type] = row_counts.get(cancer_type, 0) + stats.rows
+		files[path] = {'cancer_type':cancer_type, 'bytes':part['bytes'], 'rows':stats.rows}
+
+	columns = {}
+	for name in temp_table_columns[1:]:
+		if name not in total.max_length: continue
+		integer  = total.integer.get(name)
+		distinct = total.distinct.get(name)
+		columns[name] = {
+			'type': column_type(total.max_length[name], integer),
+			'max_length': total.max_length[name],
+			'nulls': total.empty[name],
+			'null_rate': round(float(total.empty[name])/total.rows, 6) if total.rows else 0.0,
+			'range': integer,
+			'distinct': len(distinct) if distinct is not None else None,
+			'values': distinct
+		}
+	return {'release':release, 'rows':total.rows, 'row_counts':row_counts, 'files':files,
+			'tables':{'simple_somatic_temp':{'columns':columns}}}
+
+
+#########################################
+def column_type(max_length, integer):
+	if integer is not None and integer[0] is not None:
+		return "INT" if -max_int<=integer[0] and integer[1]<=max_int else "BIGINT"
+	return "VARCHAR (%d)" % varchar_width(max_length)
+
+
+def varchar_width(max_length):
+	return max(10, 10*int((max_length*(1+width_headroom)+9)//10))
+
+
+#########################################
+# the column definitions for the create table statement, in the order given
+# string_columns stay VARCHAR even if all their values happen to be digits (ids, strand ...)
+def manifest_column_definitions(manifest, table, column_names, string_columns=()):
+	columns = manifest['tables'][table]['columns']
+	definitions = []
+	for name in column_names:
+		column = columns[name]
+		if name in string_columns:
+			sql_type = "VARCHAR (%d)" % varchar_width(column['max_length'])
+		else:
+			sql_type = column['type']
+		not_null = " NOT NULL" if column['nulls']==0 else ""
+		definitions.append("%s %s%s" % (name, sql_type, not_null))
+	return definitions
+
+
+#########################################
+def manifest_row_counts(manifest):
+	if not manifest: return {}
+	return manifest['row_counts']
@@ -0,0 +1,110 @@
+#
+# This source code is part of icgc, an ICGC processing pipeline.
+#
+# Icgc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Icgc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see<http://www.gnu.org/licenses/>.
+#
+# Contact: ivana.mihalek@gmail.com
+#
+
+# Genomic-window sharding, below the chromosome granularity.
+# With chromosomes as the unit of work, we cannot use more than 24 workers, and the
+# stage takes as long as chromosome 1 or 2 does. Here each chromosome is cut into position windows
+# with (roughly) the same number of rows, estimated from a random sample of start_position.
+# The sample is seeded, so that the same table gives the same shards in every run - the ledger
+# keys are the shards themselves, and a resumed run has to see the same ones.
+# The shards are (chromosome, start, end) tuples, with end exclusive:
+#     shards, weights = genome_shards(cursor, chromosomes, number_of_shards=48)
+#     parallelize(number_of_chunks, fn, shards, other_args, strategy='queue', weights=weights)
+# and in the worker
+#     qry += "and " + shard_condition(shard)
+
+from icgc_utils.mysql import search_db, get_table_size
+
+# beyond the end of the longest chromosome
+max_position = 1<<31
+sample_seed  = 1
+
+#########################################
+def position_sample(cursor, table, sample_size, table_rows, column='start_position'):
+	if table_rows<=sample_size:
+		qry = "select %s from %s" % (column, table)
+	else:
+		# one pass through the table, without sorting; MyISAM does it quickly
+		# (with a constant seed, rand() gives the same sequence, and the table is scanned in the same order)
+		qry = "select %s from %s where rand(%d)<%.6f" % (column, table, sample_seed, float(sample_size)/table_rows)
+	ret = search_db(cursor, qry)
+	if not ret or (type(ret[0][0])==str and 'error' in ret[0][0].lower()): return []
+	return sorted([r[0] for r in ret if r[0] is not None])
+
+
+#########################################
+# cut points at the quantiles of the sample; the first shard starts at 0 and the last one
+# goes to max_position, so that the positions the sample missed are covered too
+def window_shards(chromosome, sorted_positions, number_of_windows):
+	if number_of_windows<=1 or len(sorted_positions)<number_of_windows:
+		return [(chromosome, 0, max_position)]
+	cuts = []
+	for i in range(1, number_of_windows):
+		cut = sorted_positions[int(float(i)*len(sorted_positions)/number_of_windows)]
+		# many mutations at the same position must not be split between two shards
+		if cuts and cut<=cuts[-1]: continue
+		cuts.append(cut)
+	boundaries = [0] + cuts + [max_position]
+	return [(chromosome, boundaries[i], boundaries[i+1]) for i in range(len(boundaries)-1)]
+
+
+#########################################
+# number_of_shards is the target for the whole genome; each chromosome gets its share
+# according to the number of rows in its table (table_template % chromosome)
+# returns the shards and the estimated number of rows in each (to be used as weights)
+def genome_shards(cursor, chromosomes, number_of_shards, db_name="icgc", table_template="mutations_chrom_%s",
+					sample_size=20000, column='start_position'):
+	rows = get_table_size(cursor, db_name, [table_template % c for c in chromosomes], as_list=True)
+	total_rows = sum(rows)
+	if total_rows==0: return [(c, 0, max_position) for c in chromosomes], [1]*len(chromosomes)
+
+	shards  = []
+	weights = []
+	rows_per_shard = float(total_rows)/number_of_shards
+	for chromosome, table_rows in zip(chromosomes, rows):
+		table = "%s.%s" % (db_name, table_template % chromosome)
+		number_of_windows = max(1, int(round(table_rows/rows_per_shard)))
+		sorted_positions = position_sample(cursor, table, sample_size, table_rows, column) if number_of_windows>1 else []
+		chrom_shards = window_shards(chromosome, sorted_positions, number_of_windows)
+		shards  += chrom_shards
+		weights += [float(table_rows)/len(chrom_shards)]*len(chrom_shards)
+	return shards, weights
+
+
+#########################################
+# a resumed run must cut the genome the same way as the run it picks up from
+def check_shard_plan(ledger, shards):
+	unknown = ledger.unknown(shards)
+	if not unknown: return
+	print("the shards in %s do not match the current ones (%s ...);" % (ledger.path, ", ".join(unknown[:3])))
+	print("the tables changed since the previous run - run without --resume")
+	exit()
+
+
+#########################################
+def shard_condition(shard, column='start_position'):
+	[chromosome, start, end] = shard
+	return "%s>=%d and %s<%d " % (column, start, column, end)
+
+
+def shard_name(shard):
+	[chromosome, start, end] = shard
+	if start==0 and end==max_position: return "chrom %s" % chromosome
+	return "chrom %s:%d-%d" % (chromosome, start, end)
+
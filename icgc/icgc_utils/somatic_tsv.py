@@ -0,0 +1,284 @@
+#
+# This source code is part of icgc, an ICGC processing pipeline.
+#
+# Icgc is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Icgc is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see<http://www.gnu.org/licenses/>.
+#
+# Contact: ivana.mihalek@gmail.com
+#
+
+# The ICGC simple somatic mutation files, as they come from the data portal:
+# which columns we keep, how they map onto the columns of <cancer type>_simple_somatic_temp
+# (see make_temp_somatic_muts_table in icgc.py), and the fixes applied on the way in.
+# Shared by 07_write_mutations_tsv (tsv on disk), 07a_stream_mutations_to_mysql (straight into mysql)
+# and 05_find_max_field_length.
+# The files are read column-wise, in blocks of block_rows lines: with pandas (if installed) by its C parser,
+# otherwise by splitting the lines and transposing the block with zip(). The fixes and the field statistics
+# are then done per column, not per line:
+#     stats = FieldStats()
+#     last_id = scan_somatic_file(path, stats=stats, outfile=outf, last_id=last_id)
+
+import os, gzip, csv
+from operator import itemgetter
+from collections import Counter
+from icgc_utils.external_sort import external_sort
+
+try:
+	import pandas
+except ImportError:
+	pandas = None
+
+block_rows = 100000
+
+# the full set of the header fields can be found by (for example)
+# head -n1 simple_somatic_mutation.controlled.ALL-US.tsv | sed 's/\t/,/g'
+# this correposnds to the subset we want to store
+somatic_fields = "icgc_mutation_id,icgc_donor_id,icgc_specimen_id,icgc_sample_id,submitted_sample_id,chromosome,chromosome_start," \
+	"chromosome_end,chromosome_strand,assembly_version,mutation_type,reference_genome_allele,control_genotype,tumour_genotype,"\
+	"mutated_from_allele,mutated_to_allele,consequence_type,aa_mutation,cds_mutation," \
+	"gene_affected,transcript_affected,total_read_count,mutant_allele_read_count".split(",")
+
+# the same, as named in the temp table; the id in front is ours
+temp_table_columns = ["id"] + "icgc_mutation_id,icgc_donor_id,icgc_specimen_id,icgc_sample_id,submitted_sample_id,chromosome,start_position," \
+	"end_position,strand,assembly,mutation_type,reference_genome_allele,control_genotype,tumor_genotype,"\
+	"mutated_from_allele,mutated_to_allele,consequence_type,aa_mutation,cds_mutation," \
+	"gene_affected,transcript_affected,total_read_count,mutant_allele_read_count".split(",")
+
+# varchar widths in the temp table, for the fields that go in as they are in the file
+temp_table_widths = {'icgc_mutation_id':20, 'icgc_donor_id':20, 'icgc_specimen_id':20, 'icgc_sample_id':20,
+	'submitted_sample_id':50, 'chromosome':20, 'chromosome_strand':5, 'assembly_version':10,
+	'reference_genome_allele':210, 'control_genotype':430, 'tumour_genotype':430,
+	'mutated_from_allele':210, 'mutated_to_allele':210, 'aa_mutation':100, 'cds_mutation':50,
+	'gene_affected':20, 'transcript_affected':20}
+
+
+#########################################
+# the original files, either as they come (gz) or unzipped by 05_unzip
+def somatic_files(data_home_local, cancer_type, suffix=".tsv"):
+	somatic = []
+	for root, dirs, files in os.walk("{}/{}".format(data_home_local, cancer_type)):
+		for file in files:
+			if file.endswith(suffix) and 'simple_somatic' in file:
+				somatic.append(os.path.join(root, file))
+	return sorted(somatic)
+
+
+#########################################
+def open_somatic(path):
+	if path.endswith(".gz"): return gzip.open(path, 'rt')
+	return open(path, 'r')
+
+
+#########################################
+# {column name: column} for each block of lines, for the columns we keep (or the ones asked for)
+# the columns are pandas Series, or tuples of strings without pandas; the empty fields are empty strings
+def somatic_blocks(path, columns=None, rows_per_block=None):
+	if columns is None: columns = somatic_fields
+	if not rows_per_block: rows_per_block = block_rows
+	if pandas is not None:
+		reader = pandas.read_csv(path, sep="\t", usecols=columns, dtype=str, na_filter=False,
+								quoting=csv.QUOTE_NONE, chunksize=rows_per_block, engine='c')
+		for frame in reader:
+			yield {name:frame[name] for name in columns}
+		return
+	with open_somatic(path) as infile:
+		headers = infile.readline().rstrip('\n').split('\t')
+		indices = [headers.index(name) for name in columns]
+		# (the first index repeated at the end, so that itemgetter returns a tuple even for a single column)
+		pick = itemgetter(*indices, indices[0])
+		while True:
+			lines = infile.readlines(rows_per_block*300)  # hint in bytes; the lines are ~300 bytes long
+			if not lines: return
+			block = zip(*[pick(line.rstrip('\n').split('\t')) for line in lines])
+			yield dict(zip(columns, block))
+
+
+#########################################
+# the fixes, on the whole block: the columns in the order of somatic_fields,
+# with the empty read counts as None (\N in the tsv, NULL in the table)
+# as_lists=False leaves the pandas columns as they are (for the FieldStats)
+def fix_somatic_block(block, as_lists=True):
+	columns = [block[name] for name in somatic_fields]
+	if pandas is not None and isinstance(columns[0], pandas.Series):
+		columns[10] = columns[10].str.split(" ", n=1).str[0]  # mutation_type
+		columns[16] = columns[16].str.replace("_variant", "", regex=False).str.replace("_gene", "", regex=False)
+		for i in [21, 22]:  # total_read_count, mutant_allele_read_count
+			tmp = columns[i].str.replace(" ", "", regex=False)
+			columns[i] = tmp.where(tmp!="", None)
+		return [column.tolist() for column in columns] if as_lists else columns
+	columns[10] = [value.split(" ")[0] for value in columns[10]]
+	columns[16] = [value.replace("_variant", "").replace("_gene", "") for value in columns[16]]
+	for i in [21, 22]:
+		columns[i] = [value.replace(" ", "") or None for value in columns[i]]
+	return columns
+
+
+#########################################
+# rows for the temp table (our id first), from one original file;
+# the ids continue from last_id, and counter[0] keeps the last id given out
+def somatic_rows(path, last_id=0, counter=None):
+	id = last_id
+	for block in somatic_blocks(path):
+		columns = fix_somatic_block(block)
+		ids = range(id+1, id+1+len(columns[0]))
+		id += len(columns[0])
+		if counter is not None: counter[0] = id
+		yield from zip(ids, *columns)
+
+
+#########################################
+# per column, over any number of blocks (and files): the max field length, the number of empty fields
+# (or None), whether all the values are integers (and their range), and the value counts
+# for the enum-like columns - the ones with no more than enum_limit distinct values
+class FieldStats:
+
+	enum_limit = 50
+
+	def __init__(self):
+		self.rows = 0
+		self.max_length = {}
+		self.empty = {}
+		self.integer  = {}  # name -> [min, max], or None if not all values are integers
+		self.distinct = {}  # name -> {value: count}, or None if there are too many different values
+
+	def update(self, block):
+		for name, column in block.items():
+			if pandas is not None and isinstance(column, pandas.Series):
+				values  = column[column.notna() & (column!="")]
+				longest = int(values.str.len().max()) if len(values) else 0
+				is_integer = lambda: bool(values.str.fullmatch(r"-?\d+").all())
+				as_integers = lambda: pandas.to_numeric(values)
+				value_counts = lambda: values.value_counts().to_dict()
+			else:
+				values  = [value for value in column if value]  # not "" and not None
+				longest = max(map(len, values), default=0)
+				is_integer = lambda: all([value.lstrip("-").isdigit() for value in values])
+				as_integers = lambda: list(map(int, values))
+				value_counts = lambda: Counter(values)
+			self.max_length[name] = max(self.max_length.get(name, 0), longest)
+			self.empty[name] = self.empty.get(name, 0) + len(column) - len(values)
+			if len(values)==0:
+				self.integer.setdefault(name, [None, None])
+				self.distinct.setdefault(name, {})
+				continue
+			if self.integer.get(name, [])!=None:
+				if is_integer():
+					ints = as_integers()
+					self.merge_range(name, [int(min(ints)), int(max(ints))])
+				else:
+					self.integer[name] = None
+			if self.distinct.get(name, {})!=None:
+				self.merge_counts(name, value_counts())
+		if block: self.rows += len(next(iter(block.values())))
+
+	def merge_range(self, name, other_range):
+		[lo, hi] = self.integer.get(name, [None, None])
+		[other_lo, other_hi] = other_range
+		if other_lo is not None: lo = other_lo if lo is None else min(lo, other_lo)
+		if other_hi is not None: hi = other_hi if hi is None else max(hi, other_hi)
+		self.integer[name] = [lo, hi]
+
+	def merge_counts(self, name, other_counts):
+		counts = self.distinct.setdefault(name, {})
+		for value, count in other_counts.items():
+			counts[value] = counts.get(value, 0) + int(count)
+		if len(counts)>self.enum_limit: self.distinct[name] = None
+
+	def merge(self, other):
+		self.rows += other.rows
+		for name, longest in other.max_length.items():
+			self.max_length[name] = max(self.max_length.get(name, 0), longest)
+		for name, empty in other.empty.items():
+			self.empty[name] = self.empty.get(name, 0) + empty
+		for name, other_range in other.integer.items():
+			if other_range is None or self.integer.get(name, [])==None:
+				self.integer[name] = None
+			else:
+				self.merge_range(name, other_range)
+		for name, other_counts in other.distinct.items():
+			if other_counts is None or self.distinct.get(name, {})==None:
+				self.distinct[name] = None
+			else:
+				self.merge_counts(name, other_counts)
+
+	# for json
+	def to_dict(self):
+		return {'rows':self.rows, 'max_length':self.max_length, 'empty':self.empty,
+				'integer':self.integer, 'distinct':self.distinct}
+
+	def from_dict(self, stats_dict):
+		self.rows = stats_dict['rows']
+		for field in ['max_length', 'empty', 'integer', 'distinct']:
+			setattr(self, field, dict(stats_dict[field]))
+		return self
+
+
+#########################################
+def somatic_line(id, row):
+	return "\t".join([str(id)] + ["\\N" if value is None else value.replace("\\", "\\\\") for value in row]) + "\n"
+
+
+def write_somatic_block(outfile, columns, last_id):
+	ids = range(last_id+1, last_id+1+len(columns[0]))
+	lines = [somatic_line(id, row) for id, row in zip(ids, zip(*columns))]
+	outfile.writelines(lines)
+	return last_id+len(lines)
+
+
+#########################################
+# sorting by position: the chromosomes in the order 1, 2, ... 22, X, Y, MT, and then whatever else
+chromosome_rank = {'X':23, 'Y':24, 'MT':25}
+
+def chromosome_key(chromosome):
+	if chromosome.isdigit(): return (int(chromosome), "")
+	return (chromosome_rank.get(chromosome, 26), chromosome)
+
+
+# for the fixed rows (without our id): chromosome and chromosome_start
+def position_key(row):
+	return (chromosome_key(row[5]), int(row[6] or 0))
+
+
+#########################################
+# the fixed rows (without our id) from a set of files, with the statistics on the way
+def fixed_somatic_rows(paths, stats=None):
+	for path in paths:
+		for block in somatic_blocks(path):
+			if stats is not None: stats.update(block)
+			yield from zip(*fix_somatic_block(block))
+
+
+#########################################
+# the rows for the temp table from a set of files, sorted by (chromosome, start_position), and
+# the ids given out in that order - the position indices and the per-chromosome stages then read the
+# table sequentially; the sort runs (run_rows at a time, see external_sort.py) go to tmpdir
+def position_sorted_rows(paths, last_id=0, stats=None, run_rows=500000, tmpdir=None):
+	sorted_rows = external_sort(fixed_somatic_rows(paths, stats), position_key, run_rows, tmpdir)
+	for id, row in enumerate(sorted_rows, last_id+1):
+		yield [id] + list(row)
+
+
+#########################################
+# one pass through the file: the field statistics (on the fields as they are in the file), and/or
+# the fixed rows for the temp table written to outfile; returns the last id written
+# table_stats: the statistics on the fixed fields, by the temp table column names
+def scan_somatic_file(path, stats=None, outfile=None, last_id=0, columns=None, table_stats=None):
+	if columns is None: columns = somatic_fields
+	for block in somatic_blocks(path, columns):
+		if stats is not None: stats.update(block)
+		if table_stats is None and outfile is None: continue
+		fixed = fix_somatic_block(block, as_lists=False)
+		if table_stats is not None: table_stats.update(dict(zip(temp_table_columns[1:], fixed)))
+		if outfile is not None:
+			last_id = write_somatic_block(outfile, [list(column) for column in fixed], last_id)
+	return last_id